@@ -0,0 +1,65 @@
+"""Benchmark the vectorized /convert path at 10k instants x 500 cities.
+
+Run from the repository root:
+
+    python benchmarks/bench_convert.py [--instants 10000] [--cities 500]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dst_transitions import compile_city_transitions
+from time_convert import OffsetArrays, convert_times, instant_range
+
+def build_tables(count: int) -> list:
+    zones = pytz.common_timezones
+    return [
+        compile_city_transitions({'city': f'City {i}', 'timezone': zones[i % len(zones)], 'utc_offset': '+00:00'})
+        for i in range(count)
+    ]
+
+def timed(fn, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--instants', type=int, default=10000)
+    parser.add_argument('--cities', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tables = build_tables(args.cities)
+    start = int(datetime(2025, 1, 1, tzinfo=pytz.UTC).timestamp())
+    instants = instant_range(start, start + (args.instants - 1) * 3600, 3600)
+    cells = len(instants) * len(tables)
+
+    pack_time, arrays = timed(lambda: OffsetArrays(tables), args.repeat)
+    lookup_time, _ = timed(lambda: arrays.lookup(instants), args.repeat)
+    total_time, _ = timed(lambda: convert_times(instants, arrays), args.repeat)
+
+    # Scalar baseline: one bisect per cell, measured on a sample and scaled
+    sample = instants[:max(1, 100000 // len(tables))]
+    scalar_time, _ = timed(
+        lambda: [table.lookup(int(epoch)) for epoch in sample for table in tables], 1
+    )
+    scalar_per_cell = scalar_time / (len(sample) * len(tables))
+
+    print(f"{len(instants)} instants x {len(tables)} cities = {cells:,} cells")
+    print(f"  pack offset arrays     {pack_time * 1e3:9.2f} ms")
+    print(f"  vectorized lookup      {lookup_time * 1e3:9.2f} ms  ({lookup_time / cells * 1e9:6.1f} ns/cell)")
+    print(f"  lookup + formatting    {total_time * 1e3:9.2f} ms  ({total_time / cells * 1e9:6.1f} ns/cell)")
+    print(f"  scalar bisect baseline {scalar_per_cell * cells * 1e3:9.2f} ms  ({scalar_per_cell * 1e9:6.1f} ns/cell, extrapolated)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Benchmark fuzzy /search against the linear scan it replaces.
+
+Cities are the real entries in locations.json padded out with generated
+names (some accented) to the requested sizes. For each size it times:
+
+    linear   startswith over every city, as /search did before the index
+    prefix   PrefixIndex, the default /search mode
+    fuzzy    TrigramIndex, /search?fuzzy=true
+    scan     the same fuzzy match without the trigram index, i.e. an edit
+             distance check against every name
+
+and reports, per query set, microseconds per query and how many queries
+found their intended city. Run from the repository root:
+
+    python benchmarks/bench_search.py [--sizes 1000,10000,100000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SEARCH_FIELDS, PrefixIndex, TrigramIndex, normalize, prefix_distance
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'no', 'sa', 'te', 'vi', 'do', 'ber', 'gan', 'tor', 'lin', 'mar', 'sk',
+             'ą', 'ö', 'é', 'ñ', 'ł', 'ü', 'ç']
+
+# (query, city it should find)
+QUERIES = {
+    'exact': [('London', 'London'), ('Melbourne', 'Melbourne'), ('Kathmandu', 'Kathmandu')],
+    'accent': [('gdansk', 'Gdańsk'), ('malmo', 'Malmö'), ('lodz', 'Łódź'), ('bogota', 'Bogotá')],
+    'typo': [('londn', 'London'), ('melborne', 'Melbourne'), ('tmisoara', 'Timișoara'), ('reykjavk', 'Reykjavík')],
+}
+
+def generated_name(rng: random.Random) -> str:
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+def build_cities(size: int) -> dict:
+    with open(os.path.join(ROOT, 'locations.json'), encoding='utf-8') as f:
+        real = json.load(f)['locations']
+    cities = {city['city']: city for city in real}
+    rng = random.Random(size)
+    while len(cities) < size:
+        name = f'{generated_name(rng)} {generated_name(rng)}'
+        cities[name] = {'city': name, 'state': generated_name(rng), 'country': generated_name(rng)}
+    return cities
+
+def linear_search(cities: dict, query: str, limit: int = 5) -> list:
+    query = query.lower().strip()
+    matches = []
+    for key, city in cities.items():
+        if any((city.get(field) or '').lower().strip().startswith(query) for field in SEARCH_FIELDS):
+            matches.append(key)
+            if len(matches) >= limit:
+                break
+    return matches
+
+def scan_search(cities: dict, query: str, limit: int = 5) -> list:
+    query = normalize(query)
+    max_edits = 1 if len(query) <= 5 else 2
+    scored = []
+    for key, city in cities.items():
+        edits = min(prefix_distance(query, normalize(city.get(field)), max_edits) for field in SEARCH_FIELDS)
+        if edits <= max_edits:
+            scored.append((edits, key))
+    return [key for _, key in sorted(scored)[:limit]]
+
+def timed(fn, queries: list, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [fn(query) for query, _ in queries]
+        best = min(best, time.perf_counter() - start)
+    found = sum(expected in result for (_, expected), result in zip(queries, results))
+    return best / len(queries) * 1e6, found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=lambda value: [int(n) for n in value.split(',')], default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'cities':>8} {'queries':>8} {'method':>8} {'us/query':>10} {'found':>6}")
+    for size in args.sizes:
+        cities = build_cities(size)
+        start = time.perf_counter()
+        prefix = PrefixIndex()
+        prefix.build(cities)
+        prefix_build = time.perf_counter() - start
+        start = time.perf_counter()
+        fuzzy = TrigramIndex()
+        fuzzy.build(cities)
+        fuzzy_build = time.perf_counter() - start
+        print(f"{size:>8} build: prefix {prefix_build * 1000:.0f} ms, fuzzy {fuzzy_build * 1000:.0f} ms")
+
+        methods = {
+            'linear': lambda query: linear_search(cities, query),
+            'prefix': prefix.search,
+            'fuzzy': fuzzy.search,
+            'scan': lambda query: scan_search(cities, query),
+        }
+        for kind, queries in QUERIES.items():
+            for method, fn in methods.items():
+                # The full fuzzy scan is slow enough to run only once
+                per_query, found = timed(fn, queries, 1 if method == 'scan' else args.repeat)
+                print(f"{size:>8} {kind:>8} {method:>8} {per_query:>10,.1f} {found:>4}/{len(queries)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark Redis calls under bursts of identical /location requests.
+
+Runs the app in-process against fakeredis (pip install fakeredis) with no
+snapshot loaded, so every response-cache miss costs a Redis round trip.
+Each round moves the clock to the next minute, expiring the cached entry,
+and fires a burst of concurrent requests for the same city, with request
+coalescing on and off. Failed requests are 503s from the Redis circuit
+breaker tripping on call deadlines. Run from the repository root
+(redis_manager still needs the usual .env at import):
+
+    python benchmarks/bench_singleflight.py [--bursts 1,10,100,1000] [--rounds 20]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import fakeredis
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+import redis_manager
+from clock import ClockService, FakeClock, set_clock
+
+CITY = {
+    'id': 'london', 'city': 'London', 'state': 'England', 'country': 'United Kingdom',
+    'timezone': 'Europe/London', 'coordinates': '51.5074, -0.1278', 'utc_offset': '+00:00',
+    'dst_status': 'Yes', 'currency': 'GBP', 'languages_spoken': 'English', 'country_code': 'GB',
+    'national_holidays': '', 'details': '',
+}
+
+async def run_round(client, fake_clock, burst: int):
+    # Step into the next minute so the cached entry has expired
+    fake_clock.advance(60)
+    responses = await asyncio.gather(*(client.get('/location/London') for _ in range(burst)))
+    return sum(response.status_code != 200 for response in responses)
+
+async def measure(client, fake_clock, burst: int, rounds: int, coalesce: bool):
+    main.location_flight.enabled = coalesce
+    breaker = redis_manager.redis_breaker
+    breaker.reset()
+    calls = breaker.calls
+    failed = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        failed += await run_round(client, fake_clock, burst)
+    elapsed = time.perf_counter() - started
+    calls = breaker.calls - calls
+    return burst * rounds / elapsed, calls / elapsed, calls / rounds, failed
+
+async def run(args):
+    redis_manager.redis_client = fakeredis.FakeAsyncRedis()
+    await redis_manager.update_city(CITY['id'], CITY, bump_version=False)
+    fake_clock = FakeClock(time.time())
+    set_clock(ClockService(fake_clock))
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        print(f"{'burst':>6} {'coalescing':>10} {'requests/s':>12} {'redis calls/s':>14} {'calls/burst':>12} {'failed':>7}")
+        for burst in args.bursts:
+            for coalesce in (True, False):
+                rate, redis_rate, per_burst, failed = await measure(client, fake_clock, burst, args.rounds, coalesce)
+                print(f"{burst:>6} {'on' if coalesce else 'off':>10} {rate:>12,.0f} {redis_rate:>14,.0f} "
+                      f"{per_burst:>12.1f} {failed:>7}")
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bursts', type=lambda value: [int(n) for n in value.split(',')], default=[1, 10, 100, 1000])
+    parser.add_argument('--rounds', type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main_()
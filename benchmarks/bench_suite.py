@@ -0,0 +1,283 @@
+"""Benchmark the API and sync paths and compare runs against a JSON baseline.
+
+Runs the app in-process against fakeredis (pip install fakeredis), or a real
+Redis with --redis-url (its database is FLUSHED). Cities are the entries in
+locations.json, repeated with numbered names up to each size, with a
+timezone and coordinates assigned deterministically; every tenth city gets
+the DST override in dst_offsets_rows.csv. For each size it measures:
+
+    sync            sync_supabase_to_redis from an in-memory paginated source
+    get_all_cities  a full read of every city from Redis
+    calculate_time  calculate_city_time with precompiled transitions
+    location_redis  GET /location with no snapshot loaded (Redis per miss)
+    location        GET /location served from the snapshot
+    search          GET /search with 3-6 character prefixes
+    search_fuzzy    GET /search?fuzzy=true with one typo per query
+
+and reports operations per second, p50/p99 latency and Redis round trips
+(commands or pipelines sent) per operation. Requests pick cities uniformly
+at random from a fixed seed, so runs are repeatable. Each benchmark but
+sync and get_all_cities runs --rounds times from the same cache state and
+keeps its fastest round, which filters out most machine noise. Run from the
+repository root (redis_manager still needs the usual .env at import):
+
+    python benchmarks/bench_suite.py --save baseline.json
+    python benchmarks/bench_suite.py --compare baseline.json [--save current.json]
+    python benchmarks/bench_suite.py --results current.json --compare baseline.json
+
+--compare exits with status 1 if any metric regressed by more than
+--tolerance (latency and throughput), or Redis round trips per operation
+went up. Compare runs made on the same machine with the same options.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import fakeredis
+import httpx
+import pytz
+from redis.asyncio import Redis
+from redis.asyncio.connection import AbstractConnection
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import city_cache
+import main
+import redis_manager
+import response_cache
+from routes.time_routes import calculate_city_time
+from sync_sources import InMemorySource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Metrics where a larger value is a regression
+LOWER_IS_BETTER = ('p50_ms', 'p99_ms', 'redis_calls')
+
+class RoundTrips:
+    """Count commands and pipelines sent to Redis, on any connection."""
+
+    def __init__(self):
+        self.count = 0
+        send = AbstractConnection.send_packed_command
+        counter = self
+
+        async def counted(connection, command, check_health=True):
+            counter.count += 1
+            return await send(connection, command, check_health)
+
+        AbstractConnection.send_packed_command = counted
+
+def build_rows(size: int):
+    """City and dst_offsets rows for a dataset of `size` cities."""
+    with open(os.path.join(ROOT, 'locations.json'), encoding='utf-8') as f:
+        locations = json.load(f)['locations']
+    with open(os.path.join(ROOT, 'dst_offsets_rows.csv'), encoding='utf-8', newline='') as f:
+        dst_template = next(csv.DictReader(f))
+    rng = random.Random(size)
+    zones = pytz.common_timezones
+    stamp = '2025-01-22T10:00:00+00:00'
+    cities, dst_offsets = [], []
+    for i in range(size):
+        location = locations[i % len(locations)]
+        copy = i // len(locations)
+        name = location['city'] if copy == 0 else f"{location['city']} {copy}"
+        cities.append({
+            'id': i + 1, 'city': name, 'state': location['state'], 'country': location['country'],
+            'timezone': zones[rng.randrange(len(zones))],
+            'coordinates': f'{rng.uniform(-80, 80):.4f}, {rng.uniform(-180, 180):.4f}',
+            'utc_offset': '+00:00', 'dst_status': 'No', 'currency': '', 'languages_spoken': '',
+            'country_code': '', 'national_holidays': '', 'details': '',
+            'created_at': stamp, 'updated_at': stamp, 'deleted_at': None,
+        })
+        if i % 10 == 0:
+            dst_offsets.append({**dst_template, 'id': len(dst_offsets) + 1, 'city': name, 'updated_at': stamp})
+    return cities, dst_offsets
+
+def summarize(latencies: list, elapsed: float, round_trips: int) -> dict:
+    latencies = sorted(latencies)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    return {
+        'ops': len(latencies),
+        'ops_per_s': len(latencies) / elapsed,
+        'p50_ms': pick(0.50),
+        'p99_ms': pick(0.99),
+        'redis_calls': round_trips / len(latencies),
+    }
+
+async def measure(fn, args_list: list, concurrency: int, trips: RoundTrips, rounds: int = 1, setup=None) -> dict:
+    """Await fn(*args) for every entry of args_list, `concurrency` at a time.
+
+    Repeats the whole list `rounds` times, calling setup() before each so
+    every round starts from the same state, and keeps the fastest round.
+    """
+    best = None
+    for _ in range(rounds):
+        if setup:
+            await setup()
+        pending = iter(args_list)
+        latencies = []
+
+        async def worker():
+            for args in pending:
+                start = time.perf_counter()
+                await fn(*args)
+                latencies.append(time.perf_counter() - start)
+
+        trips_before = trips.count
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        result = summarize(latencies, time.perf_counter() - start, trips.count - trips_before)
+        if best is None or result['ops_per_s'] > best['ops_per_s']:
+            best = result
+    return best
+
+async def request(client, path: str, params: dict = None):
+    response = await client.get(path, params=params)
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {path} {params or ''} returned {response.status_code}")
+
+def typo(rng: random.Random, name: str) -> str:
+    i = rng.randrange(1, len(name))
+    return name[:i] + name[i + 1:]
+
+def reset_caches():
+    response_cache._cache = response_cache.ResponseCache()
+    city_cache._snapshot = city_cache.CitySnapshot()
+
+async def fresh_snapshot():
+    """Start from a loaded snapshot and an empty response cache."""
+    reset_caches()
+    await city_cache.load_snapshot()
+
+async def no_snapshot():
+    reset_caches()
+
+async def run_size(size: int, args, trips: RoundTrips) -> dict:
+    await redis_manager.redis_client.flushdb()
+    reset_caches()
+    cities, dst_offsets = build_rows(size)
+    source = InMemorySource({'cities': cities, 'dst_offsets': dst_offsets})
+    rng = random.Random(size)
+    names = [rng.choice(cities)['city'] for _ in range(args.requests)]
+    results = {}
+
+    # The first sync also seeds Redis for everything after it
+    results['sync'] = await measure(redis_manager.sync_supabase_to_redis, [(True, source)] * args.repeat, 1, trips)
+    results['get_all_cities'] = await measure(redis_manager.get_all_cities, [()] * args.repeat, 1, trips)
+
+    snapshot = await city_cache.load_snapshot()
+    utc_now = datetime.now(timezone.utc)
+    calls = [(snapshot.get_city(name), utc_now, snapshot.get_transitions(name)) for name in names]
+
+    async def calculate(city, now, transitions):
+        calculate_city_time(city, now, transitions)
+
+    results['calculate_time'] = await measure(calculate, calls, 1, trips, args.rounds)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        paths = [(client, f'/location/{name}') for name in names]
+        results['location_redis'] = await measure(request, paths, args.concurrency, trips, args.rounds, no_snapshot)
+        results['location'] = await measure(request, paths, args.concurrency, trips, args.rounds, fresh_snapshot)
+
+        queries = [(client, '/search', {'query': name[:rng.randint(3, 6)]}) for name in names]
+        results['search'] = await measure(request, queries, args.concurrency, trips, args.rounds, fresh_snapshot)
+        fuzzy = [(client, '/search', {'query': typo(rng, name), 'fuzzy': 'true'}) for name in names if len(name) > 4]
+        results['search_fuzzy'] = await measure(request, fuzzy, args.concurrency, trips, args.rounds, fresh_snapshot)
+    return results
+
+async def run(args) -> dict:
+    if args.redis_url:
+        redis_manager.redis_client = Redis.from_url(args.redis_url)
+    else:
+        redis_manager.redis_client = fakeredis.FakeAsyncRedis()
+    trips = RoundTrips()
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = await run_size(size, args, trips)
+        print_results({str(size): results[str(size)]})
+    return {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'redis': args.redis_url or 'fakeredis',
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'repeat': args.repeat,
+            'rounds': args.rounds,
+        },
+        'results': results,
+    }
+
+def print_results(results: dict):
+    for size, benchmarks in results.items():
+        for name, row in benchmarks.items():
+            print(f"{size:>8} {name:<15} {row['ops_per_s']:>12,.1f}/s  p50 {row['p50_ms']:>9.3f} ms  "
+                  f"p99 {row['p99_ms']:>9.3f} ms  redis {row['redis_calls']:>7.2f}/op")
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Print each metric next to its baseline and return the regressions."""
+    regressions = []
+    print(f"\n{'cities':>8} {'benchmark':<15} {'metric':<10} {'baseline':>12} {'current':>12} {'change':>8}")
+    for size, benchmarks in current['results'].items():
+        for name, row in benchmarks.items():
+            base = baseline['results'].get(size, {}).get(name)
+            if not base:
+                continue
+            for metric in ('ops_per_s', 'p50_ms', 'p99_ms', 'redis_calls'):
+                old, new = base[metric], row[metric]
+                change = (new - old) / old if old else 0.0
+                if metric == 'redis_calls':
+                    # Round trips are deterministic, so any increase counts
+                    regressed = new > old + 0.01
+                elif metric in LOWER_IS_BETTER:
+                    regressed = change > tolerance
+                else:
+                    regressed = change < -tolerance
+                if regressed:
+                    regressions.append((size, name, metric, old, new))
+                print(f"{size:>8} {name:<15} {metric:<10} {old:>12,.3f} {new:>12,.3f} {change:>+7.0%}"
+                      f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=lambda value: [int(n) for n in value.split(',')], default=[1000, 10000, 100000])
+    parser.add_argument('--requests', type=int, default=2000, help="requests per HTTP benchmark")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3, help="runs of sync and get_all_cities")
+    parser.add_argument('--rounds', type=int, default=3, help="rounds of the other benchmarks; the fastest is kept")
+    parser.add_argument('--redis-url', help="use this Redis instead of fakeredis; its database is flushed")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--results', help="compare this results file instead of running the benchmarks")
+    parser.add_argument('--compare', help="baseline JSON file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative slowdown (default 0.25)")
+    args = parser.parse_args()
+
+    if args.results:
+        with open(args.results, encoding='utf-8') as f:
+            current = json.load(f)
+    else:
+        # Per-request log lines would dominate the timings
+        logging.disable(logging.INFO)
+        current = asyncio.run(run(args))
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        print(f"\n{len(regressions)} regressions" if regressions else "\nNo regressions")
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,87 @@
+"""Compare Redis memory of the previous and the compact city layouts.
+
+Loads the cities in locations.json (with the remaining columns filled in
+with values of typical length) into fakeredis (pip install fakeredis) in
+the previous layout, migrates them with migrate_keyspace.py, drops the
+legacy keys and prints the memory report at each step. --scale repeats the
+dataset with numbered names to see how each layout grows. Run from the
+repository root (redis_manager still needs the usual .env at import):
+
+    python benchmarks/keyspace_memory.py [--scale 1]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import fakeredis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrate_keyspace
+import redis_manager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_cities(scale: int) -> list:
+    with open(os.path.join(ROOT, 'locations.json'), encoding='utf-8') as f:
+        locations = json.load(f)['locations']
+    cities = []
+    for copy in range(scale):
+        for location in locations:
+            name = location['city'] if copy == 0 else f"{location['city']} {copy}"
+            cities.append({
+                'id': len(cities) + 1, 'city': name, 'state': location['state'], 'country': location['country'],
+                'timezone': 'America/Argentina/Buenos_Aires', 'coordinates': '-34.6037° S, 58.3816° W',
+                'utc_offset': '-03:00', 'dst_status': 'No', 'currency': 'Argentine peso (ARS)',
+                'languages_spoken': 'Spanish', 'country_code': 'AR', 'national_holidays': 'January 1, May 25, July 9',
+                'details': 'Capital and largest city, on the western shore of the Río de la Plata.',
+                'created_at': '2025-01-22T10:00:00+00:00', 'updated_at': '2025-01-22T10:00:00+00:00',
+                'deleted_at': None,
+            })
+    return cities
+
+async def write_legacy_layout(cities: list):
+    """Write cities the way the sync did before the compact layout."""
+    client = redis_manager.redis_client
+    async with client.pipeline(transaction=False) as pipe:
+        for city in cities:
+            city_json = json.dumps(city, ensure_ascii=False)
+            pipe.hset('cities', city['city'], city_json)
+            pipe.hset('cities:data', city['id'], city_json)
+            name = city['city'].lower()
+            pipe.sadd(f'cities:name:{name}', city['id'])
+            pipe.sadd(f'cities:country:{city["country"].lower()}', city['id'])
+            for i in range(1, len(name)):
+                pipe.sadd(f'cities:prefix:{name[:i]}', city['id'])
+        await pipe.execute()
+
+async def run(args):
+    redis_manager.redis_client = migrate_keyspace.redis_client = fakeredis.FakeAsyncRedis()
+    cities = load_cities(args.scale)
+    await write_legacy_layout(cities)
+    print(f"{len(cities)} cities")
+    migrate_keyspace.print_report("Previous layout:", await migrate_keyspace.memory_report())
+
+    start = time.perf_counter()
+    migrated = await migrate_keyspace.migrate()
+    print(f"Migrated {migrated} cities in {time.perf_counter() - start:.2f} s")
+    migrate_keyspace.print_report("Both layouts:", await migrate_keyspace.memory_report())
+
+    await migrate_keyspace.drop_legacy_keys()
+    migrate_keyspace.print_report("Compact layout:", await migrate_keyspace.memory_report())
+
+    # The migrated data must read back exactly as written
+    _, loaded, _ = await redis_manager.load_city_tables()
+    assert loaded == {city['city']: city for city in cities}, "migrated cities differ"
+    print(f"Prefix 'san': {[city['city'] for city in await redis_manager.search_cities_by_prefix('san')]}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
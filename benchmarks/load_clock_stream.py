@@ -0,0 +1,141 @@
+"""Load test /stream/clock with many concurrent SSE subscribers.
+
+Start one server worker, then run from the repository root:
+
+    python benchmarks/load_clock_stream.py --url http://127.0.0.1:8000 \\
+        --subscribers 10000 --cities London,Tokyo,Sydney --duration 30
+
+Each subscriber follows a random sample of the given cities at per-second
+resolution. Reports how many subscribers stayed connected, frames received
+and the delivery lag (receive time minus the frame's tick epoch, so run the
+client on the same host as the server).
+"""
+import argparse
+import asyncio
+import random
+import resource
+import statistics
+import time
+from urllib.parse import urlencode, urlsplit
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.disconnected = 0
+        self.frames = 0
+        self.lags = []
+
+async def connect(host: str, port: int, path: str, gate: asyncio.Semaphore):
+    async with gate:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+        status = await reader.readline()
+        if b' 200 ' not in status:
+            writer.close()
+            raise ConnectionError(status.decode().strip())
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        return reader, writer
+
+async def drain(reader):
+    """Discard what was sent while the other subscribers were connecting."""
+    while True:
+        try:
+            await asyncio.wait_for(reader.read(65536), 0.01)
+        except asyncio.TimeoutError:
+            return
+
+async def consume(reader, writer, stats: Stats, deadline: float):
+    buffer = b''
+    try:
+        while time.time() < deadline:
+            chunk = await asyncio.wait_for(reader.read(65536), deadline - time.time())
+            if not chunk:
+                stats.disconnected += 1
+                return
+            # Count complete events; only the newest one is parsed for lag
+            buffer += chunk
+            end = buffer.rfind(b'\n\n')
+            if end == -1:
+                continue
+            events, buffer = buffer[:end], buffer[end + 2:]
+            stats.frames += events.count(b'"event":"tick"')
+            start = events.rfind(b'"epoch":')
+            if start != -1:
+                stats.lags.append(time.time() - int(events[start + 8:events.index(b',', start)]))
+    except asyncio.TimeoutError:
+        pass
+    except OSError:
+        stats.disconnected += 1
+    finally:
+        writer.close()
+
+def percentile(values: list, fraction: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+async def run(args):
+    url = urlsplit(args.url)
+    cities = [city.strip() for city in args.cities.split(',') if city.strip()]
+    stats = Stats()
+    gate = asyncio.Semaphore(args.connect_concurrency)
+
+    requests = []
+    for _ in range(args.subscribers):
+        sample = random.sample(cities, min(args.per_client, len(cities)))
+        path = '/stream/clock?' + urlencode([('cities', city) for city in sample])
+        requests.append(connect(url.hostname, url.port or 80, path, gate))
+
+    # Connect everyone first, then measure the steady state only
+    started = time.time()
+    connections = []
+    for result in await asyncio.gather(*requests, return_exceptions=True):
+        if isinstance(result, BaseException):
+            stats.failed += 1
+        else:
+            connections.append(result)
+    stats.connected = len(connections)
+    print(f"connected {stats.connected} subscribers in {time.time() - started:.1f}s")
+    await asyncio.gather(*(drain(reader) for reader, _ in connections))
+
+    started = time.time()
+    deadline = started + args.duration
+    await asyncio.gather(*(consume(reader, writer, stats, deadline) for reader, writer in connections))
+    elapsed = time.time() - started
+
+    print(f"{args.subscribers} subscribers, {args.duration:.0f}s against {args.url}")
+    print(f"  connected      {stats.connected}")
+    print(f"  failed         {stats.failed}")
+    print(f"  disconnected   {stats.disconnected}")
+    print(f"  frames         {stats.frames:,} ({stats.frames / elapsed:,.0f}/s)")
+    if stats.lags:
+        lags = [lag * 1e3 for lag in stats.lags]
+        print(f"  lag p50        {statistics.median(lags):8.1f} ms")
+        print(f"  lag p99        {percentile(lags, 0.99):8.1f} ms")
+        print(f"  lag max        {max(lags):8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--subscribers', type=int, default=10000)
+    parser.add_argument('--cities', default='London')
+    parser.add_argument('--per-client', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--connect-concurrency', type=int, default=500)
+    args = parser.parse_args()
+
+    # One socket per subscriber
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if args.subscribers + 100 > hard:
+        print(f"warning: open file limit {hard} is below {args.subscribers} subscribers")
+
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(run(args))
+    else:
+        uvloop.run(run(args))
+
+if __name__ == '__main__':
+    main()
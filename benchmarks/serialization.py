@@ -0,0 +1,190 @@
+"""Compare per-request CPU and memory of the Pydantic and pre-encoded response paths.
+
+Builds a city snapshot in-process (no Redis) from the entries in
+locations.json, repeated with numbered names up to --size like
+bench_suite.py, and encodes the same responses both ways:
+
+    location   one /location body: calculate_city_time + model_dump_json,
+               against CityEncoding.location
+    locations  a /locations body of --batch cities: a ComparisonResponse
+               through FastAPI's jsonable_encoder and JSONResponse,
+               against join_bodies of encoded bodies
+    nearest    the same for NearestResponse, with distance_km
+    search     five search results: dicts through json.dumps, against
+               joined CityEncoding.search_result fragments
+
+Both paths must produce equal JSON; the script stops if they do not. For
+each it reports CPU microseconds per operation (process time, fastest of
+--rounds) and the peak memory traced while building one response, which
+tracks the transient objects each path allocates. It also reports what
+encoding every city once costs, which the fast path pays once per
+snapshot. Run from the repository root (redis_manager still needs the
+usual .env at import):
+
+    python benchmarks/serialization.py [--size 10000] [--save results.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_suite import build_rows
+from city_cache import CitySnapshot
+from dst_transitions import compile_transitions
+from location_encoding import CityEncoding, city_encoding, join_bodies, location_body
+from models.location import ComparisonResponse, NearestCity, NearestResponse
+from routes.time_routes import calculate_city_time
+
+def build_snapshot(size: int) -> CitySnapshot:
+    city_rows, dst_rows = build_rows(size)
+    cities = {city['city']: city for city in city_rows}
+    dst_offsets = {row['city']: row for row in dst_rows}
+    return CitySnapshot(None, cities, dst_offsets, compile_transitions(cities, dst_offsets), loaded=True)
+
+def with_dst(snapshot: CitySnapshot, name: str) -> dict:
+    city_data = snapshot.get_city(name)
+    dst_data = snapshot.get_dst(name)
+    return {**city_data, 'dst_data': dst_data} if dst_data else city_data
+
+def pydantic_paths(snapshot: CitySnapshot, now: datetime) -> dict:
+    def location(names):
+        name = names[0]
+        return calculate_city_time(with_dst(snapshot, name), now, snapshot.get_transitions(name)).model_dump_json().encode('utf-8')
+
+    def locations(names):
+        results = [calculate_city_time(with_dst(snapshot, name), now, snapshot.get_transitions(name)) for name in names]
+        return JSONResponse(jsonable_encoder(ComparisonResponse(cities=results))).body
+
+    def nearest(names):
+        results = []
+        for i, name in enumerate(names[:5]):
+            time_info = calculate_city_time(with_dst(snapshot, name), now, snapshot.get_transitions(name))
+            results.append(NearestCity(**time_info.model_dump(), distance_km=round(i * 123.456, 1)))
+        return JSONResponse(jsonable_encoder(NearestResponse(cities=results))).body
+
+    def search(names):
+        matches = []
+        for name in names[:5]:
+            city = snapshot.get_city(name)
+            matches.append({
+                'id': city.get('id', ''), 'city': city['city'], 'state': city.get('state', ''),
+                'country': city['country'], 'timezone': city['timezone'], 'coordinates': city['coordinates'],
+            })
+        return json.dumps(matches, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    return {'location': location, 'locations': locations, 'nearest': nearest, 'search': search}
+
+def encoded_paths(snapshot: CitySnapshot, now: datetime) -> dict:
+    epoch = now.timestamp()
+
+    def location(names):
+        name = names[0]
+        return location_body(city_encoding(snapshot, name), snapshot.get_transitions(name), epoch)
+
+    def locations(names):
+        return join_bodies(
+            location_body(city_encoding(snapshot, name), snapshot.get_transitions(name), epoch) for name in names
+        )
+
+    def nearest(names):
+        bodies = []
+        for i, name in enumerate(names[:5]):
+            body = location_body(city_encoding(snapshot, name), snapshot.get_transitions(name), epoch)
+            bodies.append(body[:-1] + b',"distance_km":' + repr(round(i * 123.456, 1)).encode('ascii') + b'}')
+        return join_bodies(bodies)
+
+    def search(names):
+        return b'[' + b','.join(city_encoding(snapshot, name).search_result for name in names[:5]) + b']'
+
+    return {'location': location, 'locations': locations, 'nearest': nearest, 'search': search}
+
+def cpu_per_op(fn, batches: list, rounds: int) -> float:
+    best = None
+    for _ in range(rounds):
+        start = time.process_time()
+        for names in batches:
+            fn(names)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(batches) * 1e6
+
+def peak_bytes_per_op(fn, batches: list) -> float:
+    total = 0
+    tracemalloc.start()
+    for names in batches:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        body = fn(names)
+        total += tracemalloc.get_traced_memory()[1] - base - sys.getsizeof(body)
+        del body
+    tracemalloc.stop()
+    return total / len(batches)
+
+def run(args) -> dict:
+    snapshot = build_snapshot(args.size)
+    names = list(snapshot.cities)
+    rng = random.Random(args.size)
+    batches = [rng.sample(names, args.batch) for _ in range(args.requests)]
+    now = datetime.now(timezone.utc)
+
+    start = time.process_time()
+    for name in names:
+        CityEncoding(snapshot.get_city(name))
+    encode_all = time.process_time() - start
+    # Fill the per-snapshot encodings, as requests would once per sync
+    for name in names:
+        city_encoding(snapshot, name)
+
+    slow, fast = pydantic_paths(snapshot, now), encoded_paths(snapshot, now)
+    results = {'encode_all_ms': encode_all * 1e3, 'benchmarks': {}}
+    for name in slow:
+        for names_ in batches[:20]:
+            if json.loads(slow[name](names_)) != json.loads(fast[name](names_)):
+                sys.exit(f"{name}: the encoded body differs from the Pydantic one for {names_}")
+        row = {}
+        for label, paths in (('pydantic', slow), ('encoded', fast)):
+            row[label] = {
+                'cpu_us': cpu_per_op(paths[name], batches, args.rounds),
+                'peak_bytes': peak_bytes_per_op(paths[name], batches[:args.alloc_requests]),
+            }
+        results['benchmarks'][name] = row
+    return results
+
+def print_results(results: dict, args):
+    print(f"{args.size} cities; encoding all of them once: {results['encode_all_ms']:.1f} ms")
+    print(f"{'benchmark':<10} {'path':<9} {'cpu us/op':>10} {'peak bytes/op':>14}")
+    for name, row in results['benchmarks'].items():
+        for label in ('pydantic', 'encoded'):
+            print(f"{name:<10} {label:<9} {row[label]['cpu_us']:>10.1f} {row[label]['peak_bytes']:>14,.0f}")
+        slow, fast = row['pydantic'], row['encoded']
+        print(f"{'':<10} {'saved':<9} {1 - fast['cpu_us'] / slow['cpu_us']:>10.0%} "
+              f"{1 - fast['peak_bytes'] / slow['peak_bytes']:>14.0%}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=2000, help="operations per benchmark and round")
+    parser.add_argument('--batch', type=int, default=20, help="cities per /locations body")
+    parser.add_argument('--rounds', type=int, default=3, help="CPU timing rounds; the fastest is kept")
+    parser.add_argument('--alloc-requests', type=int, default=200, help="operations traced for memory")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results, args)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import os
+import asyncio
+import logging
+from redis_manager import get_data_version, load_city_tables
+from resilience import CircuitOpenError
+from search_index import PrefixIndex, TrigramIndex
+from geo_index import GeoIndex
+from dst_transitions import compile_transitions
+from response_cache import get_response_cache
+from singleflight import SingleFlight
+from snapshot_file import (
+    SNAPSHOT_FILE, MappedPrefixIndex, MappedTrigramIndex, open_snapshot_file, snapshot_file_changed
+)
+
+# How often (in seconds) workers poll the data version key for changes
+SNAPSHOT_REFRESH_INTERVAL = float(os.getenv('SNAPSHOT_REFRESH_INTERVAL', 5))
+# Serve only from SNAPSHOT_FILE, remapping it whenever it is replaced, so
+# the workers of a host share one copy of the data (set by main.py for
+# WORKERS > 1); Redis is read only until the file first appears
+SHARED_SNAPSHOT = os.getenv('SHARED_SNAPSHOT', '').lower() in ('1', 'true', 'yes')
+
+class CitySnapshot:
+    """Immutable, in-process copy of the cities and dst_offsets tables.
+
+    A snapshot is never modified after it is built; refreshing swaps in a new
+    object, so readers can use it without locks or Redis round trips.
+    """
+
+    # Loaded from Redis, as opposed to a snapshot_file.MappedSnapshot
+    source = 'redis'
+
+    __slots__ = ('version', 'cities', 'dst_offsets', 'transitions', 'loaded', 'encodings')
+
+    def __init__(self, version=None, cities=None, dst_offsets=None, transitions=None, loaded=False):
+        self.version = version
+        self.cities = cities or {}
+        self.dst_offsets = dst_offsets or {}
+        self.transitions = transitions or {}
+        self.loaded = loaded
+        # city name -> CityEncoding, filled in by location_encoding.city_encoding
+        self.encodings = {}
+
+    def get_city(self, city_name: str):
+        """Get city data by name, or None if the city is unknown."""
+        return self.cities.get(city_name)
+
+    def get_dst(self, city_name: str):
+        """Get DST data by city name, or None if the city has no DST entry."""
+        return self.dst_offsets.get(city_name)
+
+    def get_transitions(self, city_name: str):
+        """Get the compiled offset TransitionTable for a city, or None."""
+        return self.transitions.get(city_name)
+
+_snapshot = CitySnapshot()
+_search_index = PrefixIndex()
+_fuzzy_index = TrigramIndex()
+_geo_index = GeoIndex()
+
+def get_snapshot() -> CitySnapshot:
+    """Return the current city snapshot."""
+    return _snapshot
+
+def get_search_index() -> PrefixIndex:
+    """Return the prefix search index matching the current snapshot."""
+    return _search_index
+
+def get_fuzzy_index() -> TrigramIndex:
+    """Return the typo-tolerant search index matching the current snapshot."""
+    return _fuzzy_index
+
+def get_geo_index() -> GeoIndex:
+    """Return the nearest-city index matching the current snapshot."""
+    return _geo_index
+
+def load_snapshot_file(path: str = SNAPSHOT_FILE) -> bool:
+    """Map the compiled snapshot file and serve from it, indexes included.
+
+    Returns False (changing nothing) if there is no usable file.
+    """
+    global _snapshot, _search_index, _fuzzy_index, _geo_index
+    snapshot = open_snapshot_file(path)
+    if snapshot is None:
+        return False
+    get_response_cache().apply_snapshot(_snapshot, snapshot)
+    _search_index = MappedPrefixIndex(snapshot)
+    _fuzzy_index = MappedTrigramIndex(snapshot)
+    _geo_index = snapshot.geo_index()
+    _snapshot = snapshot
+    logging.info(f"Serving city snapshot v{snapshot.version} from {path}: {snapshot.city_count} cities")
+    return True
+
+def _coordinates(cities: dict) -> dict:
+    return {name: city.get('coordinates') for name, city in cities.items()}
+
+# Requests that find no snapshot loaded, and the refresher, share one load
+_load_flight = SingleFlight('snapshot', max_wait=30)
+
+async def load_snapshot() -> CitySnapshot:
+    """Load a fresh snapshot from Redis and make it the current one."""
+    return await _load_flight.do('snapshot', _load_snapshot)
+
+async def _load_snapshot() -> CitySnapshot:
+    global _snapshot, _search_index, _fuzzy_index, _geo_index
+
+    version, cities, dst_offsets = await load_city_tables()
+    if not cities and _snapshot.source == 'file':
+        # Redis is up but not synced yet; the file is better than nothing
+        logging.warning(f"No cities in Redis yet, still serving city snapshot v{_snapshot.version} from the file")
+        return _snapshot
+    # A snapshot from the file has no indexes of its own to update
+    live = _snapshot.loaded and _snapshot.source == 'redis'
+
+    # Update the search indexes in place with only what changed since the last
+    # snapshot. Nothing here awaits, so readers never see a half-applied index.
+    if live:
+        for index in (_search_index, _fuzzy_index):
+            index.apply_changes(_snapshot.cities, cities)
+    else:
+        search_index, fuzzy_index = PrefixIndex(), TrigramIndex()
+        search_index.build(cities)
+        fuzzy_index.build(cities)
+        _search_index, _fuzzy_index = search_index, fuzzy_index
+
+    # The geo index is rebuilt only when cities move, appear or disappear
+    if not live or _coordinates(_snapshot.cities) != _coordinates(cities):
+        geo_index = GeoIndex()
+        geo_index.build(cities)
+        _geo_index = geo_index
+
+    transitions = compile_transitions(cities, dst_offsets)
+    snapshot = CitySnapshot(version, cities, dst_offsets, transitions, loaded=True)
+    get_response_cache().apply_snapshot(_snapshot, snapshot)
+    _snapshot = snapshot
+    logging.info(
+        f"Loaded city snapshot v{version}: {len(cities)} cities, "
+        f"{len(dst_offsets)} DST entries"
+    )
+    return _snapshot
+
+async def refresh_if_stale() -> bool:
+    """Reload the snapshot if the data version in Redis has changed, or it came from the file.
+
+    With SHARED_SNAPSHOT, remap the file instead whenever it was replaced.
+    """
+    if SHARED_SNAPSHOT:
+        if snapshot_file_changed(_snapshot, SNAPSHOT_FILE) and load_snapshot_file(SNAPSHOT_FILE):
+            return True
+        if _snapshot.source == 'file':
+            return False
+    if _snapshot.loaded and _snapshot.source == 'redis' and await get_data_version() == _snapshot.version:
+        return False
+    await load_snapshot()
+    return True
+
+async def run_snapshot_refresher(interval: float = SNAPSHOT_REFRESH_INTERVAL, immediate: bool = False):
+    """Poll the data version and refresh the snapshot whenever it changes.
+
+    With immediate=True the first check runs right away instead of after
+    one interval, to replace a snapshot served from the file quickly.
+    """
+    while True:
+        if immediate:
+            immediate = False
+        else:
+            await asyncio.sleep(interval)
+        try:
+            await refresh_if_stale()
+        except asyncio.CancelledError:
+            raise
+        except CircuitOpenError:
+            # Redis is known to be down; keep serving the last good snapshot
+            logging.debug("Redis circuit open, keeping city snapshot v%s", _snapshot.version)
+        except Exception as e:
+            logging.error(f"Error refreshing city snapshot, keeping v{_snapshot.version}: {str(e)}", exc_info=True)
@@ -0,0 +1,44 @@
+import json
+
+# Columns stored positionally, in this order, in encoded city records. New
+# columns may only be appended: records already in Redis use these positions.
+RECORD_FIELDS = (
+    'id', 'city', 'state', 'country', 'timezone', 'coordinates', 'utc_offset', 'dst_status',
+    'currency', 'languages_spoken', 'country_code', 'national_holidays', 'details',
+    'created_at', 'updated_at', 'deleted_at',
+)
+
+def encode_city(city: dict) -> bytes:
+    """Encode a city row as a compact JSON array.
+
+    The first element is a bitmask of which RECORD_FIELDS the row has,
+    followed by their values in order, so field names are not stored per
+    row. Columns outside RECORD_FIELDS go in a trailing object. Decoding
+    gives back an equal dict, so encoded records can be compared directly.
+    """
+    mask = 0
+    values = []
+    for bit, field in enumerate(RECORD_FIELDS):
+        if field in city:
+            mask |= 1 << bit
+            values.append(city[field])
+    record = [mask, *values]
+    extras = {field: value for field, value in city.items() if field not in RECORD_FIELDS}
+    if extras:
+        record.append(extras)
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def decode_city(raw) -> dict:
+    """Decode a record written by encode_city back into a city dict."""
+    if isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    mask, *values = json.loads(raw)
+    city = {}
+    position = 0
+    for bit, field in enumerate(RECORD_FIELDS):
+        if mask >> bit & 1:
+            city[field] = values[position]
+            position += 1
+    if position < len(values):
+        city.update(values[position])
+    return city
@@ -1,4 +1,37 @@
-from fastapi_cache import FastAPICache
+"""
+Clear cached HTTP responses from the shared (Redis) tier.
 
-# Clear all cache
-FastAPICache.clear()
\ No newline at end of file
+    python clearcache.py                 # every cached /location and /search response
+    python clearcache.py London Paris    # only what depends on these cities
+
+Changes made through update_city or the sync already invalidate the affected
+entries, so this is only needed after editing Redis by hand. Each worker's
+in-process tier expires on its own: location entries at the next minute
+boundary, search entries after SEARCH_CACHE_TTL seconds.
+"""
+import sys
+import asyncio
+from redis_manager import (
+    RESPONSE_CACHE_PREFIX, city_search_terms, invalidate_cached_responses, load_city_tables, redis_client
+)
+
+async def clear_all() -> int:
+    keys = [key async for key in redis_client.scan_iter(match=f'{RESPONSE_CACHE_PREFIX}*', count=1000)]
+    if keys:
+        await redis_client.unlink(*keys)
+    return len(keys)
+
+async def clear_cities(city_names: list):
+    _, cities, _ = await load_city_tables()
+    terms = city_search_terms(*(cities.get(name) or {'city': name} for name in city_names))
+    await invalidate_cached_responses(city_names, terms)
+
+async def main(city_names: list):
+    if city_names:
+        await clear_cities(city_names)
+        print(f"Cleared cached responses for {', '.join(city_names)}")
+    else:
+        print(f"Cleared {await clear_all()} cached responses")
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
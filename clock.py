@@ -0,0 +1,179 @@
+import os
+import time
+import struct
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+# Seconds between reference clock refreshes
+CLOCK_REFRESH_INTERVAL = float(os.getenv('CLOCK_REFRESH_INTERVAL', 60))
+# Reference clock backend: 'system' or 'sntp'
+CLOCK_BACKEND = os.getenv('CLOCK_BACKEND', 'system')
+# SNTP server for the 'sntp' backend, normally a local chrony/ntpd instance
+CLOCK_SNTP_HOST = os.getenv('CLOCK_SNTP_HOST', 'localhost')
+CLOCK_SNTP_PORT = int(os.getenv('CLOCK_SNTP_PORT', 123))
+
+# Seconds between the NTP epoch (1900) and the Unix epoch (1970)
+_NTP_DELTA = 2208988800
+
+class ClockReading:
+    """Immutable pairing of a reference UTC time with the monotonic clock."""
+
+    __slots__ = ('utc_epoch', 'monotonic', 'source')
+
+    def __init__(self, utc_epoch: float, monotonic: float, source: str):
+        self.utc_epoch = utc_epoch
+        self.monotonic = monotonic
+        self.source = source
+
+class SystemClockBackend:
+    """Reference time from the host's system clock."""
+
+    name = 'system'
+
+    def current(self) -> float:
+        """Best non-blocking estimate, used before the first refresh."""
+        return time.time()
+
+    async def fetch(self) -> float:
+        return time.time()
+
+class SntpClockBackend:
+    """Reference time from an SNTP server, by default one running locally."""
+
+    name = 'sntp'
+
+    def __init__(self, host: str = CLOCK_SNTP_HOST, port: int = CLOCK_SNTP_PORT, timeout: float = 1.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def current(self) -> float:
+        # Nothing fetched yet, fall back to the system clock
+        return time.time()
+
+    async def fetch(self) -> float:
+        loop = asyncio.get_running_loop()
+        reply = loop.create_future()
+
+        class _Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                if not reply.done():
+                    reply.set_result(data)
+
+            def error_received(self, exc):
+                if not reply.done():
+                    reply.set_exception(exc)
+
+        transport, _ = await loop.create_datagram_endpoint(
+            _Protocol, remote_addr=(self.host, self.port)
+        )
+        try:
+            sent = time.monotonic()
+            # LI=0, VN=3, Mode=3 (client)
+            transport.sendto(b'\x1b' + 47 * b'\0')
+            data = await asyncio.wait_for(reply, self.timeout)
+            round_trip = time.monotonic() - sent
+        finally:
+            transport.close()
+
+        if len(data) < 48:
+            raise ValueError(f"Short SNTP reply ({len(data)} bytes)")
+        seconds, fraction = struct.unpack('!II', data[40:48])
+        # Transmit timestamp, moved forward by half the round trip
+        return seconds - _NTP_DELTA + fraction / 2 ** 32 + round_trip / 2
+
+class FakeClock:
+    """Manually driven clock for tests.
+
+    Serves as both the backend and the monotonic source of a ClockService,
+    so `advance()` moves the service's notion of now deterministically.
+    """
+
+    name = 'fake'
+
+    def __init__(self, utc_epoch: float = 0.0):
+        self.utc_epoch = utc_epoch
+        self._monotonic = 0.0
+
+    def set(self, when: datetime):
+        """Jump to a new time; a ClockService picks it up on its next refresh()."""
+        self.utc_epoch = when.timestamp()
+
+    def advance(self, seconds: float):
+        self.utc_epoch += seconds
+        self._monotonic += seconds
+
+    def monotonic(self) -> float:
+        return self._monotonic
+
+    def current(self) -> float:
+        return self.utc_epoch
+
+    async def fetch(self) -> float:
+        return self.utc_epoch
+
+class ClockService:
+    """Reference clock anchored on time.monotonic().
+
+    Readers combine the current ClockReading with the monotonic clock and
+    never block or lock: refresh() builds a new reading and swaps it in with
+    a single assignment. Until the first refresh, readings come from the
+    backend's non-blocking current() estimate.
+    """
+
+    def __init__(self, backend=None, refresh_interval: float = CLOCK_REFRESH_INTERVAL, monotonic=None):
+        self.backend = backend or SystemClockBackend()
+        self.refresh_interval = refresh_interval
+        self._monotonic = monotonic or getattr(self.backend, 'monotonic', time.monotonic)
+        self._reading = ClockReading(self.backend.current(), self._monotonic(), 'initial')
+
+    @property
+    def reading(self) -> ClockReading:
+        return self._reading
+
+    def now_epoch(self) -> float:
+        """Current UTC time as epoch seconds."""
+        reading = self._reading
+        return reading.utc_epoch + (self._monotonic() - reading.monotonic)
+
+    def now(self) -> datetime:
+        """Current UTC time as an aware datetime."""
+        return datetime.fromtimestamp(self.now_epoch(), timezone.utc)
+
+    async def refresh(self) -> ClockReading:
+        """Fetch a new reference time from the backend and swap it in."""
+        utc_epoch = await self.backend.fetch()
+        self._reading = ClockReading(utc_epoch, self._monotonic(), self.backend.name)
+        return self._reading
+
+    async def run(self):
+        """Refresh the reference time every refresh_interval seconds until cancelled."""
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Clock refresh from {self.backend.name} failed, keeping last reading: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+def _default_backend():
+    if CLOCK_BACKEND == 'sntp':
+        return SntpClockBackend()
+    return SystemClockBackend()
+
+_clock = ClockService(_default_backend())
+
+def get_clock() -> ClockService:
+    """Return the process-wide clock service."""
+    return _clock
+
+def set_clock(clock: ClockService):
+    """Replace the process-wide clock service (e.g. with a FakeClock in tests)."""
+    global _clock
+    _clock = clock
+
+def utc_now() -> datetime:
+    """Current UTC time from the process-wide clock service."""
+    return _clock.now()
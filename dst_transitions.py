@@ -0,0 +1,159 @@
+import os
+import logging
+from bisect import bisect_right
+from datetime import datetime, timedelta
+import pytz
+from clock import utc_now
+
+# Years of transitions compiled on either side of the current year
+TRANSITION_YEARS_BEHIND = int(os.getenv('TRANSITION_YEARS_BEHIND', 1))
+TRANSITION_YEARS_AHEAD = int(os.getenv('TRANSITION_YEARS_AHEAD', 5))
+
+_EPOCH = datetime(1970, 1, 1)
+
+class TransitionTable:
+    """Sorted UTC offset transitions for one city.
+
+    epochs[i] is the UTC epoch second from which offsets[i] (total offset in
+    minutes) and dst[i] apply, until epochs[i + 1].
+    """
+
+    __slots__ = ('epochs', 'offsets', 'dst')
+
+    def __init__(self, entries):
+        self.epochs = [entry[0] for entry in entries]
+        self.offsets = [entry[1] for entry in entries]
+        self.dst = [entry[2] for entry in entries]
+
+    def lookup(self, epoch: float):
+        """Return (offset_minutes, is_dst) in effect at a UTC epoch second."""
+        i = max(bisect_right(self.epochs, epoch) - 1, 0)
+        return self.offsets[i], self.dst[i]
+
+    def entries(self):
+        return list(zip(self.epochs, self.offsets, self.dst))
+
+def parse_offset_minutes(offset: str) -> int:
+    """Parse offsets like '+05:45', '-0330', '−03:00' or '+10' into minutes."""
+    offset = offset.strip()
+    # Handle all variations of minus signs
+    for minus in ('−', '–', '—'):
+        offset = offset.replace(minus, '-')
+    sign = -1 if offset.startswith('-') else 1
+    digits = offset.lstrip('+-')
+    if ':' in digits:
+        hours, minutes = digits.split(':', 1)
+    elif len(digits) > 2:
+        hours, minutes = digits[:-2], digits[-2:]
+    else:
+        hours, minutes = digits, '0'
+    return sign * (int(hours) * 60 + int(minutes or 0))
+
+def format_offset(minutes: int) -> str:
+    """Format an offset in minutes as +HHMM / -HHMM."""
+    sign = '-' if minutes < 0 else '+'
+    hours, mins = divmod(abs(minutes), 60)
+    return f"{sign}{str(hours).zfill(2)}{str(mins).zfill(2)}"
+
+def compile_city_transitions(city_data: dict, dst_data: dict = None, now: datetime = None) -> TransitionTable:
+    """Compile a city's timezone plus any dst_offsets override into a TransitionTable.
+
+    Offsets come from the IANA zone in city_data['timezone']. If the zone is
+    unknown, the city's fixed utc_offset is used instead. A dst_offsets row
+    overrides the zone between its start and end (UTC): during that window
+    the offset is utc_offset + forward_by.
+    """
+    start, end = transition_window(now)
+    try:
+        entries = zone_transitions(city_data['timezone'], start, end)
+    except (KeyError, pytz.UnknownTimeZoneError):
+        entries = [(start, parse_offset_minutes(city_data['utc_offset']), False)]
+
+    if dst_data and city_data.get('dst_status', 'No').lower() == 'yes':
+        try:
+            entries = _apply_override(entries, city_data, dst_data)
+        except (KeyError, ValueError) as e:
+            logging.error(f"Ignoring invalid DST override for {city_data.get('city')}: {str(e)}")
+
+    return TransitionTable(_coalesce(entries))
+
+def compile_transitions(cities: dict, dst_offsets: dict, now: datetime = None) -> dict:
+    """Compile TransitionTables for every city, keyed like `cities`.
+
+    Cities without a DST override share one table per (timezone, utc_offset).
+    """
+    tables = {}
+    shared = {}
+    for name, city_data in cities.items():
+        try:
+            dst_data = dst_offsets.get(name)
+            if dst_data:
+                tables[name] = compile_city_transitions(city_data, dst_data, now)
+                continue
+            key = (city_data.get('timezone'), city_data.get('utc_offset'))
+            if key not in shared:
+                shared[key] = compile_city_transitions(city_data, None, now)
+            tables[name] = shared[key]
+        except Exception as e:
+            logging.error(f"Could not compile transitions for {name}: {str(e)}")
+    return tables
+
+def zone_transitions(tz_name: str, start: int, end: int) -> list:
+    """Return (epoch, offset_minutes, is_dst) entries for an IANA zone between start and end."""
+    tz = pytz.timezone(tz_name)
+    times = getattr(tz, '_utc_transition_times', None)
+    if not times:
+        # Static zone, a single fixed offset
+        return [(start, _minutes(tz.utcoffset(datetime(2000, 1, 1))), False)]
+
+    infos = tz._transition_info
+    i = max(bisect_right(times, _from_epoch(start)) - 1, 0)
+    entries = [(start, _minutes(infos[i][0]), bool(infos[i][1]))]
+    for when, info in zip(times[i + 1:], infos[i + 1:]):
+        epoch = _to_epoch(when)
+        if epoch >= end:
+            break
+        entries.append((epoch, _minutes(info[0]), bool(info[1])))
+    return entries
+
+def _apply_override(entries: list, city_data: dict, dst_data: dict) -> list:
+    dst_start = _to_epoch(datetime.strptime(
+        f"{dst_data['dst_start']} {dst_data['dst_start_time']}", "%d/%m/%Y %H:%M"))
+    dst_end = _to_epoch(datetime.strptime(
+        f"{dst_data['dst_end']} {dst_data['dst_end_time']}", "%d/%m/%Y %H:%M"))
+    if dst_end <= dst_start:
+        raise ValueError("dst_end is not after dst_start")
+
+    dst_offset = parse_offset_minutes(city_data['utc_offset']) + parse_offset_minutes(dst_data['forward_by'])
+    after = TransitionTable(entries).lookup(dst_end)
+
+    spliced = [entry for entry in entries if entry[0] < dst_start]
+    spliced.append((dst_start, dst_offset, True))
+    spliced.append((dst_end, after[0], after[1]))
+    spliced.extend(entry for entry in entries if entry[0] > dst_end)
+    return spliced
+
+def _coalesce(entries: list) -> list:
+    """Drop entries that do not change the offset or DST flag."""
+    result = []
+    for entry in entries:
+        if result and result[-1][1:] == entry[1:]:
+            continue
+        result.append(entry)
+    return result
+
+def transition_window(now: datetime = None):
+    """(start, end) UTC epoch seconds that tables compiled at `now` cover."""
+    year = (now or utc_now()).year
+    start = _to_epoch(datetime(year - TRANSITION_YEARS_BEHIND, 1, 1))
+    end = _to_epoch(datetime(year + TRANSITION_YEARS_AHEAD + 1, 1, 1))
+    return start, end
+
+def _to_epoch(naive_utc: datetime) -> int:
+    return int((naive_utc - _EPOCH).total_seconds())
+
+def _from_epoch(epoch: int) -> datetime:
+    return _EPOCH + timedelta(seconds=epoch)
+
+def _minutes(delta) -> int:
+    return int(delta.total_seconds() // 60)
@@ -0,0 +1,153 @@
+import re
+import math
+import heapq
+import logging
+from array import array
+
+# Mean Earth radius in kilometres
+EARTH_RADIUS_KM = 6371.0088
+
+# A number with an optional degree sign and hemisphere letter, e.g. "51.5074° N" or "-0.1278"
+_COORDINATE = re.compile(r'(-?\d+(?:\.\d+)?)\s*°?\s*([NSEWnsew])?')
+
+def parse_coordinates(value):
+    """Parse a city's coordinates string into (lat, lon) degrees, or None.
+
+    Accepts "51.5074, -0.1278", "51.5074° N, 0.1278° W" and
+    "51.5074°N / 0.1278°W" style values. Hemisphere letters override signs
+    and may put longitude first.
+    """
+    if not value:
+        return None
+    parts = _COORDINATE.findall(str(value))
+    if len(parts) != 2:
+        return None
+    values = []
+    for number, hemisphere in parts:
+        degrees = float(number)
+        hemisphere = hemisphere.upper()
+        if hemisphere in ('S', 'W'):
+            degrees = -abs(degrees)
+        values.append((degrees, hemisphere))
+    (first, first_hemisphere), (second, _) = values
+    lat, lon = (second, first) if first_hemisphere in ('E', 'W') else (first, second)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+def to_unit_vector(lat: float, lon: float) -> tuple:
+    """Point on the unit sphere; chord length between points grows with great-circle distance."""
+    phi, lam = math.radians(lat), math.radians(lon)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+def chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+class GeoIndex:
+    """KD-tree over city coordinates for k-nearest-neighbour lookups.
+
+    Coordinates are mapped to 3D points on the unit sphere, so plain
+    Euclidean nearest neighbours are great-circle nearest neighbours too,
+    with no special cases at the poles or the antimeridian. The tree is an
+    implicit balanced layout: each sorted slice's middle element is the
+    node, split on the axis stored for that position. Points are kept as
+    flat x, y, z doubles, so the tree can also be read from a mapped file
+    (see from_arrays).
+    """
+
+    def __init__(self):
+        self._coords = array('d')
+        self._keys = []
+        self._axes = b''
+
+    @classmethod
+    def from_arrays(cls, coords, keys, axes) -> 'GeoIndex':
+        """Wrap a tree laid out by build(): 3 x n coordinates, n keys and n axes."""
+        index = cls()
+        index._coords, index._keys, index._axes = coords, keys, axes
+        return index
+
+    def arrays(self) -> tuple:
+        """The (coords, keys, axes) of the tree, as taken by from_arrays."""
+        return self._coords, self._keys, self._axes
+
+    def __len__(self):
+        return len(self._keys)
+
+    def build(self, cities: dict):
+        """Rebuild the tree from a {city_key: city_data} mapping."""
+        entries = []
+        skipped = 0
+        for key, city in cities.items():
+            coordinates = parse_coordinates(city.get('coordinates'))
+            if coordinates is None:
+                skipped += 1
+                continue
+            entries.append((to_unit_vector(*coordinates), key))
+        if skipped:
+            logging.warning(f"Geo index skipped {skipped} cities with unreadable coordinates")
+
+        axes = [0] * len(entries)
+        self._layout(entries, axes, 0, len(entries))
+        self._coords = array('d', [c for point, _ in entries for c in point])
+        self._keys = [key for _, key in entries]
+        self._axes = bytes(axes)
+
+    @staticmethod
+    def _layout(entries: list, axes: list, lo: int, hi: int):
+        stack = [(lo, hi)]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= 1:
+                continue
+            # Split on the axis with the widest spread in this slice
+            spreads = [
+                max(point[axis] for point, _ in entries[lo:hi]) - min(point[axis] for point, _ in entries[lo:hi])
+                for axis in range(3)
+            ]
+            axis = spreads.index(max(spreads))
+            entries[lo:hi] = sorted(entries[lo:hi], key=lambda entry: entry[0][axis])
+            mid = (lo + hi) // 2
+            axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+    def nearest(self, lat: float, lon: float, k: int = 5) -> list:
+        """Return up to k (city_key, distance_km) pairs, nearest first."""
+        if not self._keys or k <= 0:
+            return []
+        query = to_unit_vector(lat, lon)
+        coords, axes = self._coords, self._axes
+        best = []  # max-heap of (-squared_distance, index), at most k entries
+
+        # (lo, hi, squared distance from the query to that slice's splitting plane)
+        stack = [(0, len(self._keys), 0.0)]
+        while stack:
+            lo, hi, plane = stack.pop()
+            if lo >= hi or (len(best) == k and plane >= -best[0][0]):
+                continue
+            mid = (lo + hi) // 2
+            base = 3 * mid
+            dx, dy, dz = query[0] - coords[base], query[1] - coords[base + 1], query[2] - coords[base + 2]
+            distance = dx * dx + dy * dy + dz * dz
+            if len(best) < k:
+                heapq.heappush(best, (-distance, mid))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, mid))
+
+            axis = axes[mid]
+            diff = query[axis] - coords[base + axis]
+            # Near side is searched first; the far side only if, by the time it
+            # is popped, its splitting plane is closer than the k-th best so far
+            if diff < 0:
+                stack.append((mid + 1, hi, diff * diff))
+                stack.append((lo, mid, plane))
+            else:
+                stack.append((lo, mid, diff * diff))
+                stack.append((mid + 1, hi, plane))
+
+        return [
+            (self._keys[index], chord_to_km(math.sqrt(-negative)))
+            for negative, index in sorted(best, reverse=True)
+        ]
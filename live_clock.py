@@ -0,0 +1,199 @@
+import os
+import json
+import math
+import asyncio
+import logging
+from datetime import datetime, timezone
+from city_cache import get_snapshot
+from clock import get_clock
+from dst_transitions import compile_city_transitions
+from location_encoding import city_encoding
+
+# Frames buffered per subscriber; a slow client loses the oldest frames, not the newest
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', 4))
+# Seconds between keepalive frames for subscribers that only get per-minute ticks
+STREAM_HEARTBEAT_INTERVAL = int(os.getenv('STREAM_HEARTBEAT_INTERVAL', 15))
+
+RESOLUTIONS = ('second', 'minute')
+
+class Subscriber:
+    """One connected client: the cities it follows and its outgoing frame queue.
+
+    Frames are (event, payload) pairs, payload being pre-encoded JSON bytes
+    (None for heartbeats). Transports only format and write them.
+    """
+
+    __slots__ = ('cities', 'resolution', 'queue', 'dropped')
+
+    def __init__(self, cities: tuple, resolution: str):
+        self.cities = cities
+        self.resolution = resolution
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def offer(self, event: str, payload: bytes = None):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait((event, payload))
+
+    async def next_frame(self):
+        return await self.queue.get()
+
+class ClockHub:
+    """Single shared timer that computes each subscribed city once per tick.
+
+    Every second the hub resolves the current time of every city that at
+    least one subscriber follows, encodes it once, and fans the encoded
+    fragments out to the subscribers' queues. Per-minute subscribers only
+    get a frame when the minute rolls over. A city whose UTC offset changed
+    since the previous tick (a DST transition, or a new override in the
+    snapshot) triggers a 'transition' frame to its subscribers right away.
+    """
+
+    def __init__(self, clock=None, snapshot=None):
+        self._clock = clock
+        self._snapshot = snapshot or get_snapshot
+        self._subscribers = set()
+        self._refcounts = {}
+        # Last (offset_minutes, is_dst) sent for each subscribed city
+        self._offsets = {}
+        # Encoded fragments of the last tick, reused by subscribe() within the same second
+        self._fragments = {}
+        self._fragments_epoch = None
+        self.ticks = 0
+        self.last_tick_seconds = 0.0
+
+    @property
+    def clock(self):
+        return self._clock or get_clock()
+
+    def subscribe(self, cities, resolution: str = 'second') -> Subscriber:
+        """Register a subscriber and queue a first frame for it immediately."""
+        subscriber = Subscriber(tuple(dict.fromkeys(cities)), resolution)
+        for city in subscriber.cities:
+            self._refcounts[city] = self._refcounts.get(city, 0) + 1
+        self._subscribers.add(subscriber)
+
+        epoch = int(self.clock.now_epoch())
+        fragments = self._fragments if epoch == self._fragments_epoch else {}
+        for city in subscriber.cities:
+            if city not in fragments:
+                fragment, offset = self._render(city, epoch)
+                fragments[city] = fragment
+                self._offsets.setdefault(city, offset)
+        subscriber.offer('tick', self._frame('tick', epoch, subscriber.cities, fragments))
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber not in self._subscribers:
+            return
+        self._subscribers.discard(subscriber)
+        for city in subscriber.cities:
+            count = self._refcounts[city] - 1
+            if count:
+                self._refcounts[city] = count
+            else:
+                del self._refcounts[city]
+                self._offsets.pop(city, None)
+
+    def unknown_cities(self, cities) -> list:
+        """Cities missing from the current snapshot."""
+        snapshot = self._snapshot()
+        return [city for city in cities if snapshot.get_city(city) is None]
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def _render(self, city: str, epoch: int):
+        """Encoded time fragment and (offset_minutes, is_dst) for one city."""
+        snapshot = self._snapshot()
+        encoding = city_encoding(snapshot, city)
+        if encoding is None:
+            return json.dumps({'city': city, 'error': 'City not found'}).encode('utf-8'), None
+        if encoding.error:
+            return json.dumps({'city': city, 'error': 'City data incomplete'}).encode('utf-8'), None
+        transitions = snapshot.get_transitions(city)
+        if transitions is None:
+            transitions = compile_city_transitions(
+                snapshot.get_city(city), snapshot.get_dst(city), datetime.fromtimestamp(epoch, timezone.utc)
+            )
+        offset = transitions.lookup(epoch)
+        return encoding.location(epoch, *offset)[0], offset
+
+    @staticmethod
+    def _frame(event: str, epoch: int, cities, fragments: dict) -> bytes:
+        return b''.join((
+            b'{"event":"', event.encode('ascii'), b'","epoch":', str(epoch).encode('ascii'),
+            b',"cities":[', b','.join(fragments[city] for city in cities), b']}',
+        ))
+
+    def tick(self, epoch: int):
+        """Compute all subscribed cities at `epoch` and fan frames out."""
+        if not self._subscribers:
+            self._fragments, self._fragments_epoch = {}, None
+            return
+        fragments = {}
+        transitioned = set()
+        for city in self._refcounts:
+            fragment, offset = self._render(city, epoch)
+            fragments[city] = fragment
+            if self._offsets.get(city, offset) != offset:
+                transitioned.add(city)
+            self._offsets[city] = offset
+        self._fragments, self._fragments_epoch = fragments, epoch
+        if transitioned:
+            logging.info(f"UTC offset changed at {epoch} for {sorted(transitioned)}")
+
+        minute = epoch % 60 == 0
+        heartbeat = epoch % STREAM_HEARTBEAT_INTERVAL == 0
+        # Subscribers following the same cities share one encoded frame
+        frames = {}
+        for subscriber in self._subscribers:
+            if transitioned:
+                changed = tuple(city for city in subscriber.cities if city in transitioned)
+                if changed:
+                    subscriber.offer('transition', self._frame('transition', epoch, changed, fragments))
+            if subscriber.resolution == 'second' or minute:
+                frame = frames.get(subscriber.cities)
+                if frame is None:
+                    frame = frames[subscriber.cities] = self._frame('tick', epoch, subscriber.cities, fragments)
+                subscriber.offer('tick', frame)
+            elif heartbeat:
+                subscriber.offer('heartbeat')
+
+    async def run(self):
+        """Tick on every whole second of the reference clock until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = self.clock.now_epoch()
+            epoch = math.floor(now) + 1
+            await asyncio.sleep(epoch - now)
+            started = loop.time()
+            try:
+                self.tick(epoch)
+            except Exception as e:
+                logging.error(f"Clock stream tick failed: {str(e)}", exc_info=True)
+            self.ticks += 1
+            self.last_tick_seconds = loop.time() - started
+
+    def stats(self) -> dict:
+        return {
+            'subscribers': len(self._subscribers),
+            'cities': len(self._refcounts),
+            'ticks': self.ticks,
+            'last_tick_ms': round(self.last_tick_seconds * 1e3, 3),
+        }
+
+def sse_event(event: str, payload: bytes = None) -> bytes:
+    """Format one frame as a Server-Sent Event."""
+    if payload is None:
+        return b': ' + event.encode('ascii') + b'\n\n'
+    return b'event: ' + event.encode('ascii') + b'\ndata: ' + payload + b'\n\n'
+
+_hub = ClockHub()
+
+def get_clock_hub() -> ClockHub:
+    """Return the process-wide clock stream hub."""
+    return _hub
@@ -1,5 +1,6 @@
+from datetime import datetime, time
 from pydantic import BaseModel
-from typing import List
+from typing import Any, Dict, List, Optional, Union
 
 class LocationResponse(BaseModel):
     city: str
@@ -18,4 +19,41 @@ class LocationResponse(BaseModel):
     details: str
 
 class ComparisonResponse(BaseModel):
-    cities: List[LocationResponse]
\ No newline at end of file
+    cities: List[LocationResponse]
+
+class NearestCity(LocationResponse):
+    distance_km: float
+
+class NearestResponse(BaseModel):
+    cities: List[NearestCity]
+
+class LocationsRequest(BaseModel):
+    cities: List[str]
+
+class ConvertRequest(BaseModel):
+    cities: List[str]
+    # Either explicit instants, or a start/end range sampled every step_minutes
+    instants: Optional[List[datetime]] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    step_minutes: int = 60
+
+class WorkingHours(BaseModel):
+    city: str
+    # Local wall-clock hours; an end at or before start runs past midnight
+    start: time = time(9)
+    end: time = time(17)
+    # Days a window may start on, Monday is 0
+    weekdays: List[int] = [0, 1, 2, 3, 4]
+
+class OverlapRequest(BaseModel):
+    cities: List[WorkingHours]
+    start: datetime
+    end: datetime
+    # Shortest slot worth returning
+    min_minutes: int = 1
+
+class CityChangesRequest(BaseModel):
+    # Full city rows (each with id and city) to write, and city IDs to remove
+    upsert: List[Dict[str, Any]] = []
+    delete: List[Union[int, str]] = []
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+from functools import lru_cache
+from dst_transitions import format_offset
+
+# Cities whose encodings each snapshot keeps; when full, it starts over
+ENCODED_CITY_CACHE_SIZE = int(os.getenv('ENCODED_CITY_CACHE_SIZE', 20000))
+
+# LocationResponse fields before the time fields, and after them
+_HEAD_FIELDS = ('city', 'state', 'country', 'timezone', 'coordinates')
+_TAIL_FIELDS = ('currency', 'languages_spoken', 'country_code', 'national_holidays', 'details')
+_CURRENT_TIME = b'","current_time":"'
+
+def _json(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _fields(city_data: dict, fields: tuple) -> bytes:
+    parts = []
+    for field in fields:
+        value = city_data.get(field, '') if field == 'state' else city_data.get(field)
+        if not isinstance(value, str):
+            # LocationResponse would reject it the same way
+            raise ValueError(f"{field} of {city_data.get('city')} is {type(value).__name__}, not str")
+        parts.append(b'"' + field.encode('ascii') + b'":' + _json(value))
+    return b','.join(parts)
+
+@lru_cache(maxsize=256)
+def _offset_text(minutes: int) -> bytes:
+    return format_offset(minutes).encode('ascii')
+
+@lru_cache(maxsize=64)
+def _date_text(day: int) -> bytes:
+    return time.strftime('%A %d %B %Y', time.gmtime(day * 86400)).encode('utf-8')
+
+class CityEncoding:
+    """A city's /location body and search result, with everything static pre-encoded.
+
+    location() splices the offset, local time, date and DST flag between
+    the encoded fields before and after them, producing the same bytes as
+    calculate_city_time(...).model_dump_json() without building a model.
+    A city with a column LocationResponse would reject still has its search
+    result; `error` says why it has no /location body.
+    """
+
+    __slots__ = ('head', 'tail', 'error', 'search_result')
+
+    def __init__(self, city_data: dict):
+        self.search_result = _json({
+            'id': city_data.get('id', ''),
+            'city': city_data['city'],
+            'state': city_data.get('state', ''),
+            'country': city_data['country'],
+            'timezone': city_data['timezone'],
+            'coordinates': city_data['coordinates'],
+        })
+        try:
+            self.head = b'{' + _fields(city_data, _HEAD_FIELDS) + b',"utc_offset":"'
+            self.tail = b'",' + _fields(city_data, _TAIL_FIELDS) + b'}'
+            self.error = None
+        except ValueError as e:
+            self.head = self.tail = None
+            self.error = str(e)
+
+    def location(self, epoch: float, offset: int, is_dst: bool):
+        """Return (body, offset of the seconds digits in it) at a UTC epoch second.
+
+        offset and is_dst are what the city's TransitionTable gives for epoch.
+        Raises ValueError if the city has no valid /location body.
+        """
+        if self.error is not None:
+            raise ValueError(self.error)
+        day, seconds = divmod(int(epoch) + offset * 60, 86400)
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+        prefix = self.head + _offset_text(offset) + _CURRENT_TIME
+        body = b''.join((
+            prefix, b'%02d:%02d:%02d' % (hours, minutes, seconds),
+            b'","current_date":"', _date_text(day),
+            b'","dst_status":"Yes' if is_dst else b'","dst_status":"No', self.tail,
+        ))
+        return body, len(prefix) + 6
+
+def city_encoding(snapshot, city_name: str):
+    """The CityEncoding of a city in a snapshot, or None if the city is unknown.
+
+    Encodings are kept on the snapshot, so each city is encoded once per
+    snapshot, that is once per sync.
+    """
+    encodings = snapshot.encodings
+    encoding = encodings.get(city_name)
+    if encoding is None:
+        city_data = snapshot.get_city(city_name)
+        if city_data is None:
+            return None
+        encoding = CityEncoding(city_data)
+        if len(encodings) >= ENCODED_CITY_CACHE_SIZE:
+            encodings.clear()
+        encodings[city_name] = encoding
+    return encoding
+
+def location_body(encoding: CityEncoding, transitions, epoch: float) -> bytes:
+    """A city's /location body at a UTC epoch second."""
+    return encoding.location(epoch, *transitions.lookup(epoch))[0]
+
+def join_bodies(bodies) -> bytes:
+    """ComparisonResponse / NearestResponse body from encoded city bodies."""
+    return b'{"cities":[' + b','.join(bodies) + b']}'
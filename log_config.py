@@ -0,0 +1,129 @@
+import os
+import json
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# 'text' for the classic one-line format, 'json' for one JSON object per line
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+# Per-route sampling of INFO/DEBUG records, e.g. "/location=0.01,/search=0.1"
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')
+
+# Path of the request being handled, set by the request middleware in main.py
+current_route = contextvars.ContextVar('current_route', default=None)
+
+_listener = None
+
+# Attributes every LogRecord has; anything else was passed via `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'route'}
+
+class LazyJson:
+    """Defers json.dumps of a debug payload until the record is actually formatted."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(self.value, ensure_ascii=False, default=str)
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records as JSON lines, including any fields passed via `extra`."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        route = getattr(record, 'route', None)
+        if route:
+            entry['route'] = route
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RouteSamplingFilter(logging.Filter):
+    """Keeps only a sampled fraction of INFO/DEBUG records per route.
+
+    Warnings and errors always pass. Records logged outside a request, or
+    for routes without a configured rate, always pass.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        # Longest prefix first so '/locations' wins over '/location'
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def filter(self, record):
+        route = current_route.get()
+        record.route = route
+        if record.levelno >= logging.WARNING or route is None:
+            return True
+        for prefix, rate in self.rates:
+            if route.startswith(prefix):
+                return random.random() < rate
+        return True
+
+def parse_sample_rates(spec: str) -> dict:
+    """Parse "route=rate,route=rate" into a dict."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        route, _, rate = item.partition('=')
+        rates[route.strip()] = float(rate)
+    return rates
+
+def setup_logging(log_file: str, level: str = LOG_LEVEL, max_bytes: int = LOG_MAX_BYTES):
+    """Route all logging through a queue to a background writer thread.
+
+    Request handlers only enqueue records; a QueueListener writes them to a
+    rotating log file and the terminal. Pass max_bytes=0 when several
+    processes append to one file: rotation is then left to external tools,
+    as processes rotating independently would lose records. Safe to call
+    more than once, only the first call configures logging.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    if LOG_FORMAT == 'json':
+        formatter = StructuredFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+    file_handler = RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RouteSamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the background writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,14 +1,76 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
 import json
 import logging
-from redis_manager import get_city_data, get_dst_data, redis_client
+import os
+import secrets
+import time
+from datetime import datetime, timezone
+from typing import List
+import numpy as np
+import pytz
+from redis.exceptions import RedisError
+from redis_manager import (
+    CITY_SCAN_BATCH, apply_city_changes, get_city_and_dst, get_cities_data, get_data_version, get_sync_stats,
+    redis_breaker, redis_pool, scan_cities
+)
+from resilience import CircuitOpenError
 import asyncio
-from routes.time_routes import calculate_city_time
+from location_encoding import CityEncoding, city_encoding, join_bodies, location_body
+from models.location import CityChangesRequest, ComparisonResponse, ConvertRequest, LocationsRequest, NearestResponse, OverlapRequest
+from city_cache import (
+    SHARED_SNAPSHOT, get_fuzzy_index, get_geo_index, get_snapshot, get_search_index, load_snapshot,
+    load_snapshot_file, run_snapshot_refresher
+)
+from time_convert import OffsetArrays, convert_times, instant_range
+from clock import get_clock, utc_now
+from log_config import LOG_MAX_BYTES, current_route, setup_logging
+from live_clock import RESOLUTIONS, get_clock_hub, sse_event
+from dst_transitions import compile_city_transitions, transition_window
+from overlap import describe_slots, find_overlap, format_utc
+from search_index import normalize, search_cache_query
+from response_cache import LOCATION_CACHE_CONTROL, SEARCH_CACHE_CONTROL, cached_response, get_response_cache
+from singleflight import SingleFlight
+from metrics import REQUEST_SECONDS, STAGE_SECONDS, registry
+
+# Worker processes sharing this host's API, as started by serve.py
+WORKERS = int(os.getenv('WORKERS', 1))
+
+def _setup_logging():
+    # Several processes append to main.log when WORKERS > 1
+    setup_logging('main.log', max_bytes=0 if WORKERS > 1 else LOG_MAX_BYTES)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up logging, load the city snapshot and keep it and the reference clock fresh.
+
+    All per-process startup work happens here rather than at import, so
+    each worker process sets up its own.
+    """
+    _setup_logging()
+    # With a snapshot file, start serving at once; unless the file is shared,
+    # the refresher then switches to Redis in the background
+    from_file = load_snapshot_file()
+    if not from_file:
+        try:
+            await load_snapshot()
+        except Exception as e:
+            logging.error(f"Initial city snapshot load failed, falling back to Redis: {str(e)}")
+    refresher = asyncio.create_task(run_snapshot_refresher(immediate=from_file and not SHARED_SNAPSHOT))
+    clock_refresher = asyncio.create_task(get_clock().run())
+    clock_hub = asyncio.create_task(get_clock_hub().run())
+    try:
+        yield
+    finally:
+        refresher.cancel()
+        clock_refresher.cancel()
+        clock_hub.cancel()
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -19,44 +81,136 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('main.log'),  # Log to a file
-        logging.StreamHandler()  # Log to the terminal
-    ]
-)
+class RouteContextMiddleware:
+    """Tag log records with the request path so they can be sampled per route.
+
+    Plain ASGI rather than @app.middleware("http"), which would pass every
+    chunk of a streamed response through an extra task and memory stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            return await self.app(scope, receive, send)
+        token = current_route.set(scope['path'])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_route.reset(token)
+
+class RequestMetricsMiddleware:
+    """Observe request latency per route template, method and status.
+
+    Latency is the time until the response headers are sent, so streaming
+    responses (/cities, /stream/clock) count only their setup. WebSockets
+    are not measured.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - start, route_template(scope), scope['method'], str(message['status'])
+                )
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+_route_templates = {}
+
+def route_template(scope) -> str:
+    """The path template of the route that handled a request, e.g. /location/{city_name}."""
+    route = scope.get('route')
+    if route is not None:
+        return route.path
+    # Older Starlette only records the endpoint
+    if not _route_templates:
+        _route_templates.update({route.endpoint: route.path for route in app.routes if hasattr(route, 'endpoint')})
+    return _route_templates.get(scope.get('endpoint'), 'unmatched')
+
+app.add_middleware(RouteContextMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+
+# Concurrent cache misses for the same city or query share one computation
+location_flight = SingleFlight('location')
+search_flight = SingleFlight('search')
 
 @app.get("/location/{city_name}")
-async def get_location_time(city_name: str):
+async def get_location_time(city_name: str, request: Request):
+    now = get_clock().now_epoch()
+    cache = get_response_cache()
+    entry = await cache.get_location(city_name, now)
+    if entry is None:
+        entry = await location_flight.do(city_name, lambda: build_location_entry(city_name, now))
+        if entry.expires_at <= now:
+            # Joined a call that finished just before a minute boundary
+            entry = await build_location_entry(city_name, now)
+    elif entry.needs_refresh(now):
+        # Prepare the entry for the next minute before this one expires
+        location_flight.refresh(
+            ('next', city_name), lambda: build_location_entry(city_name, entry.expires_at, successor_of=entry)
+        )
+    body, etag = entry.render(now)
+    return cached_response(request, body, etag, LOCATION_CACHE_CONTROL)
+
+async def build_location_entry(city_name: str, now: float, successor_of=None):
+    version = get_snapshot().version
+    body, seconds_at, transitions = await render_location(city_name, now)
+    return await get_response_cache().put_location(city_name, body, seconds_at, transitions, now, version, successor_of)
+
+async def render_location(city_name: str, now: float):
+    """Encode a city's /location body at epoch `now`.
+
+    Returns (body, offset of its seconds digits, transition table).
+    """
     try:
-        # Try to get data with retry logic
-        max_retries = 3
-        for attempt in range(max_retries):
+        snapshot = get_snapshot()
+        if snapshot.loaded:
+            # Serve straight from the in-process snapshot, no Redis round trips
+            encoding = city_encoding(snapshot, city_name)
+            transitions = snapshot.get_transitions(city_name)
+            city_data = dst_data = None
+            if encoding is not None and transitions is None:
+                city_data, dst_data = snapshot.get_city(city_name), snapshot.get_dst(city_name)
+        else:
+            encoding = transitions = None
+            # No snapshot yet: one deadline-bound round trip behind the circuit
+            # breaker instead of sleeping through retries
             try:
-                city_data = await get_city_data(city_name)
-                break
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    raise
-                await asyncio.sleep(1)  # Wait before retrying
-        if not city_data:
+                with STAGE_SECONDS.time('location', 'redis_lookup'):
+                    city_data, dst_data = await get_city_and_dst(city_name)
+            except REDIS_UNAVAILABLE_ERRORS as e:
+                raise redis_unavailable(e)
+            if city_data:
+                encoding = CityEncoding(city_data)
+
+        if encoding is None:
             raise HTTPException(
                 status_code=404, 
                 detail={"message": "City not found", "city": city_name}
             )
-        
-        dst_data = await get_dst_data(city_name)
-        if not dst_data:
-            logging.warning(f"DST data not found for {city_name}")
-            
-        if dst_data:
-            city_data['dst_data'] = dst_data
-        
-        time_info = calculate_city_time(city_data)
-        return time_info
+        if encoding.error:
+            # A row LocationResponse cannot hold, e.g. a null currency
+            raise HTTPException(
+                status_code=404,
+                detail={"message": "City data incomplete", "city": city_name}
+            )
+
+        if transitions is None:
+            with STAGE_SECONDS.time('location', 'compile_transitions'):
+                transitions = compile_city_transitions(city_data, dst_data, datetime.fromtimestamp(now, timezone.utc))
+        with STAGE_SECONDS.time('location', 'serialize'):
+            body, seconds_at = encoding.location(now, *transitions.lookup(now))
+        return body, seconds_at, transitions
         
     except HTTPException:
         raise
@@ -66,79 +220,651 @@ async def get_location_time(city_name: str):
             status_code=500, 
             detail={"message": "Internal server error", "error": str(e)}
         )
+
+# Redis failures that mean "try again later" rather than "no such city"
+REDIS_UNAVAILABLE_ERRORS = (CircuitOpenError, RedisError, OSError, asyncio.TimeoutError)
+
+def redis_unavailable(e: Exception) -> HTTPException:
+    logging.warning(f"Redis unavailable and no local snapshot: {type(e).__name__}: {str(e)}")
+    return HTTPException(
+        status_code=503,
+        detail={"message": "City data temporarily unavailable", "error": type(e).__name__},
+        headers={"Retry-After": str(int(redis_breaker.reset_timeout))}
+    )
+
+# Upper bound on cities per batch request
+MAX_BATCH_CITIES = 50
+
+@app.post("/locations", response_model=ComparisonResponse)
+async def get_locations_time(request: LocationsRequest):
+    """Get the current time for many cities, all computed against one UTC instant."""
+    city_names = request.cities
+    if not city_names:
+        return ComparisonResponse(cities=[])
+    if len(city_names) > MAX_BATCH_CITIES:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"At most {MAX_BATCH_CITIES} cities per request", "count": len(city_names)}
+        )
+
+    try:
+        snapshot = get_snapshot()
+        if snapshot.loaded:
+            resolved = [(snapshot.get_city(name), snapshot.get_dst(name)) for name in city_names]
+            tables = [snapshot.get_transitions(name) for name in city_names]
+        else:
+            try:
+                resolved = await get_cities_data(city_names)
+            except REDIS_UNAVAILABLE_ERRORS as e:
+                raise redis_unavailable(e)
+            tables = [None] * len(city_names)
+
+        missing = [name for name, (city_data, _) in zip(city_names, resolved) if not city_data]
+        if missing:
+            raise HTTPException(
+                status_code=404,
+                detail={"message": "City not found", "cities": missing}
+            )
+
+        encodings = [
+            city_encoding(snapshot, name) if snapshot.loaded else CityEncoding(city_data)
+            for name, (city_data, _) in zip(city_names, resolved)
+        ]
+        incomplete = [name for name, encoding in zip(city_names, encodings) if encoding.error]
+        if incomplete:
+            raise HTTPException(
+                status_code=404,
+                detail={"message": "City data incomplete", "cities": incomplete}
+            )
+
+        now = utc_now()
+        epoch = now.timestamp()
+        bodies = []
+        for encoding, (city_data, dst_data), transitions in zip(encodings, resolved, tables):
+            if transitions is None:
+                transitions = compile_city_transitions(city_data, dst_data, now)
+            bodies.append(location_body(encoding, transitions, epoch))
+        return Response(content=join_bodies(bodies), media_type='application/json')
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error processing batch request for {city_names}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={"message": "Internal server error", "error": str(e)}
+        )
+
+# Upper bound on records per HSCAN batch for /cities
+MAX_CITY_SCAN_BATCH = 5000
+CITY_LIST_FORMATS = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+
+def parse_city_cursor(cursor: str):
+    """Split a /cities cursor into (HSCAN cursor, records of that batch already returned)."""
+    try:
+        scan_cursor, _, skip = cursor.partition('-')
+        scan_cursor, skip = int(scan_cursor), int(skip or 0)
+    except ValueError:
+        scan_cursor = skip = -1
+    if scan_cursor < 0 or skip < 0:
+        raise HTTPException(status_code=400, detail={"message": "Invalid cursor", "cursor": cursor})
+    return scan_cursor, skip
+
+async def city_pages(scan_cursor: int, skip: int, limit, batch: int):
+    """Yield (cities, next_cursor) per HSCAN batch until limit cities or the end of the table.
+
+    next_cursor is None once the table is exhausted. A page that stops
+    inside a batch records how far into it it got, so the next page can
+    pick up from the same HSCAN cursor.
+    """
+    remaining = limit
+    while True:
+        next_scan_cursor, cities = await scan_cities(scan_cursor, batch)
+        cities = cities[skip:]
+        if remaining is not None and len(cities) >= remaining:
+            if len(cities) > remaining:
+                yield cities[:remaining], f'{scan_cursor}-{skip + remaining}'
+            else:
+                yield cities, str(next_scan_cursor) if next_scan_cursor else None
+            return
+        if remaining is not None:
+            remaining -= len(cities)
+        yield cities, str(next_scan_cursor) if next_scan_cursor else None
+        if not next_scan_cursor:
+            return
+        scan_cursor, skip = next_scan_cursor, 0
+
+def _city_lines(cities: list) -> bytes:
+    return b''.join(json.dumps(city, ensure_ascii=False).encode('utf-8') + b'\n' for city in cities)
+
+@app.get("/cities")
+async def list_cities(
+    cursor: str = '0',
+    limit: int = Query(None, ge=1),
+    batch: int = Query(CITY_SCAN_BATCH, ge=1, le=MAX_CITY_SCAN_BATCH),
+    format: str = 'ndjson',
+):
+    """Stream stored cities straight from Redis, one HSCAN batch at a time.
+
+    Returns up to `limit` cities (all by default) from `cursor` on, as
+    NDJSON (one city per line, then a {"next_cursor": ...} line) or as a
+    JSON object {"cities": [...], "next_cursor": ...}. Pass next_cursor back
+    to continue; it is null at the end of the table. Memory use is bounded
+    by the batch size, not the table size.
+    """
+    if format not in CITY_LIST_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"format must be one of {', '.join(CITY_LIST_FORMATS)}"}
+        )
+    pages = city_pages(*parse_city_cursor(cursor), limit, batch)
+    # Read the first batch up front, so an unavailable Redis is still a 503
+    try:
+        first = await pages.__anext__()
+    except REDIS_UNAVAILABLE_ERRORS as e:
+        raise redis_unavailable(e)
+
+    async def body():
+        next_cursor = cursor
+        error = None
+        if format == 'json':
+            yield b'{"cities":['
+        separator = b''
+        try:
+            page = first
+            while True:
+                cities, next_cursor = page
+                if cities and format == 'json':
+                    yield separator + b','.join(json.dumps(city, ensure_ascii=False).encode('utf-8') for city in cities)
+                    separator = b','
+                elif cities:
+                    yield _city_lines(cities)
+                try:
+                    page = await pages.__anext__()
+                except StopAsyncIteration:
+                    break
+        except REDIS_UNAVAILABLE_ERRORS as e:
+            # Headers are gone; report where to resume in the body instead
+            logging.warning(f"City listing interrupted at cursor {next_cursor}: {type(e).__name__}: {str(e)}")
+            error = type(e).__name__
+        trailer = {'next_cursor': next_cursor, **({'error': error} if error else {})}
+        if format == 'json':
+            yield b'],' + json.dumps(trailer)[1:].encode('utf-8')
+        else:
+            yield json.dumps(trailer).encode('utf-8') + b'\n'
+
+    return StreamingResponse(body(), media_type=CITY_LIST_FORMATS[format], headers={'Cache-Control': 'no-store'})
+
+# Upper bound on cities per /nearest request
+MAX_NEAREST = int(os.getenv('MAX_NEAREST', 20))
+
+@app.get("/nearest", response_model=NearestResponse)
+async def get_nearest_cities(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(5, ge=1, le=MAX_NEAREST),
+):
+    """Get the k cities closest to a point, nearest first, with their current time."""
+    try:
+        snapshot = get_snapshot()
+        if not snapshot.loaded:
+            try:
+                snapshot = await load_snapshot()
+            except REDIS_UNAVAILABLE_ERRORS as e:
+                raise redis_unavailable(e)
+
+        now = utc_now()
+        epoch = now.timestamp()
+        bodies = []
+        for city_name, distance_km in get_geo_index().nearest(lat, lon, k):
+            encoding = city_encoding(snapshot, city_name)
+            if encoding is None or encoding.error:
+                # Unknown, or a row LocationResponse cannot hold
+                continue
+            transitions = snapshot.get_transitions(city_name)
+            if transitions is None:
+                transitions = compile_city_transitions(snapshot.get_city(city_name), snapshot.get_dst(city_name), now)
+            body = location_body(encoding, transitions, epoch)
+            # NearestCity is LocationResponse plus distance_km, last
+            bodies.append(body[:-1] + b',"distance_km":' + repr(round(distance_km, 1)).encode('ascii') + b'}')
+        return Response(content=join_bodies(bodies), media_type='application/json')
+
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error processing request for {city_name}: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logging.error(f"Error finding cities near {lat}, {lon}: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={"message": "Internal server error", "error": str(e)}
+        )
+
+# Upper bound on instants x cities per /convert request
+MAX_CONVERT_CELLS = int(os.getenv('MAX_CONVERT_CELLS', 100000))
+
+def _epoch_seconds(value: datetime) -> int:
+    """Epoch seconds for a datetime, treating naive values as UTC."""
+    if value.tzinfo is None:
+        value = pytz.UTC.localize(value)
+    return int(value.timestamp())
+
+@app.post("/convert")
+async def convert_city_times(request: ConvertRequest):
+    """Convert many UTC instants to local time in many cities at once."""
+    if request.instants is not None:
+        count = len(request.instants)
+    elif request.start is not None and request.end is not None and request.step_minutes > 0:
+        start, end = _epoch_seconds(request.start), _epoch_seconds(request.end)
+        if end < start:
+            raise HTTPException(
+                status_code=400,
+                detail={"message": "end must not be before start"}
+            )
+        count = (end - start) // (request.step_minutes * 60) + 1
+    else:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Provide instants, or start, end and a positive step_minutes"}
+        )
+
+    # Checked before any instants are built, so a huge range never allocates
+    cells = count * len(request.cities)
+    if cells > MAX_CONVERT_CELLS:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"At most {MAX_CONVERT_CELLS} instant x city cells per request", "cells": cells}
+        )
+    if request.instants is not None:
+        instants = np.array([_epoch_seconds(value) for value in request.instants], dtype=np.int64)
+    else:
+        instants = instant_range(start, end, request.step_minutes * 60)
+    if cells == 0:
+        return {'cities': request.cities, 'instants': [], 'local_times': [], 'utc_offsets': [], 'dst': []}
+
+    try:
+        snapshot = get_snapshot()
+        if not snapshot.loaded:
+            try:
+                snapshot = await load_snapshot()
+            except REDIS_UNAVAILABLE_ERRORS as e:
+                raise redis_unavailable(e)
+
+        missing = [name for name in request.cities if snapshot.get_transitions(name) is None]
+        if missing:
+            raise HTTPException(
+                status_code=404,
+                detail={"message": "City not found", "cities": missing}
+            )
+
+        arrays = OffsetArrays([snapshot.get_transitions(name) for name in request.cities])
+        return {'cities': request.cities, **convert_times(instants, arrays)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error converting times for {request.cities}: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={"message": "Internal server error", "error": str(e)}
+        )
+
+# Upper bounds on the cities and days per /overlap request
+MAX_OVERLAP_CITIES = int(os.getenv('MAX_OVERLAP_CITIES', MAX_BATCH_CITIES))
+MAX_OVERLAP_DAYS = int(os.getenv('MAX_OVERLAP_DAYS', 366))
+
+def _seconds_of_day(value) -> int:
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+@app.post("/overlap")
+async def find_working_overlap(request: OverlapRequest):
+    """UTC intervals in a date range in which every city is within its working hours."""
+    start, end = _epoch_seconds(request.start), _epoch_seconds(request.end)
+    names = [hours.city for hours in request.cities]
+    if not names or len(names) > MAX_OVERLAP_CITIES:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"Provide between 1 and {MAX_OVERLAP_CITIES} cities", "count": len(names)}
+        )
+    if end <= start or end - start > MAX_OVERLAP_DAYS * 86400:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"end must be after start, and at most {MAX_OVERLAP_DAYS} days later"}
+        )
+    window_start, window_end = transition_window()
+    if start < window_start or end > window_end:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Range is outside the compiled transitions",
+                    "from": format_utc(window_start), "to": format_utc(window_end)}
+        )
+    invalid = [hours.city for hours in request.cities if not set(hours.weekdays) <= set(range(7))]
+    if invalid:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "weekdays must be between 0 (Monday) and 6 (Sunday)", "cities": invalid}
+        )
+
+    try:
+        snapshot = get_snapshot()
+        if not snapshot.loaded:
+            try:
+                snapshot = await load_snapshot()
+            except REDIS_UNAVAILABLE_ERRORS as e:
+                raise redis_unavailable(e)
+
+        missing = [name for name in names if snapshot.get_transitions(name) is None]
+        if missing:
+            raise HTTPException(
+                status_code=404,
+                detail={"message": "City not found", "cities": missing}
+            )
+
+        tables = [snapshot.get_transitions(name) for name in names]
+        windows = [
+            (_seconds_of_day(hours.start), _seconds_of_day(hours.end), frozenset(hours.weekdays))
+            for hours in request.cities
+        ]
+        slots = find_overlap(tables, start, end, windows, max(request.min_minutes, 1) * 60)
+        return {
+            'cities': names,
+            'start': format_utc(start),
+            'end': format_utc(end),
+            'slots': describe_slots(slots, tables),
+            'total_minutes': sum(e - s for s, e in slots) // 60,
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error finding overlap for {names}: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={"message": "Internal server error", "error": str(e)}
+        )
+
+async def check_clock_subscription(cities: list, resolution: str):
+    """Validate a clock stream subscription, raising HTTPException if it is invalid."""
+    if not cities or len(cities) > MAX_BATCH_CITIES:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"Subscribe to between 1 and {MAX_BATCH_CITIES} cities", "count": len(cities)}
+        )
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"resolution must be one of {', '.join(RESOLUTIONS)}"}
+        )
+    if not get_snapshot().loaded:
+        try:
+            await load_snapshot()
+        except REDIS_UNAVAILABLE_ERRORS as e:
+            raise redis_unavailable(e)
+    missing = get_clock_hub().unknown_cities(cities)
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail={"message": "City not found", "cities": missing}
+        )
+
+@app.get("/stream/clock")
+async def stream_clock(cities: List[str] = Query(...), resolution: str = 'second'):
+    """Server-Sent Events stream of the current time in the given cities.
+
+    Sends a 'tick' event every second (or every minute), and a 'transition'
+    event as soon as a city's UTC offset changes.
+    """
+    await check_clock_subscription(cities, resolution)
+    hub = get_clock_hub()
+    subscriber = hub.subscribe(cities, resolution)
+
+    async def events():
+        try:
+            while True:
+                yield sse_event(*await subscriber.next_frame())
+        finally:
+            hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _retrieve_send_error(task: asyncio.Task):
+    """Retrieve the error of a finished WebSocket sender, so asyncio does not log it as never retrieved.
+
+    Sends fail routinely once the client has gone away; the receive loop
+    notices the disconnect and cleans up.
+    """
+    if not task.cancelled() and task.exception() is not None:
+        logging.debug("WebSocket clock sender stopped: %r", task.exception())
+
+@app.websocket("/ws/clock")
+async def websocket_clock(websocket: WebSocket):
+    """WebSocket variant of /stream/clock.
+
+    The client sends {"cities": [...], "resolution": "second"} to subscribe,
+    and may send another such message later to change its subscription.
+    """
+    await websocket.accept()
+    hub = get_clock_hub()
+    subscriber = None
+    sender = None
+
+    async def send_frames(current):
+        while True:
+            event, payload = await current.next_frame()
+            if payload is not None:
+                await websocket.send_text(payload.decode('utf-8'))
+
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+                if not isinstance(message, dict):
+                    raise ValueError("Expected a JSON object")
+                cities = message.get('cities') or []
+                resolution = message.get('resolution', 'second')
+                await check_clock_subscription(cities, resolution)
+            except ValueError as e:
+                await websocket.send_json({'event': 'error', 'status': 400, 'detail': {'message': str(e)}})
+                continue
+            except HTTPException as e:
+                await websocket.send_json({'event': 'error', 'status': e.status_code, 'detail': e.detail})
+                continue
+            if subscriber is not None:
+                sender.cancel()
+                hub.unsubscribe(subscriber)
+            subscriber = hub.subscribe(cities, resolution)
+            sender = asyncio.create_task(send_frames(subscriber))
+            sender.add_done_callback(_retrieve_send_error)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if subscriber is not None:
+            sender.cancel()
+            hub.unsubscribe(subscriber)
+
+@app.get("/health")
+async def health():
+    """Report the Redis circuit breaker, connection pool and snapshot state."""
+    snapshot = get_snapshot()
+    pool = {
+        'max_connections': redis_pool.max_connections,
+        # Private attributes of redis-py's pool, read defensively
+        'in_use': len(getattr(redis_pool, '_in_use_connections', ())),
+        'idle': len(getattr(redis_pool, '_available_connections', ())),
+    }
+    degraded = redis_breaker.state != redis_breaker.CLOSED
+    return {
+        'status': 'degraded' if degraded else 'ok',
+        'serving_from': 'snapshot' if snapshot.loaded else 'redis',
+        'snapshot': {
+            'loaded': snapshot.loaded,
+            'source': snapshot.source,
+            'version': snapshot.version,
+            'cities': len(snapshot.cities),
+        },
+        'redis': {'breaker': redis_breaker.stats(), 'pool': pool},
+        'clock_stream': get_clock_hub().stats(),
+        'response_cache': get_response_cache().stats(),
+        'single_flight': {flight.name: flight.stats() for flight in (location_flight, search_flight)},
+    }
 
 @app.get("/search")
-async def search_cities(query: str):
-    """Search for cities with case-insensitive matching."""
+async def search_cities(query: str, request: Request, fuzzy: bool = False):
+    """Search for cities with case- and accent-insensitive matching, optionally typo-tolerant."""
     try:
-        print(f"\n🔎 Search request received for: '{query}'")
-        
         # Only search if query is 3 or more characters
-        if len(query.strip()) < 3:
-            print("⚠️ Query too short (min 3 characters)")
+        query = normalize(query)
+        if len(query) < 3:
+            logging.debug("Search query %r too short (min 3 characters)", query)
             return []
             
-        query = query.lower().strip()
-        matches = []
-        
-        # Get all city keys from Redis
-        city_keys = await redis_client.hkeys('cities')
-        print(f"📚 Scanning through {len(city_keys)} cities")
-        
-        # Search through cities
-        for city_key in city_keys:
-            city_key = city_key.decode('utf-8')
-            # Get the city data directly without using it as a search key
-            city_data = await redis_client.hget('cities', city_key)  # Use the actual city key
-            
-            if city_data:
-                try:
-                    city = json.loads(city_data.decode('utf-8'))
-                    
-                    # Check if query matches any field
-                    search_fields = [
-                        city['city'].lower().strip(),
-                        city.get('state', '').lower().strip(),
-                        city.get('country', '').lower().strip()
-                    ]
-                    
-                    # Match if any field starts with the query
-                    if any(field.startswith(query) for field in search_fields):
-                        print(f"✅ Match found: {city['city']}, {city.get('state', '')}, {city['country']}")
-                        matches.append({
-                            'id': city.get('id', ''),
-                            'city': city['city'],
-                            'state': city.get('state', ''),
-                            'country': city['country'],
-                            'timezone': city['timezone'],
-                            'coordinates': city['coordinates']
-                        })
-                except json.JSONDecodeError as e:
-                    print(f"JSON decode error for city {city_key}: {e}")
-                    continue
-                except Exception as e:
-                    print(f"Unexpected error processing city {city_key}: {e}")
-                    continue
-        
-        if not matches:
-            print("❌ No matches found")
-            return []
-            
-        print(f"🎯 Found {len(matches[:5])} matches")
-        return matches[:5]  # Return top 5 results
+        now = get_clock().now_epoch()
+        cache_query = search_cache_query(query, fuzzy)
+        entry = await get_response_cache().get_search(cache_query, now)
+        if entry is None:
+            entry = await search_flight.do(cache_query, lambda: build_search_entry(query, now, fuzzy))
+        elif entry.needs_refresh(now):
+            search_flight.refresh(cache_query, lambda: build_search_entry(query, now, fuzzy))
+        return cached_response(request, *entry.render(now), SEARCH_CACHE_CONTROL)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"💥 Search error: {str(e)}")
         logging.error(f"Error searching for cities: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500, 
             detail={"message": "Error searching cities", "error": str(e)}
         )
 
+async def build_search_entry(query: str, now: float, fuzzy: bool = False):
+    """Search the index for a normalized query and cache the encoded results."""
+    snapshot = get_snapshot()
+    if not snapshot.loaded:
+        try:
+            snapshot = await load_snapshot()
+        except REDIS_UNAVAILABLE_ERRORS as e:
+            raise redis_unavailable(e)
+    
+    # Ranked lookup against the in-memory indexes, no Redis round trips
+    index = get_fuzzy_index() if fuzzy else get_search_index()
+    with STAGE_SECONDS.time('search', 'fuzzy_match' if fuzzy else 'prefix_match'):
+        city_keys = index.search(query, limit=5)
+    with STAGE_SECONDS.time('search', 'serialize'):
+        body = b'[' + b','.join(city_encoding(snapshot, city_key).search_result for city_key in city_keys) + b']'
+    
+    logging.debug("Search %r (fuzzy=%s) matched %d cities", query, fuzzy, len(city_keys))
+    # Top 5 results, cached until the data behind them changes
+    return await get_response_cache().put_search(search_cache_query(query, fuzzy), body, now, snapshot.version)
+
+# Shared secret for the admin routes; they are disabled while it is unset
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+# Upper bound on upserts plus deletes per admin batch
+MAX_CITY_CHANGES = int(os.getenv('MAX_CITY_CHANGES', 1000))
+
+def require_admin(token: str):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail={"message": "Invalid admin token"})
+
+@app.post("/admin/cities")
+async def change_cities(request: CityChangesRequest, x_admin_token: str = Header(None)):
+    """Upsert and delete many cities in one Redis transaction.
+
+    Only records and index entries that differ from what Redis holds are
+    written. API workers pick the change up through the data version.
+    """
+    require_admin(x_admin_token)
+    count = len(request.upsert) + len(request.delete)
+    if count > MAX_CITY_CHANGES:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"At most {MAX_CITY_CHANGES} changes per request", "count": count}
+        )
+    missing_ids = [i for i, city in enumerate(request.upsert) if city.get('id') is None]
+    if missing_ids:
+        raise HTTPException(status_code=400, detail={"message": "Cities without an id", "positions": missing_ids})
+
+    try:
+        changed = await apply_city_changes(request.upsert, request.delete)
+        version = await get_data_version()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"message": str(e)})
+    except REDIS_UNAVAILABLE_ERRORS as e:
+        raise redis_unavailable(e)
+    logging.info(f"Admin batch: {len(request.upsert)} upserts, {len(request.delete)} deletes, {changed} changed")
+    return {'changed': changed, 'version': version}
+
+def _cache_stat(stat: str):
+    def collect():
+        cache = get_response_cache()
+        return {(name,): getattr(cache, name).stats()[stat] for name in ('locations', 'searches')}
+    return collect
+
+def _hit_ratios():
+    ratios = {}
+    for name in ('locations', 'searches'):
+        stats = getattr(get_response_cache(), name).stats()
+        lookups = stats['hits'] + stats['misses']
+        ratios[(name,)] = stats['hits'] / lookups if lookups else 0.0
+    return ratios
+
+def _flight_stat(stat: str):
+    return lambda: {(flight.name,): flight.stats()[stat] for flight in (location_flight, search_flight)}
+
+for stat in ('hits', 'misses', 'evictions'):
+    registry.collected(
+        f'clockshift_response_cache_{stat}_total', f'In-process response cache {stat}', ('cache',), 'counter',
+        _cache_stat(stat)
+    )
+registry.collected('clockshift_response_cache_entries', 'Entries in the in-process response cache', ('cache',),
+                   'gauge', _cache_stat('entries'))
+registry.collected('clockshift_response_cache_hit_ratio', 'Hits over lookups since start', ('cache',), 'gauge',
+                   _hit_ratios)
+registry.collected('clockshift_single_flight_joined_total', 'Cache misses that joined an in-flight computation',
+                   ('flight',), 'counter', _flight_stat('joined'))
+registry.collected('clockshift_single_flight_leaders_total', 'Cache misses that started a computation',
+                   ('flight',), 'counter', _flight_stat('leaders'))
+registry.collected('clockshift_redis_breaker_open', '1 while the Redis circuit breaker is not closed', (), 'gauge',
+                   lambda: {(): int(redis_breaker.state != redis_breaker.CLOSED)})
+registry.collected('clockshift_redis_breaker_rejections_total', 'Calls rejected by the open Redis breaker', (),
+                   'counter', lambda: {(): redis_breaker.rejections})
+registry.collected('clockshift_snapshot_version', 'Data version of the loaded city snapshot', (), 'gauge',
+                   lambda: {(): get_snapshot().version or 0})
+registry.collected('clockshift_snapshot_cities', 'Cities in the loaded city snapshot', (), 'gauge',
+                   lambda: {(): len(get_snapshot().cities)})
+
+# Sync stats the sync process stores in Redis, refreshed on every scrape
+_sync_stats = {}
+
+def _sync_stat(stat: str):
+    return lambda: {(kind,): values[stat] for kind, values in _sync_stats.items() if stat in values}
+
+for stat, name, help, kind in (
+    ('duration_seconds', 'clockshift_sync_last_duration_seconds', 'Duration of the last successful sync', 'gauge'),
+    ('rows', 'clockshift_sync_last_rows', 'Rows read by the last successful sync', 'gauge'),
+    ('last_success', 'clockshift_sync_last_success_timestamp_seconds', 'Unix time of the last successful sync',
+     'gauge'),
+    ('failures', 'clockshift_sync_failures_total', 'Failed syncs', 'counter'),
+):
+    registry.collected(name, help, ('kind',), kind, _sync_stat(stat))
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this worker, plus the sync stats stored in Redis."""
+    try:
+        stats = await get_sync_stats()
+        _sync_stats.clear()
+        _sync_stats.update(stats)
+    except REDIS_UNAVAILABLE_ERRORS as e:
+        # Keep exporting the last stats read
+        logging.debug("Sync stats unavailable: %s", e)
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == "__main__":
     import uvicorn
+    _setup_logging()
     logging.info("Starting server...")
     uvicorn.run(app, host="0.0.0.0", port=8000)
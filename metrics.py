@@ -0,0 +1,182 @@
+import os
+import time
+import math
+from bisect import bisect_left
+
+# Set METRICS_ENABLED=0 to turn recording into no-ops
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+# Latency buckets in seconds, from 50 microseconds to 10 seconds
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric:
+    """Base for metrics with a fixed set of label names.
+
+    Values are plain Python numbers keyed by the tuple of label values.
+    Updates never await, so they are atomic with respect to the event loop
+    and need no locks; do not update them from other threads.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for values, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_labels(self.labels, values)} {_format_value(value)}')
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        if METRICS_ENABLED:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels):
+        if METRICS_ENABLED:
+            self._values[labels] = value
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram, rendered the way Prometheus expects."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        if not METRICS_ENABLED:
+            return
+        series = self._values.get(labels)
+        if series is None:
+            # One count per bucket plus +Inf, then the sum
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels) -> 'Timer':
+        """Context manager observing the time spent in its block."""
+        return Timer(self, labels)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for values, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), series):
+                cumulative += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, values)} {_format_value(series[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labels, values)} {cumulative}')
+        return lines
+
+class Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+class Collected(Metric):
+    """Metric whose values are read from a callback at scrape time.
+
+    collect() returns {label values tuple: value}, for state that other
+    components already count themselves (caches, circuit breaker).
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple, kind: str, collect):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> list:
+        self._values = self.collect()
+        return super().render()
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collected(self, name: str, help: str, labels: tuple, kind: str, collect) -> Collected:
+        return self.register(Collected(name, help, labels, kind, collect))
+
+    def render(self) -> str:
+        """Prometheus text exposition (version 0.0.4) of every metric."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# Shared by the API and the sync process
+REQUEST_SECONDS = registry.histogram(
+    'clockshift_request_duration_seconds', 'HTTP request latency by route template', ('route', 'method', 'status')
+)
+STAGE_SECONDS = registry.histogram(
+    'clockshift_stage_duration_seconds', 'Time spent in each stage of building a response', ('route', 'stage')
+)
+REDIS_COMMANDS = registry.counter(
+    'clockshift_redis_commands_total', 'Redis commands sent, including those inside pipelines', ('command',)
+)
+REDIS_SECONDS = registry.histogram(
+    'clockshift_redis_call_duration_seconds',
+    'Redis round trip latency; pipelines are labelled PIPELINE or MULTI', ('command',)
+)
+REDIS_ERRORS = registry.counter(
+    'clockshift_redis_errors_total', 'Redis round trips that raised', ('command', 'error')
+)
+SYNC_SECONDS = registry.histogram(
+    'clockshift_sync_duration_seconds', 'Duration of syncs run by this process', ('kind',),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+)
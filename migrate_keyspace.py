@@ -0,0 +1,148 @@
+"""
+Move city data from the previous Redis layout to the compact one, and report
+how much memory each layout uses.
+
+    python migrate_keyspace.py                 # write the compact layout, keep the old keys
+    python migrate_keyspace.py --drop-legacy   # then remove the old keys
+    python migrate_keyspace.py --report        # only print the memory report
+
+The previous layout kept every city as JSON twice (`cities` by name and
+`cities:data` by ID) plus a set per city name, country and name prefix. The
+compact layout is `cities:records` (encoded records by ID), `cities:ids`
+(name -> ID) and one `cities:index` sorted set for prefix lookups.
+
+Migration path: stop the old sync process, run this script (API workers
+still on the old code keep reading the old keys), deploy the new workers
+and sync, then run it with --drop-legacy. A full bulk sync also removes the
+old keys once the new code runs it. Data is read from Redis itself, so no
+Supabase access is needed.
+
+Sizes come from MEMORY USAGE where the server supports it. Otherwise (for
+example against fakeredis) they are estimates from payload sizes plus
+typical Redis per-key and per-element overheads, marked with "~".
+"""
+import sys
+import json
+import asyncio
+from redis.exceptions import ResponseError
+from redis_manager import (
+    CITY_IDS_KEY, CITY_INDEX_KEY, CITY_RECORDS_KEY, LEGACY_HASH_KEYS, LEGACY_SET_PATTERNS, SYNC_BATCH_SIZE,
+    build_keyspace, bulk_write_keyspace, redis_client
+)
+
+# Rough Redis 7 overheads used when MEMORY USAGE is unavailable
+_KEY_OVERHEAD = 56  # dict entry, key object and sds header
+_SMALL_ENTRIES = 128  # listpack/intset limits before a hashtable/skiplist is used
+_SMALL_VALUE = 64
+_SMALL_ELEMENT_OVERHEAD = 2
+_HASHTABLE_ELEMENT_OVERHEAD = 48
+_SKIPLIST_ELEMENT_OVERHEAD = 80
+
+REPORT_GROUPS = (
+    ('records', CITY_RECORDS_KEY),
+    ('name ids', CITY_IDS_KEY),
+    ('lex index', CITY_INDEX_KEY),
+    *((f'legacy {key}', key) for key in LEGACY_HASH_KEYS),
+    *((f'legacy {pattern}', pattern) for pattern in LEGACY_SET_PATTERNS),
+    ('dst_offsets', 'dst_offsets'),
+)
+
+async def read_legacy_cities() -> list:
+    """City rows from the previous layout, preferring the ID-keyed copy."""
+    for key in ('cities:data', 'cities'):
+        raw = await redis_client.hgetall(key)
+        if raw:
+            return [json.loads(payload.decode('utf-8')) for payload in raw.values()]
+    return []
+
+async def migrate() -> int:
+    """Write the compact layout from the previous one. Returns the number of cities moved."""
+    cities = await read_legacy_cities()
+    if not cities:
+        return 0
+    dst_raw = await redis_client.hgetall('dst_offsets')
+    dst_offsets = [json.loads(payload.decode('utf-8')) for payload in dst_raw.values()]
+    hashes, indexes = build_keyspace(cities, dst_offsets)
+    # Old API workers may still be reading the previous keys
+    await bulk_write_keyspace(hashes, indexes, remove_stale=False)
+    return len(hashes[CITY_RECORDS_KEY])
+
+async def drop_legacy_keys() -> int:
+    """Remove every key of the previous layout. Returns how many were removed."""
+    removed = await redis_client.unlink(*LEGACY_HASH_KEYS)
+    for pattern in LEGACY_SET_PATTERNS:
+        batch = []
+        async for key in redis_client.scan_iter(match=pattern, count=SYNC_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= SYNC_BATCH_SIZE:
+                removed += await redis_client.unlink(*batch)
+                batch = []
+        if batch:
+            removed += await redis_client.unlink(*batch)
+    return removed
+
+def _collection_size(elements: list, element_overhead: int) -> int:
+    small = len(elements) <= _SMALL_ENTRIES and all(len(element) <= _SMALL_VALUE for element in elements)
+    overhead = _SMALL_ELEMENT_OVERHEAD if small else element_overhead
+    return sum(len(element) + overhead for element in elements)
+
+async def estimate_key_size(key: bytes) -> int:
+    """Approximate memory of one key from its contents."""
+    kind = (await redis_client.type(key)).decode()
+    if kind == 'hash':
+        raw = await redis_client.hgetall(key)
+        # A listpack stores fields and values as separate elements
+        elements = [*raw.keys(), *raw.values()]
+        size = _collection_size(elements, _HASHTABLE_ELEMENT_OVERHEAD // 2)
+    elif kind == 'set':
+        size = _collection_size(list(await redis_client.smembers(key)), _HASHTABLE_ELEMENT_OVERHEAD)
+    elif kind == 'zset':
+        # Scores are 0, stored as one byte in a listpack and as a double in a skiplist
+        size = _collection_size(await redis_client.zrange(key, 0, -1), _SKIPLIST_ELEMENT_OVERHEAD + 8)
+    else:
+        size = len(await redis_client.get(key) or b'')
+    return _KEY_OVERHEAD + len(key) + size
+
+async def key_size(key: bytes, exact: bool):
+    if exact:
+        try:
+            return await redis_client.memory_usage(key, samples=0) or 0, True
+        except ResponseError:
+            pass
+    return await estimate_key_size(key), False
+
+async def memory_report() -> list:
+    """Return (group, keys, bytes, exact) for each layout key group present."""
+    rows = []
+    exact = True
+    for group, pattern in REPORT_GROUPS:
+        keys = [key async for key in redis_client.scan_iter(match=pattern, count=SYNC_BATCH_SIZE)]
+        if not keys:
+            continue
+        total = 0
+        for key in keys:
+            size, exact = await key_size(key, exact)
+            total += size
+        rows.append((group, len(keys), total, exact))
+    return rows
+
+def print_report(title: str, rows: list):
+    print(title)
+    for group, keys, size, exact in rows:
+        print(f"  {group:<26} {keys:>8} keys {'' if exact else '~'}{size / 1024:>10,.1f} KiB")
+    total = sum(size for _, _, size, _ in rows)
+    exact = all(exact for *_, exact in rows)
+    print(f"  {'total':<26} {sum(keys for _, keys, _, _ in rows):>8} keys {'' if exact else '~'}{total / 1024:>10,.1f} KiB")
+
+async def main(args: list):
+    print_report("Before:", await memory_report())
+    if '--report' in args:
+        return
+    if '--drop-legacy' in args:
+        print(f"Removed {await drop_legacy_keys()} legacy keys")
+    else:
+        print(f"Migrated {await migrate()} cities")
+    print_report("After:", await memory_report())
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
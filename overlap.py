@@ -0,0 +1,97 @@
+import time
+from bisect import bisect_right
+
+DAY = 86400
+
+def working_intervals(table, start: int, end: int, window_start: int, window_end: int, weekdays) -> list:
+    """UTC [start, end) intervals in which a city's local time is within working hours.
+
+    window_start and window_end are seconds after local midnight; an end at
+    or before the start is a window running past midnight into the next day.
+    weekdays (Monday is 0) are the days a window may start on. Walks the
+    city's TransitionTable one constant-offset segment at a time, so local
+    hours shifted by a DST transition land at the right UTC instants, and a
+    window that a transition cuts through is split at it.
+    """
+    length = (window_end - window_start) % DAY or DAY
+    epochs, offsets = table.epochs, table.offsets
+    intervals = []
+    i = max(bisect_right(epochs, start) - 1, 0)
+    segment_start = start
+    while segment_start < end:
+        segment_end = min(epochs[i + 1], end) if i + 1 < len(epochs) else end
+        shift = offsets[i] * 60
+        # Local days whose window overlaps [segment_start, segment_end) at this offset
+        first = (segment_start + shift - window_start - length) // DAY + 1
+        last = (segment_end + shift - window_start - 1) // DAY
+        for day in range(first, last + 1):
+            # 1970-01-01 was a Thursday
+            if (day + 3) % 7 not in weekdays:
+                continue
+            opens = day * DAY + window_start - shift
+            s = max(opens, segment_start)
+            e = min(opens + length, segment_end)
+            if intervals and s <= intervals[-1][1]:
+                intervals[-1][1] = max(intervals[-1][1], e)
+            else:
+                intervals.append([s, e])
+        segment_start = segment_end
+        i += 1
+    return [tuple(interval) for interval in intervals]
+
+def intersect(a: list, b: list) -> list:
+    """Intersection of two sorted lists of disjoint (start, end) intervals."""
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        s = max(a[i][0], b[j][0])
+        e = min(a[i][1], b[j][1])
+        if s < e:
+            result.append((s, e))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+def find_overlap(tables: list, start: int, end: int, windows: list, min_seconds: int = 1) -> list:
+    """UTC (start, end) intervals of at least min_seconds in which every city is within hours.
+
+    windows[i] is the (window_start, window_end, weekdays) of tables[i], as
+    working_intervals takes them.
+    """
+    overlap = [(start, end)]
+    for table, (window_start, window_end, weekdays) in zip(tables, windows):
+        overlap = intersect(overlap, working_intervals(table, start, end, window_start, window_end, weekdays))
+        if not overlap:
+            break
+    return [(s, e) for s, e in overlap if e - s >= min_seconds]
+
+def format_utc(epoch: int) -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+def format_local(epoch: int, table, at: int = None) -> str:
+    """Local wall time at a UTC epoch second, ISO-8601 with its UTC offset.
+
+    The offset is the one in effect at `at` (default: epoch itself).
+    """
+    offset = table.lookup(epoch if at is None else at)[0]
+    sign = '-' if offset < 0 else '+'
+    hours, minutes = divmod(abs(offset), 60)
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(epoch + offset * 60)) + f'{sign}{hours:02d}:{minutes:02d}'
+
+def describe_slots(slots: list, tables: list) -> list:
+    """Response rows for overlap intervals, with each city's local start and end.
+
+    The local end is given in the offset in effect just before it, so a
+    slot cut short by a transition ends at the wall time it actually did.
+    """
+    return [
+        {
+            'start': format_utc(s),
+            'end': format_utc(e),
+            'minutes': (e - s) // 60,
+            'local': [{'start': format_local(s, table), 'end': format_local(e, table, e - 1)} for table in tables],
+        }
+        for s, e in slots
+    ]
@@ -1,152 +1,723 @@
 import os
 import json
+import uuid
 import logging
 import asyncio
+import time
+from datetime import datetime
 from supabase import create_client
-from redis.asyncio import Redis
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import RedisError, WatchError
 from dotenv import load_dotenv
+from sync_sources import PostgresSource, SupabaseSource, WATERMARK_COLUMN
+from log_config import LazyJson, setup_logging
+from resilience import CircuitBreaker
+from search_index import SEARCH_FIELDS, normalize, query_affected
+from city_records import decode_city, encode_city
+from metrics import REDIS_COMMANDS, REDIS_ERRORS, REDIS_SECONDS, SYNC_SECONDS
+from dst_transitions import compile_transitions
+from snapshot_file import SNAPSHOT_FILE, open_snapshot_file, write_snapshot_file
 
 # Load environment variables
 load_dotenv()
 
-# Supabase setup
+# Supabase setup. With SYNC_DATABASE_URL set, the sync reads Postgres
+# directly instead of going through the Supabase REST API.
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+SYNC_DATABASE_URL = os.getenv('SYNC_DATABASE_URL')
+_sync_source = None
+
+def get_sync_source():
+    """The sync's row source, created on first use (API workers never need one)."""
+    global _sync_source
+    if _sync_source is None:
+        if SYNC_DATABASE_URL:
+            _sync_source = PostgresSource(SYNC_DATABASE_URL)
+        else:
+            _sync_source = SupabaseSource(create_client(SUPABASE_URL, SUPABASE_KEY))
+    return _sync_source
 
 # Redis setup
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
+# Connections per process; callers wait up to REDIS_POOL_TIMEOUT for a free one
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 32))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 0.2))
+# Deadline for request-path reads, and for loading the full city tables
+REDIS_CALL_TIMEOUT = float(os.getenv('REDIS_CALL_TIMEOUT', 0.25))
+REDIS_LOAD_TIMEOUT = float(os.getenv('REDIS_LOAD_TIMEOUT', 10))
 
-redis_client = Redis(
+redis_pool = BlockingConnectionPool(
     host=REDIS_HOST,
     port=REDIS_PORT,
     db=0,
     password=REDIS_PASSWORD,
-    decode_responses=False,  # Keep responses as bytes
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT,
     socket_timeout=5,
-    socket_connect_timeout=5,
-    retry_on_timeout=True
+    socket_connect_timeout=2,
+    socket_keepalive=True,
+    health_check_interval=30,
+    retry_on_timeout=False  # The circuit breaker decides what to retry
 )
 
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('redis_manager.log'),
-        logging.StreamHandler()
-    ]
+def _command_name(args) -> str:
+    name = args[0]
+    return (name.decode() if isinstance(name, bytes) else str(name)).upper()
+
+class InstrumentedPipeline(Pipeline):
+    """Pipeline that records each flush as one PIPELINE or MULTI round trip."""
+
+    async def execute(self, raise_on_error: bool = True):
+        for args, _ in self.command_stack:
+            REDIS_COMMANDS.inc(_command_name(args))
+        label = 'MULTI' if self.is_transaction else 'PIPELINE'
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        except Exception as e:
+            REDIS_ERRORS.inc(label, type(e).__name__)
+            raise
+        finally:
+            REDIS_SECONDS.observe(time.perf_counter() - start, label)
+
+    async def immediate_execute_command(self, *args, **options):
+        # Commands sent right away while WATCHing keys
+        command = _command_name(args)
+        REDIS_COMMANDS.inc(command)
+        start = time.perf_counter()
+        try:
+            return await super().immediate_execute_command(*args, **options)
+        except Exception as e:
+            REDIS_ERRORS.inc(command, type(e).__name__)
+            raise
+        finally:
+            REDIS_SECONDS.observe(time.perf_counter() - start, command)
+
+class InstrumentedRedis(Redis):
+    """Redis client that counts and times every command (see metrics.py)."""
+
+    async def execute_command(self, *args, **options):
+        command = _command_name(args)
+        REDIS_COMMANDS.inc(command)
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception as e:
+            REDIS_ERRORS.inc(command, type(e).__name__)
+            raise
+        finally:
+            REDIS_SECONDS.observe(time.perf_counter() - start, command)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+redis_client = InstrumentedRedis(
+    connection_pool=redis_pool,
+    decode_responses=False  # Keep responses as bytes
+)
+
+# Guards request-path reads: fails fast while Redis is unhealthy
+redis_breaker = CircuitBreaker(
+    'redis',
+    failure_threshold=int(os.getenv('REDIS_BREAKER_THRESHOLD', 5)),
+    reset_timeout=float(os.getenv('REDIS_BREAKER_RESET', 5)),
+    call_timeout=REDIS_CALL_TIMEOUT,
+    errors=(RedisError, OSError)
 )
 
-async def sync_supabase_to_redis():
-    """Sync data from Supabase to Redis."""
+# Bumped whenever city or DST data changes so API workers can reload their snapshot
+DATA_VERSION_KEY = 'cities:version'
+# City records (see city_records.py) by ID, the ID owning each city name,
+# and a lexicographic index of "{normalized name}\0{field rank}{ID}" members
+# (all scored 0) over city, state and country names for ZRANGEBYLEX
+CITY_RECORDS_KEY = 'cities:records'
+CITY_IDS_KEY = 'cities:ids'
+CITY_INDEX_KEY = 'cities:index'
+# Keys of the previous layout: full JSON by name and by ID, plus a set per
+# name, country and name prefix. Removed by the next bulk sync or by
+# migrate_keyspace.py --drop-legacy.
+LEGACY_HASH_KEYS = ('cities', 'cities:data')
+LEGACY_SET_PATTERNS = ('cities:name:*', 'cities:country:*', 'cities:prefix:*')
+# Registry of live keys written by the last bulk sync, used to clean up stale keys
+SYNC_KEYS_KEY = 'cities:sync:keys'
+# Outcome of the last full and delta sync, for API workers to export as metrics
+SYNC_STATS_KEY = 'sync:stats'
+# Commands per pipeline flush (and fields/members per command) during bulk syncs
+SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', 1000))
+# Fetched pages the sync buffers ahead of the Redis writer. When they are
+# full, fetching pauses until the writer catches up.
+SYNC_QUEUE_PAGES = int(os.getenv('SYNC_QUEUE_PAGES', 4))
+# Staged keys expire after this many seconds if a sync dies before its swap
+SYNC_STAGING_TTL = int(os.getenv('SYNC_STAGING_TTL', 3600))
+# Records per HSCAN batch when walking the whole cities table
+CITY_SCAN_BATCH = int(os.getenv('CITY_SCAN_BATCH', 500))
+# Index entries read per ZRANGEBYLEX page by search_cities_by_prefix, and in
+# total; past the total, results for very common prefixes are approximate
+PREFIX_SCAN_PAGE = int(os.getenv('PREFIX_SCAN_PAGE', 500))
+PREFIX_SCAN_MAX = int(os.getenv('PREFIX_SCAN_MAX', 10000))
+
+# Delta syncs run every DELTA_SYNC_INTERVAL seconds; a full sync still runs
+# every FULL_SYNC_INTERVAL seconds as a safety net
+DELTA_SYNC_INTERVAL = float(os.getenv('DELTA_SYNC_INTERVAL', 5))
+FULL_SYNC_INTERVAL = float(os.getenv('FULL_SYNC_INTERVAL', 14400))
+# How often (in seconds) the snapshot exporter polls the data version
+SNAPSHOT_EXPORT_INTERVAL = float(os.getenv('SNAPSHOT_EXPORT_INTERVAL', 5))
+
+# Shared tier of the HTTP response cache (see response_cache.py)
+RESPONSE_CACHE_PREFIX = 'respcache:'
+# Cached search keys, so a city change can find the queries it affects
+SEARCH_CACHE_KEYS_KEY = 'respcache:search:keys'
+
+def location_cache_key(city_name: str) -> str:
+    return f'{RESPONSE_CACHE_PREFIX}location:{city_name}'
+
+def search_cache_key(query: str) -> str:
+    return f'{RESPONSE_CACHE_PREFIX}search:{query}'
+
+def city_search_terms(*cities) -> set:
+    """Normalized city, state and country names of the given cities (None entries skipped)."""
+    terms = {normalize(city.get(field)) for city in cities if city for field in SEARCH_FIELDS}
+    terms.discard('')
+    return terms
+
+async def get_cached_response(key: str):
+    """Read one shared-tier cached response (raw bytes or None)."""
+    return await redis_breaker.call(redis_client.get, key)
+
+async def set_cached_response(key: str, raw: bytes, expires_at: float, registry: str = None, registry_ttl: int = None):
+    """Store one shared-tier cached response until the epoch `expires_at`."""
+    async def write():
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.set(key, raw, pxat=int(expires_at * 1000))
+            if registry:
+                pipe.sadd(registry, key)
+                pipe.expire(registry, registry_ttl)
+            await pipe.execute()
+
+    await redis_breaker.call(write)
+
+async def invalidate_cached_responses(city_names, search_terms=()):
+    """Drop shared-tier cached responses affected by a change.
+
+    Removes the /location entries of city_names, and the /search entries
+    whose query is affected by search_terms. Failures are only
+    logged: API workers also ignore entries built before a change.
+    """
+    try:
+        stale = []
+        if search_terms:
+            start = len(search_cache_key(''))
+            for key in await redis_client.smembers(SEARCH_CACHE_KEYS_KEY):
+                query = key.decode('utf-8')[start:]
+                if query_affected(query, search_terms):
+                    stale.append(key)
+        keys = [location_cache_key(name) for name in city_names] + stale
+        if not keys:
+            return
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.unlink(*keys)
+            if stale:
+                pipe.srem(SEARCH_CACHE_KEYS_KEY, *stale)
+            await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Could not invalidate cached responses for {list(city_names)}: {str(e)}")
+
+async def stream_source_pages(source, tables: dict, changes: bool = False):
+    """Yield (table, rows) pages from several tables fetched concurrently.
+
+    Tables are read whole with iter_all, or with changes=True through
+    iter_changes from the watermark tables maps them to. One task per table fetches
+    ahead into a queue of SYNC_QUEUE_PAGES pages and waits while it is
+    full, so at most that many pages are held in memory however far the
+    Redis writer falls behind. A failed fetch is raised here.
+    """
+    queue = asyncio.Queue(maxsize=SYNC_QUEUE_PAGES)
+    done = object()
+
+    async def fetch(table, since):
+        pages = source.iter_changes(table, since) if changes else source.iter_all(table)
+        try:
+            async for rows in pages:
+                await queue.put((table, rows))
+        finally:
+            # Close the source's generator now, not whenever it is collected
+            await pages.aclose()
+
+    fetchers = [asyncio.create_task(fetch(table, since)) for table, since in tables.items()]
+
+    async def fetch_all():
+        await asyncio.wait(fetchers, return_when=asyncio.FIRST_EXCEPTION)
+        failed = next((task for task in fetchers if task.done() and not task.cancelled() and task.exception()), None)
+        if failed is None:
+            await queue.put(done)
+            return
+        # Stop the other fetches first, or they would wait on a full queue forever
+        await _cancel_tasks(fetchers)
+        await queue.put(failed.exception())
+
+    supervisor = asyncio.create_task(fetch_all())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        await _cancel_tasks([*fetchers, supervisor])
+
+async def _cancel_tasks(tasks: list):
+    """Cancel tasks and wait until they have all finished."""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+def newer_watermark(current, rows: list):
+    """The newer of a running watermark and the newest one among rows."""
+    return newest_watermark([*rows, {WATERMARK_COLUMN: current}])
+
+async def sync_supabase_to_redis(bulk: bool = True, source=None):
+    """Sync data from Supabase to Redis.
+
+    Both tables are read concurrently, page by page (see
+    stream_source_pages), and each page is written as it arrives. By
+    default pages are staged and the whole keyspace is swapped in
+    atomically at the end (see KeyspaceStager). Pass bulk=False to write
+    city batches in place instead. `source` defaults to get_sync_source().
+    A successful sync rewrites the snapshot file (see export_snapshot_file).
+    """
+    source = source or get_sync_source()
+    stager = KeyspaceStager() if bulk else None
+    watermarks = {'cities': None, 'dst_offsets': None}
+    counts = {'cities': 0, 'dst_offsets': 0}
+    started = time.perf_counter()
     try:
         logging.info("Starting Supabase to Redis sync...")
-        
-        # Sync cities table
-        cities_response = supabase.table('cities').select('*').execute()
-        if not cities_response.data:
+
+        async for table, rows in stream_source_pages(source, dict.fromkeys(watermarks)):
+            watermarks[table] = newer_watermark(watermarks[table], rows)
+            # Tombstoned rows are left out; in place, they are deleted below
+            tombstones = [row for row in rows if row.get('deleted_at')]
+            rows = [row for row in rows if not row.get('deleted_at')]
+            if table == 'cities':
+                cities = []
+                for city in rows:
+                    if not city.get('city'):
+                        logging.error(f"Invalid city data: {city}")
+                        continue
+                    cities.append(city)
+                counts[table] += len(cities)
+                if bulk:
+                    await stager.stage(*build_keyspace(cities, []))
+                elif cities or tombstones:
+                    await apply_city_changes(
+                        upserts=cities, deletes=[city['id'] for city in tombstones], bump_version=False
+                    )
+            else:
+                counts[table] += len(rows)
+                if bulk:
+                    await stager.stage(*build_keyspace([], rows))
+                else:
+                    # A city with a live row in this page keeps it
+                    live = {dst_offset['city'] for dst_offset in rows}
+                    deleted = {dst_offset['city'] for dst_offset in tombstones} - live
+                    if deleted:
+                        await redis_client.hdel('dst_offsets', *deleted)
+                    if rows:
+                        await redis_client.hset('dst_offsets', mapping={
+                            dst_offset['city']: json.dumps(dst_offset, ensure_ascii=False) for dst_offset in rows
+                        })
+
+        if not counts['cities']:
             logging.error("No cities found in Supabase!")
+            if bulk:
+                await stager.discard()
+            await record_sync('full', started, 0, failed=True)
             return
-            
-        logging.info(f"Found {len(cities_response.data)} cities in Supabase")
-        
-        for city in cities_response.data:
-            if not city.get('city'):
-                logging.error(f"Invalid city data: {city}")
-                continue
-                
-            # 1. Store full city data in a hash
-            await redis_client.hset(
-                'cities:data',  # Main data store
-                city['id'],     # Use ID as key instead of city name
-                json.dumps(city, ensure_ascii=False)
-            )
-            
-            # 2. Create search indexes
-            await redis_client.sadd(
-                f'cities:name:{city["city"].lower()}',  # Search by city name
-                city['id']
-            )
-            await redis_client.sadd(
-                f'cities:country:{city["country"].lower()}',  # Search by country
-                city['id']
-            )
-            
-            # 3. Optional: Create prefix search capability
-            for i in range(1, len(city['city'])):
-                prefix = city['city'][:i].lower()
-                await redis_client.sadd(f'cities:prefix:{prefix}', city['id'])
-            
-            logging.info(f"Updated city in Redis: {city['city']} ({city.get('country')})")
-        
-        # Sync dst_offsets table
-        dst_offsets_response = supabase.table('dst_offsets').select('*').execute()
-        for dst_offset in dst_offsets_response.data:
-            # Convert to JSON string with proper encoding
-            dst_json = json.dumps(dst_offset, ensure_ascii=False)
-            # Store in Redis with utf-8
-            await redis_client.hset('dst_offsets', 
-                                  dst_offset['city'].encode('utf-8'), 
-                                  dst_json.encode('utf-8'))
-            logging.info(f"Updated DST offset in Redis: {dst_offset['city']}")
+
+        logging.info(f"Synced {counts['cities']} cities and {counts['dst_offsets']} DST offsets from Supabase")
+        version = await stager.swap() if bulk else await bump_data_version()
+
+        # Later delta syncs only need rows changed after what we just loaded
+        await set_sync_watermark('cities', watermarks['cities'])
+        await set_sync_watermark('dst_offsets', watermarks['dst_offsets'])
         
-        logging.info("Data sync completed successfully")
+        await record_sync('full', started, counts['cities'] + counts['dst_offsets'])
+        logging.info(f"Data sync completed successfully (data version {version})")
+        await export_snapshot_file()
     except Exception as e:
+        if bulk:
+            await stager.discard()
+        await record_sync('full', started, 0, failed=True)
         logging.error(f"Error syncing data: {str(e)}", exc_info=True)
         raise
 
+def city_index_members(city: dict) -> list:
+    """Return the CITY_INDEX_KEY members for a city's city, state and country names."""
+    members = []
+    for rank, field in enumerate(SEARCH_FIELDS):
+        term = normalize(city.get(field))
+        if term:
+            members.append(f'{term}\0{rank}{city["id"]}')
+    return members
+
+def build_keyspace(cities: list, dst_offsets: list):
+    """Build the complete synced keyspace in memory.
+
+    Returns (hashes, indexes) where hashes maps key -> {field: value} and
+    indexes maps a sorted set key -> [member, ...], all scored 0. The API
+    resolves city names through CITY_IDS_KEY to records in CITY_RECORDS_KEY.
+    """
+    hashes = {CITY_RECORDS_KEY: {}, CITY_IDS_KEY: {}, 'dst_offsets': {}}
+    indexes = {CITY_INDEX_KEY: []}
+
+    for city in cities:
+        if not city.get('city'):
+            logging.error(f"Invalid city data: {city}")
+            continue
+        hashes[CITY_RECORDS_KEY][city['id']] = encode_city(city)
+        hashes[CITY_IDS_KEY][city['city']] = city['id']
+        indexes[CITY_INDEX_KEY].extend(city_index_members(city))
+
+    for dst_offset in dst_offsets:
+        hashes['dst_offsets'][dst_offset['city']] = json.dumps(dst_offset, ensure_ascii=False)
+
+    return hashes, indexes
+
+class KeyspaceStager:
+    """Stage a keyspace in chunks under a unique namespace, then swap it in atomically.
+
+    stage() pipelines writes in batches of SYNC_BATCH_SIZE commands under
+    a unique staging prefix; staged keys expire after SYNC_STAGING_TTL
+    seconds in case the process dies before swapping. swap() then renames
+    every staged key over its live key in a single MULTI/EXEC, unlinks
+    live keys the new data no longer has and bumps the data version, so
+    readers see either the old or the new data, never a mix.
+    """
+
+    def __init__(self):
+        self.prefix = f'cities:staging:{uuid.uuid4().hex}:'
+        self.hash_keys = set()
+        self.live_keys = {}
+
+    async def stage(self, hashes: dict, indexes: dict):
+        """Add one chunk of (hashes, indexes), as built by build_keyspace."""
+        self.hash_keys.update(hashes)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key, mapping in hashes.items():
+                items = list(mapping.items())
+                for start in range(0, len(items), SYNC_BATCH_SIZE):
+                    pipe.hset(self.prefix + key, mapping=dict(items[start:start + SYNC_BATCH_SIZE]))
+                    if len(pipe) >= SYNC_BATCH_SIZE:
+                        await pipe.execute()
+            for key, members in indexes.items():
+                for start in range(0, len(members), SYNC_BATCH_SIZE):
+                    pipe.zadd(self.prefix + key, dict.fromkeys(members[start:start + SYNC_BATCH_SIZE], 0))
+                    if len(pipe) >= SYNC_BATCH_SIZE:
+                        await pipe.execute()
+            new_keys = [key for key, mapping in [*hashes.items(), *indexes.items()] if mapping and key not in self.live_keys]
+            for key in new_keys:
+                pipe.expire(self.prefix + key, SYNC_STAGING_TTL)
+            await pipe.execute()
+        self.live_keys.update(dict.fromkeys(new_keys))
+
+    async def swap(self, remove_stale: bool = True) -> int:
+        """Swap every staged key in. Returns the new data version.
+
+        With remove_stale=False, keys the new data no longer has are left in place.
+        """
+        live_keys = list(self.live_keys)
+        logging.info(f"Staged {len(live_keys)} keys under {self.prefix}")
+        stale_keys = await get_synced_keys(self.hash_keys) - set(live_keys) if remove_stale else set()
+
+        async with redis_client.pipeline(transaction=True) as pipe:
+            for key in live_keys:
+                pipe.rename(self.prefix + key, key)
+                pipe.persist(key)
+            if stale_keys:
+                pipe.unlink(*stale_keys)
+            pipe.delete(SYNC_KEYS_KEY)
+            if live_keys:
+                pipe.sadd(SYNC_KEYS_KEY, *live_keys)
+            pipe.incr(DATA_VERSION_KEY)
+            results = await pipe.execute()
+
+        logging.info(f"Swapped in {len(live_keys)} keys, removed {len(stale_keys)} stale keys")
+        return results[-1]
+
+    async def discard(self):
+        """Remove whatever was staged, leaving no half-written generation behind."""
+        staged = [key async for key in redis_client.scan_iter(match=f'{self.prefix}*', count=SYNC_BATCH_SIZE)]
+        if staged:
+            await redis_client.unlink(*staged)
+
+async def bulk_write_keyspace(hashes: dict, indexes: dict, remove_stale: bool = True) -> int:
+    """Stage a complete keyspace and atomically swap it in (see KeyspaceStager).
+
+    With remove_stale=False, keys the new data no longer has are left in
+    place. Returns the new data version.
+    """
+    stager = KeyspaceStager()
+    try:
+        await stager.stage(hashes, indexes)
+        return await stager.swap(remove_stale)
+    except Exception:
+        await stager.discard()
+        raise
+
+async def get_synced_keys(hash_keys) -> set:
+    """Get the live keys written by the previous bulk sync.
+
+    Before the first bulk sync there is no registry, so fall back to the
+    keys the key-by-key sync and the previous layout create.
+    """
+    members = await redis_client.smembers(SYNC_KEYS_KEY)
+    if members:
+        return {member.decode('utf-8') for member in members}
+
+    keys = set(hash_keys) | {CITY_INDEX_KEY} | set(LEGACY_HASH_KEYS)
+    for pattern in LEGACY_SET_PATTERNS:
+        async for key in redis_client.scan_iter(match=pattern, count=SYNC_BATCH_SIZE):
+            keys.add(key.decode('utf-8'))
+    return keys
+
+async def delta_sync_supabase_to_redis(source=None) -> int:
+    """Apply only rows changed since the last sync.
+
+    Rows at or after each table's watermark are fetched page by page, both
+    tables concurrently, and applied as one apply_city_changes batch per
+    page (cities) or written directly (dst_offsets).
+    Rows with deleted_at set are tombstones and are removed. Rows that match
+    what Redis already holds are skipped, so re-reading the rows at the
+    watermark itself is free. The data version is bumped once if anything
+    changed, and then the snapshot file is rewritten. Returns the number of
+    rows that changed.
+    """
+    source = source or get_sync_source()
+    changed = 0
+    fetched = 0
+    started = time.perf_counter()
+    watermarks = {table: await get_sync_watermark(table) for table in ('cities', 'dst_offsets')}
+
+    try:
+        async for table, rows in stream_source_pages(source, dict(watermarks), changes=True):
+            fetched += len(rows)
+            watermarks[table] = newer_watermark(watermarks[table], rows)
+            if table == 'dst_offsets':
+                for dst_offset in rows:
+                    changed += await apply_dst_offset(dst_offset)
+                continue
+            latest = {}
+            for city in rows:
+                if not city.get('deleted_at') and not city.get('city'):
+                    logging.error(f"Invalid city data: {city}")
+                else:
+                    latest[city['id']] = city
+            changed += await apply_city_changes(
+                upserts=[city for city in latest.values() if not city.get('deleted_at')],
+                deletes=[city['id'] for city in latest.values() if city.get('deleted_at')],
+                bump_version=False
+            )
+
+        if changed:
+            version = await bump_data_version()
+            logging.info(f"Delta sync applied {changed} changes (data version {version})")
+
+        await set_sync_watermark('cities', watermarks['cities'])
+        await set_sync_watermark('dst_offsets', watermarks['dst_offsets'])
+    except Exception:
+        await record_sync('delta', started, 0, failed=True)
+        raise
+    await record_sync('delta', started, fetched)
+    if changed or (SNAPSHOT_FILE and not os.path.exists(SNAPSHOT_FILE)):
+        await export_snapshot_file()
+    return changed
+
+async def apply_dst_offset(dst_offset: dict) -> bool:
+    """Write or remove (for tombstones) one dst_offsets row. Returns True if Redis changed."""
+    city_name = dst_offset['city'].encode('utf-8')
+    old_raw = await redis_client.hget('dst_offsets', city_name)
+    if dst_offset.get('deleted_at'):
+        if old_raw is None:
+            return False
+        await redis_client.hdel('dst_offsets', city_name)
+        await invalidate_cached_responses([dst_offset['city']])
+        logging.info(f"Removed DST offset from Redis: {dst_offset['city']}")
+        return True
+
+    if old_raw and json.loads(old_raw.decode('utf-8')) == dst_offset:
+        return False
+    await redis_client.hset('dst_offsets', city_name,
+                            json.dumps(dst_offset, ensure_ascii=False).encode('utf-8'))
+    await invalidate_cached_responses([dst_offset['city']])
+    logging.info(f"Updated DST offset in Redis: {dst_offset['city']}")
+    return True
+
+def newest_watermark(rows: list):
+    """Return the newest watermark column value among rows, or None."""
+    values = [row[WATERMARK_COLUMN] for row in rows if row.get(WATERMARK_COLUMN)]
+    if not values:
+        return None
+    return max(values, key=_parse_watermark)
+
+def _parse_watermark(value: str):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return value
+
+async def get_sync_watermark(table: str):
+    """Get the stored change watermark for a table, or None before the first sync."""
+    watermark = await redis_client.get(f'sync:watermark:{table}')
+    return watermark.decode('utf-8') if watermark else None
+
+async def set_sync_watermark(table: str, watermark):
+    """Advance the stored change watermark for a table (no-op for None)."""
+    if watermark:
+        await redis_client.set(f'sync:watermark:{table}', watermark)
+
+async def record_sync(kind: str, started: float, rows: int, failed: bool = False):
+    """Record how a sync that began at perf_counter() `started` went.
+
+    Successes store their duration, row count and completion time in
+    SYNC_STATS_KEY; failures only bump a counter there. Problems writing
+    the stats are logged, never raised.
+    """
+    duration = time.perf_counter() - started
+    SYNC_SECONDS.observe(duration, kind)
+    try:
+        if failed:
+            await redis_client.hincrby(SYNC_STATS_KEY, f'{kind}:failures', 1)
+        else:
+            await redis_client.hset(SYNC_STATS_KEY, mapping={
+                f'{kind}:duration_seconds': duration,
+                f'{kind}:rows': rows,
+                f'{kind}:last_success': time.time(),
+            })
+    except RedisError as e:
+        logging.warning(f"Could not record {kind} sync stats: {str(e)}")
+
+async def get_sync_stats() -> dict:
+    """Read SYNC_STATS_KEY as {kind: {stat: value}}."""
+    raw = await redis_breaker.call(redis_client.hgetall, SYNC_STATS_KEY)
+    stats = {}
+    for field, value in raw.items():
+        kind, stat = field.decode('utf-8').split(':', 1)
+        stats.setdefault(kind, {})[stat] = float(value)
+    return stats
+
+async def bump_data_version():
+    """Increment the data version key and return the new version."""
+    return await redis_client.incr(DATA_VERSION_KEY)
+
+async def get_data_version():
+    """Get the current data version, or None if data was never versioned."""
+    version = await redis_breaker.call(redis_client.get, DATA_VERSION_KEY)
+    return int(version) if version is not None else None
+
+async def load_city_tables():
+    """Load all cities (keyed by name) and dst_offsets together with the data version.
+
+    All reads run in one MULTI/EXEC so the version always matches the data.
+    """
+    async def read_tables():
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.get(DATA_VERSION_KEY)
+            pipe.hgetall(CITY_IDS_KEY)
+            pipe.hgetall(CITY_RECORDS_KEY)
+            pipe.hgetall('dst_offsets')
+            return await pipe.execute()
+
+    version, ids, records, dst_raw = await redis_breaker.call(read_tables, timeout=REDIS_LOAD_TIMEOUT)
+
+    cities = {}
+    for name, city_id in ids.items():
+        record = records.get(city_id)
+        if record is None:
+            logging.error(f"City {name!r} points at missing record {city_id!r}")
+            continue
+        try:
+            cities[name.decode('utf-8')] = decode_city(record)
+        except (UnicodeDecodeError, ValueError) as e:
+            logging.error(f"Skipping unreadable city entry {name!r}: {str(e)}")
+
+    dst_offsets = {}
+    for name, payload in dst_raw.items():
+        try:
+            dst_offsets[name.decode('utf-8')] = json.loads(payload.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            logging.error(f"Skipping unreadable DST entry {name!r}: {str(e)}")
+
+    return (int(version) if version is not None else None), cities, dst_offsets
+
+async def export_snapshot_file(path: str = SNAPSHOT_FILE):
+    """Compile what Redis holds now into the snapshot file API workers read.
+
+    Does nothing if `path` is empty. Returns the data version written, or
+    None. Failures are logged, never raised: workers keep the last file.
+    """
+    if not path:
+        return None
+    try:
+        version, cities, dst_offsets = await load_city_tables()
+        if not cities:
+            return None
+        transitions = compile_transitions(cities, dst_offsets)
+        size = await asyncio.to_thread(write_snapshot_file, path, version, cities, dst_offsets, transitions)
+        logging.info(f"Wrote city snapshot v{version} to {path} ({len(cities)} cities, {size / 1024:.0f} KiB)")
+        return version
+    except Exception as e:
+        logging.error(f"Could not write snapshot file {path}: {str(e)}", exc_info=True)
+        return None
+
+async def run_snapshot_exporter(path: str = SNAPSHOT_FILE, interval: float = SNAPSHOT_EXPORT_INTERVAL):
+    """Rewrite the snapshot file whenever the data version in Redis changes.
+
+    Covers changes made outside the sync too (the admin endpoint). Run one
+    per host, next to API workers started with SHARED_SNAPSHOT.
+    """
+    existing = open_snapshot_file(path)
+    exported = existing.version if existing else None
+    del existing
+    while True:
+        try:
+            version = await get_data_version()
+            if version is not None and (version != exported or not os.path.exists(path)):
+                exported = await export_snapshot_file(path) or exported
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Snapshot exporter could not read the data version: {str(e)}")
+        await asyncio.sleep(interval)
+
 async def get_city_data(city_name: str):
     """Get city data from Redis."""
     try:
-        print(f"\n📥 Redis Manager: Received request for city: {city_name}")
-        
-        # Log Redis connection status
-        print(f"🔌 Redis connection: {redis_client}")
-        
-        # 1. Get data from Redis using the city name as key
-        print(f"🔍 Attempting Redis HGET on 'cities' with key: {city_name}")
-        city_data = await redis_client.hget('cities', city_name.encode('utf-8'))
-        
-        # Debug: Show all keys in Redis
-        all_keys = await redis_client.hkeys('cities')
-        print(f"📚 Available keys in Redis: {[key.decode('utf-8') if isinstance(key, bytes) else key for key in all_keys][:5]}... (showing first 5)")
-        
-        if city_data:
-            print(f"✅ Found data in Redis for: {city_name}")
-            print(f"📦 Raw Redis data: {city_data}")
-            
-            # 2. If data exists, decode if needed and parse it
-            if isinstance(city_data, bytes):
-                decoded_data = city_data.decode('utf-8')
-            else:
-                decoded_data = city_data
-            print(f"🔄 Decoded data: {decoded_data[:100]}...")  # Show first 100 chars
-            
-            parsed_data = json.loads(decoded_data)
-            print(f"📋 Parsed JSON: {json.dumps(parsed_data, indent=2)}\n")
-            
+        parsed_data = (await redis_breaker.call(read_city_records, [city_name]))[0]
+        if parsed_data:
+            logging.debug("Found city %s in Redis: %s", city_name, LazyJson(parsed_data))
             return parsed_data
             
-        print(f"❌ No data found in Redis for city: {city_name}")
-        print(f"💡 Debug: Key format used: {city_name.encode('utf-8')}\n")
+        logging.debug("No data found in Redis for city %s", city_name)
         return None
         
     except Exception as e:
-        print(f"💥 Redis Manager Error: {str(e)}")
-        print(f"🔍 Debug info:")
-        print(f"  - City name: {city_name}")
-        print(f"  - Redis client: {redis_client}")
-        print(f"  - Error type: {type(e).__name__}\n")
-        logging.error(f"Error fetching city data: {str(e)}", exc_info=True)
+        logging.error(
+            f"Error fetching city data for {city_name}: {str(e)}",
+            exc_info=True,
+            extra={'city': city_name, 'error_type': type(e).__name__}
+        )
         return None
 
 async def get_dst_data(city_name: str):
     """Get DST data from Redis."""
     try:
-        dst_data = await redis_client.hget('dst_offsets', city_name.encode('utf-8'))
+        dst_data = await redis_breaker.call(redis_client.hget, 'dst_offsets', city_name.encode('utf-8'))
         if dst_data:
             # Decode with utf-8 and parse JSON
             return json.loads(dst_data.decode('utf-8'))
@@ -155,131 +726,342 @@ async def get_dst_data(city_name: str):
         logging.error(f"Error fetching DST data: {str(e)}", exc_info=True)
         return None
 
+async def get_cities_data(city_names: list):
+    """Get city and DST data for many cities in one round trip.
+
+    Returns a list of (city_data, dst_data) pairs in the order of city_names,
+    with None for anything not found.
+    """
+    keys = [name.encode('utf-8') for name in city_names]
+
+    async def read_cities():
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hmget(CITY_IDS_KEY, keys)
+            pipe.hmget('dst_offsets', keys)
+            ids, dst_raw = await pipe.execute()
+        return await read_records(ids), dst_raw
+
+    cities, dst_raw = await redis_breaker.call(read_cities)
+    return [
+        (city, json.loads(dst.decode('utf-8')) if dst else None)
+        for city, dst in zip(cities, dst_raw)
+    ]
+
+async def read_records(city_ids: list) -> list:
+    """Decode the records of city_ids in order, with None for missing (or None) IDs."""
+    wanted = [city_id for city_id in city_ids if city_id is not None]
+    records = dict(zip(wanted, await redis_client.hmget(CITY_RECORDS_KEY, wanted))) if wanted else {}
+    return [decode_city(records[city_id]) if records.get(city_id) else None for city_id in city_ids]
+
+async def read_city_records(city_names: list) -> list:
+    """Resolve city names to their decoded records, with None for unknown names."""
+    ids = await redis_client.hmget(CITY_IDS_KEY, [name.encode('utf-8') for name in city_names])
+    return await read_records(ids)
+
+async def get_city_and_dst(city_name: str):
+    """Get city and DST data for one city in a single round trip.
+
+    Unlike get_city_data, errors are not swallowed: callers see RedisError,
+    timeouts and CircuitOpenError and can fall back to local data.
+    """
+    (city_data, dst_data), = await get_cities_data([city_name])
+    return city_data, dst_data
+
+async def scan_cities(cursor: int = 0, batch_size: int = CITY_SCAN_BATCH):
+    """Read one HSCAN batch of city records, starting at cursor.
+
+    Returns (next_cursor, cities); next_cursor is 0 once the scan is
+    complete. Records carry the full row, so a batch is one round trip. As
+    with any SCAN, a city changed mid-scan may be seen twice or not at all.
+    """
+    next_cursor, records = await redis_breaker.call(
+        redis_client.hscan, CITY_RECORDS_KEY, cursor, count=batch_size
+    )
+    cities = []
+    for city_id, record in records.items():
+        try:
+            cities.append(decode_city(record))
+        except (UnicodeDecodeError, ValueError) as e:
+            logging.error(f"Skipping unreadable city record {city_id!r}: {str(e)}")
+    return next_cursor, cities
+
+async def iter_cities(batch_size: int = CITY_SCAN_BATCH):
+    """Yield every stored city, reading batch_size records at a time."""
+    cursor = 0
+    while True:
+        cursor, cities = await scan_cities(cursor, batch_size)
+        for city in cities:
+            yield city
+        if cursor == 0:
+            return
+
 async def get_all_cities():
-    """Get all cities from Redis."""
+    """Get all cities from Redis (see iter_cities to avoid holding them all)."""
     try:
-        print("\n📥 Redis Manager: Fetching all cities")
-        cities = []
-        
-        # Get all city keys
-        city_keys = await redis_client.hkeys('cities')
-        print(f"📚 Found {len(city_keys)} cities in Redis")
-        
-        # Get data for each city
-        for city_key in city_keys:
-            city_key = city_key.decode('utf-8')
-            city = await get_city_data(city_key)
-            if city:
-                cities.append(city)
-                
-        return cities
-        
+        return [city async for city in iter_cities()]
     except Exception as e:
-        print(f"💥 Redis Manager Error getting all cities: {str(e)}")
         logging.error(f"Error fetching all cities: {str(e)}", exc_info=True)
         return []
 
 async def search_cities_by_prefix(query: str, limit: int = 5):
-    """Search cities by prefix using the new Redis structure"""
+    """Search cities whose city, state or country name starts with query, via ZRANGEBYLEX.
+
+    Ranks like PrefixIndex: city name matches before state matches before
+    country matches. Index entries are ordered by name, not field, so a
+    prefix shared by a populous state or country ("sa" for Saudi Arabia)
+    puts many lower-ranked entries ahead of later city matches. Entries
+    are therefore read page by page until `limit` city name matches are
+    found or the prefix is exhausted, reading at most PREFIX_SCAN_MAX.
+    Cities sharing one name are ordered by ID here, not by city name as
+    PrefixIndex orders them.
+    """
     try:
-        print(f"\n📥 Redis Manager: Searching cities with prefix: {query}")
+        query = normalize(query)
+        if not query:
+            return []
+        # 0xff never occurs in UTF-8, so it sorts after every name with this prefix
+        start = b'[' + query.encode('utf-8')
+        end = start + b'\xff'
+        # Per field rank, the first `limit` distinct city IDs in index order
+        ranked = [[] for _ in SEARCH_FIELDS]
+        scanned = 0
+        while scanned < PREFIX_SCAN_MAX:
+            members = await redis_client.zrangebylex(CITY_INDEX_KEY, start, end, 0, PREFIX_SCAN_PAGE)
+            scanned += len(members)
+            for member in members:
+                _, tail = member.decode('utf-8').split('\0', 1)
+                ids = ranked[int(tail[0])]
+                if len(ids) < limit and tail[1:] not in ids:
+                    ids.append(tail[1:])
+            if len(members) < PREFIX_SCAN_PAGE or len(ranked[0]) >= limit:
+                break
+            # Continue after the last member read
+            start = b'(' + members[-1]
+        logging.debug("Prefix %r read %d index entries", query, scanned)
+        city_ids = list(dict.fromkeys(city_id for ids in ranked for city_id in ids))[:limit]
+
         matches = []
-        query = query.lower().strip()
-        
-        # Get city IDs that match the prefix
-        city_ids = await redis_client.smembers(f'cities:prefix:{query}')
-        print(f"🔍 Found {len(city_ids)} potential matches")
-        
-        # Get full data for each matching city
-        for city_id in city_ids:
-            city_data = await redis_client.hget('cities:data', city_id)
-            if city_data:
-                try:
-                    city = json.loads(city_data.decode('utf-8'))
-                    matches.append({
-                        'id': city['id'],
-                        'city': city['city'],
-                        'state': city.get('state', ''),
-                        'country': city['country'],
-                        'timezone': city['timezone'],
-                        'coordinates': city['coordinates'],
-                        'currency': city.get('currency'),
-                        'languages_spoken': city.get('languages_spoken'),
-                        'national_holidays': city.get('national_holidays')
-                    })
-                    
-                    if len(matches) >= limit:
-                        break
-                        
-                except Exception as e:
-                    print(f"❌ Error parsing city data: {str(e)}")
-                    continue
-        
-        print(f"✅ Returning {len(matches)} matches")
+        for city in await read_records(city_ids):
+            if city:
+                matches.append({
+                    'id': city['id'],
+                    'city': city['city'],
+                    'state': city.get('state', ''),
+                    'country': city['country'],
+                    'timezone': city['timezone'],
+                    'coordinates': city['coordinates'],
+                    'currency': city.get('currency'),
+                    'languages_spoken': city.get('languages_spoken'),
+                    'national_holidays': city.get('national_holidays')
+                })
         return matches
         
     except Exception as e:
-        print(f"💥 Search error: {str(e)}")
+        logging.error(f"Error searching cities by prefix: {str(e)}", exc_info=True)
         return []
 
-async def clear_city_indexes(city_id: str, old_data: dict):
-    """Remove old indexes for a city"""
+# Attempts at a batch of city changes before giving up when the keys keep
+# changing under it
+CITY_CHANGE_RETRIES = int(os.getenv('CITY_CHANGE_RETRIES', 3))
+
+def plan_city_changes(upserts: dict, deletes: set, old_records: dict, name_owners: dict, namesakes: dict = None):
+    """Work out the minimal writes that turn the stored cities into the requested ones.
+
+    upserts maps city ID -> new row, deletes is a set of city IDs,
+    old_records maps every one of those IDs to its stored row (or None) and
+    name_owners maps every old and new city name to the ID that owns it in
+    CITY_IDS_KEY (or None). namesakes maps a city name to the IDs of stored
+    cities with exactly that name (see find_namesakes); when the owner of a
+    name is deleted or renamed, the name passes to the lowest remaining one
+    of them instead of leaving CITY_IDS_KEY. IDs are strings. Returns
+    (records, removed_ids, names, removed_names, added_members,
+    removed_members, changed) where changed lists (old row, new row) pairs,
+    with None for a missing side.
+    """
+    records = {}
+    removed_ids = []
+    changed = []
+    owners = dict(name_owners)
+    added_members = []
+    removed_members = []
+
+    for city_id in deletes:
+        old = old_records[city_id]
+        if old:
+            removed_ids.append(city_id)
+            changed.append((old, None))
+    for city_id, new in upserts.items():
+        old = old_records[city_id]
+        if old != new:
+            records[city_id] = encode_city(new)
+            changed.append((old, new))
+
+    for old, new in changed:
+        old_members = set(city_index_members(old)) if old else set()
+        new_members = set(city_index_members(new)) if new else set()
+        removed_members.extend(old_members - new_members)
+        added_members.extend(new_members - old_members)
+        # A name only leaves CITY_IDS_KEY while this city still owns it
+        if old and (not new or old['city'] != new['city']) and owners[old['city']] == str(old['id']):
+            owners[old['city']] = None
+    for _, new in changed:
+        if new:
+            owners[new['city']] = str(new['id'])
+    if namesakes:
+        leaving = {str(old['id']) for old, new in changed if old and (not new or old['city'] != new['city'])}
+        for name, city_id in owners.items():
+            if city_id is None and name_owners[name]:
+                remaining = [key for key in namesakes.get(name, ()) if key not in leaving]
+                if remaining:
+                    owners[name] = min(remaining, key=lambda key: (len(key), key))
+
+    names = {name: city_id for name, city_id in owners.items() if city_id and city_id != name_owners[name]}
+    removed_names = [name for name, city_id in owners.items() if not city_id and name_owners[name]]
+    return records, removed_ids, names, removed_names, added_members, removed_members, changed
+
+async def find_namesakes(client, names: list) -> dict:
+    """Map each name to the IDs of the stored cities with exactly that name.
+
+    Candidates come from the city name entries of CITY_INDEX_KEY, which
+    match on the normalized name, and are checked against their records.
+    """
+    candidates = {}
+    for name in names:
+        term = normalize(name)
+        if term:
+            start = f'[{term}\0{SEARCH_FIELDS.index("city")}'.encode('utf-8')
+            for member in await client.zrangebylex(CITY_INDEX_KEY, start, start + b'\xff'):
+                candidates.setdefault(name, []).append(member.decode('utf-8').split('\0', 1)[1][1:])
+    city_ids = list({city_id for ids in candidates.values() for city_id in ids})
+    if not city_ids:
+        return {}
+    stored = dict(zip(city_ids, await client.hmget(CITY_RECORDS_KEY, city_ids)))
+    return {
+        name: [city_id for city_id in ids if stored[city_id] and decode_city(stored[city_id])['city'] == name]
+        for name, ids in candidates.items()
+    }
+
+async def apply_city_changes(upserts=(), deletes=(), bump_version: bool = True) -> int:
+    """Upsert and delete many cities in one transaction.
+
+    upserts is a list of city rows (each with an id and a city name),
+    deletes a list of city IDs. Stored rows are read under WATCH, only the
+    records, name entries and index members that actually differ are
+    written, and everything (plus the data version bump) goes out in a
+    single MULTI/EXEC, so readers never see part of a batch. If another
+    writer touches the city keys in between, the batch is re-planned, up to
+    CITY_CHANGE_RETRIES times. Returns the number of cities that changed.
+    """
+    upserts = {str(city['id']): city for city in upserts}
+    deletes = {str(city_id) for city_id in deletes}
+    both = upserts.keys() & deletes
+    if both:
+        raise ValueError(f"Cities both upserted and deleted: {sorted(both)}")
+    invalid = [city_id for city_id, city in upserts.items() if not city.get('city')]
+    if invalid:
+        raise ValueError(f"Cities without a name: {invalid}")
+    city_ids = [*upserts, *deletes]
+    if not city_ids:
+        return 0
+
+    for attempt in range(CITY_CHANGE_RETRIES):
+        async with redis_client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(CITY_RECORDS_KEY, CITY_IDS_KEY)
+                stored = await pipe.hmget(CITY_RECORDS_KEY, city_ids)
+                old_records = {city_id: decode_city(raw) if raw else None for city_id, raw in zip(city_ids, stored)}
+                city_names = list({
+                    *(city['city'] for city in old_records.values() if city),
+                    *(city['city'] for city in upserts.values())
+                })
+                owners = await pipe.hmget(CITY_IDS_KEY, city_names) if city_names else []
+                name_owners = {name: owner.decode('utf-8') if owner else None for name, owner in zip(city_names, owners)}
+
+                records, removed_ids, names, removed_names, added, removed, changed = plan_city_changes(
+                    upserts, deletes, old_records, name_owners
+                )
+                if removed_names:
+                    # Hand names over to other cities that share them, if any
+                    namesakes = await find_namesakes(pipe, removed_names)
+                    records, removed_ids, names, removed_names, added, removed, changed = plan_city_changes(
+                        upserts, deletes, old_records, name_owners, namesakes
+                    )
+                if not changed:
+                    await pipe.unwatch()
+                    return 0
+
+                pipe.multi()
+                if removed:
+                    pipe.zrem(CITY_INDEX_KEY, *removed)
+                if removed_names:
+                    pipe.hdel(CITY_IDS_KEY, *removed_names)
+                if removed_ids:
+                    pipe.hdel(CITY_RECORDS_KEY, *removed_ids)
+                if records:
+                    pipe.hset(CITY_RECORDS_KEY, mapping=records)
+                if names:
+                    pipe.hset(CITY_IDS_KEY, mapping=names)
+                if added:
+                    pipe.zadd(CITY_INDEX_KEY, dict.fromkeys(added, 0))
+                if bump_version:
+                    pipe.incr(DATA_VERSION_KEY)
+                await pipe.execute()
+                break
+            except WatchError:
+                logging.info(f"City keys changed during a batch of {len(city_ids)} changes, retrying ({attempt + 1})")
+    else:
+        raise WatchError(f"City keys kept changing, gave up after {CITY_CHANGE_RETRIES} attempts")
+
+    await invalidate_cached_responses(
+        {city['city'] for pair in changed for city in pair if city},
+        city_search_terms(*(city for pair in changed for city in pair))
+    )
+    logging.info(
+        f"Applied {len(changed)} city changes: {len(records)} written, {len(removed_ids)} deleted, "
+        f"{len(added)} index entries added, {len(removed)} removed"
+    )
+    return len(changed)
+
+async def update_city(city_id: str, new_data: dict, bump_version: bool = True) -> bool:
+    """Update city data and all its indexes.
+
+    Returns False without writing anything if Redis already holds new_data.
+    """
     try:
-        old_name = old_data['city'].lower()
-        # Remove from name index
-        await redis_client.srem(f'cities:name:{old_name}', city_id)
-        # Remove from country index
-        await redis_client.srem(f'cities:country:{old_data["country"].lower()}', city_id)
-        # Remove from prefix indexes
-        for i in range(1, len(old_name)):
-            prefix = old_name[:i]
-            await redis_client.srem(f'cities:prefix:{prefix}', city_id)
+        return bool(await apply_city_changes(upserts=[{**new_data, 'id': new_data.get('id', city_id)}], bump_version=bump_version))
     except Exception as e:
-        print(f"Error clearing indexes: {str(e)}")
+        logging.error(f"Error updating city {city_id}: {str(e)}", exc_info=True)
+        raise
 
-async def update_city(city_id: str, new_data: dict):
-    """Update city data and all its indexes"""
+async def delete_city(city_id: str, bump_version: bool = True) -> bool:
+    """Remove a city and all its indexes. Returns False if the city was not stored."""
     try:
-        # Get old data to remove old indexes
-        old_data_raw = await redis_client.hget('cities:data', city_id)
-        if old_data_raw:
-            old_data = json.loads(old_data_raw.decode('utf-8'))
-            await clear_city_indexes(city_id, old_data)
-        
-        # Update main data
-        await redis_client.hset(
-            'cities:data',
-            city_id,
-            json.dumps(new_data, ensure_ascii=False)
-        )
-        
-        # Create new indexes
-        city_name = new_data['city'].lower()
-        await redis_client.sadd(f'cities:name:{city_name}', city_id)
-        await redis_client.sadd(f'cities:country:{new_data["country"].lower()}', city_id)
-        
-        # Create prefix indexes
-        for i in range(1, len(city_name) + 1):
-            prefix = city_name[:i]
-            await redis_client.sadd(f'cities:prefix:{prefix}', city_id)
-            
-        print(f"✅ Updated city: {new_data['city']}")
-        
+        return bool(await apply_city_changes(deletes=[city_id], bump_version=bump_version))
     except Exception as e:
-        print(f"💥 Error updating city: {str(e)}")
+        logging.error(f"Error deleting city {city_id}: {str(e)}", exc_info=True)
         raise
 
 async def main():
     """Main function to run the Redis manager."""
     try:
         await sync_supabase_to_redis()
+        last_full_sync = time.monotonic()
         while True:
-            await asyncio.sleep(14400)  # Sync every 4 hours
-            await sync_supabase_to_redis()
+            await asyncio.sleep(DELTA_SYNC_INTERVAL)
+            try:
+                if time.monotonic() - last_full_sync >= FULL_SYNC_INTERVAL:
+                    await sync_supabase_to_redis()
+                    last_full_sync = time.monotonic()
+                else:
+                    await delta_sync_supabase_to_redis()
+            except Exception as e:
+                # A failed cycle is retried on the next tick
+                logging.error(f"Sync cycle failed: {str(e)}", exc_info=True)
     except Exception as e:
         logging.error(f"Error in main loop: {str(e)}", exc_info=True)
         raise
 
 if __name__ == "__main__":
+    setup_logging('redis_manager.log')
     asyncio.run(main())
 
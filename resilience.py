@@ -0,0 +1,121 @@
+import time
+import asyncio
+import logging
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+class CircuitBreaker:
+    """Fail-fast guard around calls to an unreliable dependency.
+
+    Every call gets a deadline. After `failure_threshold` consecutive
+    failures (errors or timeouts) the breaker opens and rejects calls
+    immediately with CircuitOpenError. After `reset_timeout` seconds it lets
+    a single trial call through (half-open): success closes it again, failure
+    re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0,
+                 call_timeout: float = 0.5, errors: tuple = (Exception,)):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self.errors = errors
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejections = 0
+        self.last_failure = None
+        self.last_failure_at = None
+
+    async def call(self, fn, *args, timeout: float = None, **kwargs):
+        """Await fn(*args, **kwargs) under the breaker and a deadline."""
+        trial = self._before_call()
+        self.calls += 1
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), timeout or self.call_timeout)
+        except asyncio.TimeoutError as e:
+            self.timeouts += 1
+            self._on_failure(e, trial)
+            raise
+        except self.errors as e:
+            self._on_failure(e, trial)
+            raise
+        except BaseException:
+            # Not a dependency failure (e.g. cancellation), just free the trial slot
+            if trial:
+                self._trial_in_flight = False
+            raise
+        self._on_success(trial)
+        return result
+
+    def _before_call(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejections += 1
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            self.state = self.HALF_OPEN
+            logging.info(f"{self.name} circuit half-open, sending a trial call")
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                self.rejections += 1
+                raise CircuitOpenError(f"{self.name} circuit is half-open, trial call in flight")
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def _on_success(self, trial: bool):
+        self.successes += 1
+        self.consecutive_failures = 0
+        if trial:
+            self._trial_in_flight = False
+            self.state = self.CLOSED
+            self.opened_at = None
+            logging.info(f"{self.name} circuit closed")
+
+    def _on_failure(self, error: Exception, trial: bool):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_failure = f"{type(error).__name__}: {error}"
+        self.last_failure_at = time.time()
+        if trial:
+            self._trial_in_flight = False
+        if trial or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logging.warning(f"{self.name} circuit opened after {self.consecutive_failures} failures: {self.last_failure}")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def reset(self):
+        """Close the breaker and forget consecutive failures."""
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        """Breaker state and counters for health reporting."""
+        return {
+            'name': self.name,
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'calls': self.calls,
+            'successes': self.successes,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'rejections': self.rejections,
+            'last_failure': self.last_failure,
+            'last_failure_at': self.last_failure_at,
+        }
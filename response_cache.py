@@ -0,0 +1,319 @@
+import os
+import json
+import asyncio
+import hashlib
+import random
+import logging
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from fastapi import Request, Response
+from redis.exceptions import RedisError
+from redis_manager import (
+    SEARCH_CACHE_KEYS_KEY, city_search_terms, get_cached_response, location_cache_key, search_cache_key,
+    set_cached_response
+)
+from resilience import CircuitOpenError
+from search_index import query_affected
+
+# Entries kept per worker in the in-process tier
+LOCATION_CACHE_SIZE = int(os.getenv('LOCATION_CACHE_SIZE', 10000))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 2000))
+# Seconds a cached search result lives server-side, and in browsers and proxies
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 300))
+SEARCH_MAX_AGE = int(os.getenv('SEARCH_MAX_AGE', 60))
+# Entries are refreshed at a random point within this many seconds before
+# they expire, so entries built together do not all expire together
+LOCATION_REFRESH_JITTER = float(os.getenv('LOCATION_REFRESH_JITTER', 5))
+SEARCH_REFRESH_JITTER = float(os.getenv('SEARCH_REFRESH_JITTER', 30))
+# Also share cached responses between workers through Redis
+RESPONSE_CACHE_REDIS = os.getenv('RESPONSE_CACHE_REDIS', '').lower() in ('1', 'true', 'yes')
+
+# /location bodies change every second, so clients must revalidate; the
+# ETag lets them (and proxies) get a 304 for a repeat within the same second
+LOCATION_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+SEARCH_CACHE_CONTROL = f'public, max-age={SEARCH_MAX_AGE}'
+
+# Recent changes remembered for validating shared-tier search entries
+_MAX_TRACKED_CHANGES = 1000
+
+def _digest(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=8).hexdigest()
+
+class CachedResponse:
+    """Pre-encoded JSON body with its ETag, expiry and source data version.
+
+    Location bodies are stored as a per-minute template: `seconds_at` is the
+    offset of the seconds digits in current_time, patched in by render().
+    Offsets are whole minutes, so local seconds always equal UTC seconds.
+
+    From `refresh_at` on, callers should build a replacement early. A
+    `successor` built ahead of time takes over once this entry expires.
+    """
+
+    __slots__ = ('body', 'etag', 'expires_at', 'version', 'seconds_at', 'refresh_at', 'successor')
+
+    def __init__(self, body: bytes, expires_at: float, version=None, seconds_at: int = None, etag: str = None,
+                 refresh_jitter: float = 0.0):
+        self.body = body
+        self.etag = etag or _digest(body)
+        self.expires_at = expires_at
+        self.version = version
+        self.seconds_at = seconds_at
+        self.refresh_at = expires_at - random.uniform(0, refresh_jitter)
+        self.successor = None
+
+    def needs_refresh(self, now: float) -> bool:
+        return now >= self.refresh_at and self.successor is None
+
+    def render(self, epoch: float):
+        """Return (body, ETag header value) as of `epoch`."""
+        if self.seconds_at is None:
+            return self.body, f'"{self.etag}"'
+        seconds = b'%02d' % (int(epoch) % 60)
+        i = self.seconds_at
+        return self.body[:i] + seconds + self.body[i + 2:], f'"{self.etag}-{seconds.decode()}"'
+
+    def dump(self) -> bytes:
+        header = json.dumps({
+            'etag': self.etag, 'expires_at': self.expires_at,
+            'version': self.version, 'seconds_at': self.seconds_at,
+        })
+        return header.encode('utf-8') + b'\n' + self.body
+
+    @classmethod
+    def load(cls, raw: bytes) -> 'CachedResponse':
+        header, body = raw.split(b'\n', 1)
+        meta = json.loads(header)
+        return cls(body, meta['expires_at'], meta['version'], meta['seconds_at'], meta['etag'])
+
+class LRUCache:
+    """Bounded in-process map of key -> CachedResponse, evicting least recently used."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now: float):
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= now and entry.successor is not None:
+            entry = self._entries[key] = entry.successor
+        if entry is None or entry.expires_at <= now:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry: CachedResponse):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        return self._entries.pop(key, None)
+
+    def keys(self) -> list:
+        return list(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+def next_transition(transitions, epoch: float) -> float:
+    """UTC epoch of the first offset transition after `epoch`, or inf."""
+    if transitions is None:
+        return float('inf')
+    i = bisect_right(transitions.epochs, epoch)
+    return transitions.epochs[i] if i < len(transitions.epochs) else float('inf')
+
+class ResponseCache:
+    """Two-tier cache of encoded /location and /search responses.
+
+    The in-process LRU tier answers most requests. The optional Redis tier
+    (RESPONSE_CACHE_REDIS) lets workers share what they rendered.
+
+    Location entries are keyed by city and live until the next minute
+    boundary or UTC offset transition, whichever comes first. Search
+    entries are keyed by search_cache_query() and live SEARCH_CACHE_TTL
+    seconds.
+
+    apply_snapshot() drops only the entries affected by the cities that
+    changed between two snapshots. Redis entries carry the data version they
+    were built from, and are ignored if they predate a change that affects
+    them.
+    """
+
+    def __init__(self, shared: bool = RESPONSE_CACHE_REDIS):
+        self.shared = shared
+        self.locations = LRUCache(LOCATION_CACHE_SIZE)
+        self.searches = LRUCache(SEARCH_CACHE_SIZE)
+        # Redis entries older than this version are never trusted
+        self._min_version = None
+        self._city_changes = {}  # city name -> data version of its last change
+        self._search_changes = deque()  # (data version, search terms) per change
+
+    async def get_location(self, city_name: str, now: float):
+        entry = self.locations.get(city_name, now)
+        if entry is None and self.shared:
+            entry = await self._get_shared(location_cache_key(city_name), now)
+            if entry is not None and self._outdated(entry, self._city_changes.get(city_name)):
+                entry = None
+            if entry is not None:
+                self.locations.put(city_name, entry)
+        return entry
+
+    async def put_location(self, city_name: str, body: bytes, seconds_at: int, transitions, now: float,
+                           version=None, successor_of: CachedResponse = None) -> CachedResponse:
+        """Cache a /location body computed at `now` as a per-minute template.
+
+        seconds_at is the offset of the seconds digits of current_time in
+        body, as CityEncoding.location() returns it. With successor_of, the
+        entry was computed ahead of time for the moment successor_of
+        expires, and is attached to it instead.
+        """
+        expires_at = min((int(now) // 60 + 1) * 60, next_transition(transitions, now))
+        jitter = min(LOCATION_REFRESH_JITTER, (expires_at - now) / 2)
+        entry = CachedResponse(body, expires_at, version, seconds_at, refresh_jitter=jitter)
+        if successor_of is not None:
+            successor_of.successor = entry
+            return entry
+        self.locations.put(city_name, entry)
+        if self.shared:
+            await self._put_shared(location_cache_key(city_name), entry)
+        return entry
+
+    async def get_search(self, query: str, now: float):
+        entry = self.searches.get(query, now)
+        if entry is None and self.shared:
+            entry = await self._get_shared(search_cache_key(query), now)
+            if entry is not None and self._outdated(entry, self._search_change_version(query)):
+                entry = None
+            if entry is not None:
+                self.searches.put(query, entry)
+        return entry
+
+    async def put_search(self, query: str, body: bytes, now: float, version=None) -> CachedResponse:
+        """Cache the encoded search results for a normalized query."""
+        entry = CachedResponse(body, now + SEARCH_CACHE_TTL, version,
+                               refresh_jitter=min(SEARCH_REFRESH_JITTER, SEARCH_CACHE_TTL / 2))
+        self.searches.put(query, entry)
+        if self.shared:
+            await self._put_shared(search_cache_key(query), entry, registry=SEARCH_CACHE_KEYS_KEY)
+        return entry
+
+    def apply_snapshot(self, old, new):
+        """Drop entries affected by the differences between two city snapshots."""
+        if not old.loaded or old.source != 'redis' or new.source != 'redis':
+            # Anything cached so far came straight from Redis, without a
+            # version, or one side is a snapshot file, which is not diffed
+            self.locations.clear()
+            self.searches.clear()
+            self._min_version = new.version or 0
+            return
+
+        changed = {
+            name for name in old.cities.keys() | new.cities.keys()
+            if old.cities.get(name) != new.cities.get(name)
+        }
+        changed |= {
+            name for name in old.dst_offsets.keys() | new.dst_offsets.keys()
+            if old.dst_offsets.get(name) != new.dst_offsets.get(name)
+        }
+        if not changed:
+            return
+
+        terms = city_search_terms(
+            *(old.cities.get(name) for name in changed), *(new.cities.get(name) for name in changed)
+        )
+        for name in changed:
+            self.locations.pop(name)
+            self._city_changes[name] = new.version or 0
+        for query in self.searches.keys():
+            if query_affected(query, terms):
+                self.searches.pop(query)
+
+        if len(self._search_changes) >= _MAX_TRACKED_CHANGES:
+            # Forgetting a change means no longer trusting anything older than it
+            self._min_version = self._search_changes.popleft()[0]
+        self._search_changes.append((new.version or 0, terms))
+        logging.debug("Invalidated cached responses for %d changed cities", len(changed))
+
+    def _search_change_version(self, query: str):
+        versions = [version for version, terms in self._search_changes
+                    if query_affected(query, terms)]
+        return max(versions, default=None)
+
+    def _outdated(self, entry: CachedResponse, changed_at) -> bool:
+        if self._min_version is None:
+            # No snapshot loaded yet, nothing to compare against
+            return False
+        version = entry.version or 0
+        if version < self._min_version:
+            return True
+        return changed_at is not None and version < changed_at
+
+    async def _get_shared(self, key: str, now: float):
+        try:
+            raw = await get_cached_response(key)
+        except (CircuitOpenError, RedisError, OSError, asyncio.TimeoutError) as e:
+            logging.debug("Shared response cache read failed: %s", e)
+            return None
+        if raw is None:
+            return None
+        try:
+            entry = CachedResponse.load(raw)
+        except (ValueError, KeyError) as e:
+            logging.warning(f"Unreadable shared cache entry {key}: {str(e)}")
+            return None
+        return entry if entry.expires_at > now else None
+
+    async def _put_shared(self, key: str, entry: CachedResponse, registry: str = None):
+        try:
+            await set_cached_response(key, entry.dump(), entry.expires_at, registry, SEARCH_CACHE_TTL)
+        except (CircuitOpenError, RedisError, OSError, asyncio.TimeoutError) as e:
+            logging.debug("Shared response cache write failed: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            'shared': self.shared,
+            'locations': self.locations.stats(),
+            'searches': self.searches.stats(),
+        }
+
+def if_none_match(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match header matches etag."""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    candidates = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return '*' in candidates or etag in candidates
+
+def cached_response(request: Request, body: bytes, etag: str, cache_control: str) -> Response:
+    """JSON response for a cached body, or 304 if the client already has it."""
+    headers = {'ETag': etag, 'Cache-Control': cache_control}
+    if if_none_match(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+_cache = ResponseCache()
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache."""
+    return _cache
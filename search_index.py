@@ -0,0 +1,302 @@
+import os
+import heapq
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+
+# Fields searched, in ranking order: city matches beat state matches beat country matches
+SEARCH_FIELDS = ('city', 'state', 'country')
+
+# Most candidates, by shared trigrams, that a fuzzy query checks edit distance for
+FUZZY_MAX_CANDIDATES = int(os.getenv('FUZZY_MAX_CANDIDATES', 200))
+
+# Letters that do not decompose into a base letter plus a combining mark
+_FOLD = str.maketrans({'ł': 'l', 'ø': 'o', 'đ': 'd', 'ð': 'd', 'þ': 'th', 'æ': 'ae', 'œ': 'oe', 'ı': 'i'})
+
+# Marks fuzzy queries in response cache keys; normalize() never leaves
+# control characters in a query, so no prefix query can collide with it
+FUZZY_QUERY_MARK = '\x1f'
+
+def normalize(value) -> str:
+    """Normalize a name for matching: case- and accent-folded, so "Gdańsk" -> "gdansk"."""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(ch for ch in decomposed if unicodedata.category(ch) not in ('Mn', 'Cc'))
+    return stripped.casefold().translate(_FOLD).strip()
+
+def search_cache_query(query: str, fuzzy: bool = False) -> str:
+    """Response cache key for a normalized query in the given search mode."""
+    return FUZZY_QUERY_MARK + query if fuzzy else query
+
+def query_affected(cache_query: str, terms) -> bool:
+    """True if cached results for cache_query may change when cities with these search terms change."""
+    if cache_query.startswith(FUZZY_QUERY_MARK):
+        # Any new or changed name could be close enough to rank
+        return bool(terms)
+    return any(term.startswith(cache_query) for term in terms)
+
+class PrefixIndex:
+    """Sorted-array prefix index over city, state and country names.
+
+    Each field keeps its own sorted list of (normalized_name, city_key)
+    pairs. A query bisects to the first candidate and walks forward only
+    until the requested number of results is found, so lookups cost
+    O(log N + k) regardless of how many cities are indexed.
+    """
+
+    def __init__(self):
+        self._fields = {field: [] for field in SEARCH_FIELDS}
+        self._terms = {}  # city_key -> {field: normalized_name}
+
+    def __len__(self):
+        return len(self._terms)
+
+    def build(self, cities: dict):
+        """Rebuild the whole index from a {city_key: city_data} mapping."""
+        self._fields = {field: [] for field in SEARCH_FIELDS}
+        self._terms = {}
+        for key, city in cities.items():
+            terms = self._terms_for(city)
+            self._terms[key] = terms
+            for field, term in terms.items():
+                self._fields[field].append((term, key))
+        for entries in self._fields.values():
+            entries.sort()
+
+    def add_city(self, key: str, city: dict):
+        """Index a city, replacing any previous entry under the same key."""
+        self.remove_city(key)
+        terms = self._terms_for(city)
+        self._terms[key] = terms
+        for field, term in terms.items():
+            insort(self._fields[field], (term, key))
+
+    def remove_city(self, key: str):
+        """Drop a city from the index if it is present."""
+        terms = self._terms.pop(key, None)
+        if not terms:
+            return
+        for field, term in terms.items():
+            entries = self._fields[field]
+            pos = bisect_left(entries, (term, key))
+            if pos < len(entries) and entries[pos] == (term, key):
+                del entries[pos]
+
+    def apply_changes(self, old_cities: dict, new_cities: dict):
+        """Bring the index from old_cities to new_cities touching only changed keys."""
+        for key in old_cities.keys() - new_cities.keys():
+            self.remove_city(key)
+        for key, city in new_cities.items():
+            if old_cities.get(key) != city:
+                self.add_city(key, city)
+
+    def search(self, query: str, limit: int = 5) -> list:
+        """Return up to `limit` city keys whose city, state or country starts with query."""
+        query = normalize(query)
+        results = []
+        seen = set()
+        for field in SEARCH_FIELDS:
+            entries = self._fields[field]
+            pos = bisect_left(entries, (query,))
+            while pos < len(entries) and len(results) < limit:
+                term, key = entries[pos]
+                if not term.startswith(query):
+                    break
+                if key not in seen:
+                    seen.add(key)
+                    results.append(key)
+                pos += 1
+            if len(results) >= limit:
+                break
+        return results
+
+    @staticmethod
+    def _terms_for(city: dict) -> dict:
+        terms = {}
+        for field in SEARCH_FIELDS:
+            term = normalize(city.get(field))
+            if term:
+                terms[field] = term
+        return terms
+
+
+_EMPTY = frozenset()
+
+def _max_edits(query: str) -> int:
+    """Typos tolerated in a query: one up to five characters, two beyond."""
+    return 1 if len(query) <= 5 else 2
+
+def _trigrams(term: str, prefix: bool = False) -> set:
+    """Padded trigrams of a term; a prefix query is left open at the end."""
+    padded = '  ' + term if prefix else '  ' + term + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def prefix_distance(query: str, term: str, limit: int) -> int:
+    """Fewest edits turning query into some prefix of term, or limit + 1 if more than limit."""
+    m = len(query)
+    over = limit + 1
+    # Only cells within `limit` of the diagonal can stay within the limit
+    previous = [j if j <= limit else over for j in range(m + 1)]
+    best = previous[m]
+    for i, ch in enumerate(term[:m + limit], 1):
+        current = [i if i <= limit else over] + [over] * m
+        lowest = current[0]
+        for j in range(max(1, i - limit), min(m, i + limit) + 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (query[j - 1] != ch))
+            current[j] = cost if cost < over else over
+            if cost < lowest:
+                lowest = cost
+        if current[m] < best:
+            best = current[m]
+        if lowest > limit:
+            break
+        previous = current
+    return best if best <= limit else over
+
+class TrigramIndex:
+    """Typo-tolerant search over accent-folded city, state and country names.
+
+    Each distinct normalized name is indexed once by its trigrams, with the
+    (field, city_key) pairs that carry it. A query only looks at names that
+    share enough trigrams with it: an edit changes at most three trigrams,
+    so a name within the allowed edits shares all but 3 x edits of them, and
+    must appear in at least one of the query's rarest trigrams. Candidates
+    are ranked by trigram overlap less an edit distance penalty, measured
+    against the closest prefix of the name so partial input still matches.
+    """
+
+    def __init__(self):
+        self._grams = {}  # trigram -> set of names
+        self._owners = {}  # name -> {field: set of city keys}
+        self._terms = {}  # city_key -> {field: name}
+
+    def __len__(self):
+        return len(self._terms)
+
+    def build(self, cities: dict):
+        """Rebuild the whole index from a {city_key: city_data} mapping."""
+        self._grams = {}
+        self._owners = {}
+        self._terms = {}
+        for key, city in cities.items():
+            self.add_city(key, city)
+
+    def add_city(self, key: str, city: dict):
+        """Index a city, replacing any previous entry under the same key."""
+        self.remove_city(key)
+        terms = PrefixIndex._terms_for(city)
+        self._terms[key] = terms
+        for field, term in terms.items():
+            owners = self._owners.get(term)
+            if owners is None:
+                owners = self._owners[term] = {}
+                for gram in _trigrams(term):
+                    self._grams.setdefault(gram, set()).add(term)
+            owners.setdefault(field, set()).add(key)
+
+    def remove_city(self, key: str):
+        """Drop a city from the index if it is present."""
+        terms = self._terms.pop(key, None)
+        if not terms:
+            return
+        for field, term in terms.items():
+            owners = self._owners[term]
+            owners[field].discard(key)
+            if not owners[field]:
+                del owners[field]
+            if owners:
+                continue
+            del self._owners[term]
+            for gram in _trigrams(term):
+                names = self._grams[gram]
+                names.discard(term)
+                if not names:
+                    del self._grams[gram]
+
+    def apply_changes(self, old_cities: dict, new_cities: dict):
+        """Bring the index from old_cities to new_cities touching only changed keys."""
+        for key in old_cities.keys() - new_cities.keys():
+            self.remove_city(key)
+        for key, city in new_cities.items():
+            if old_cities.get(key) != city:
+                self.add_city(key, city)
+
+    def search(self, query: str, limit: int = 5) -> list:
+        """Return up to `limit` city keys whose names best match query, allowing typos.
+
+        The edit budget is raised one step at a time, and only while nothing
+        matches: a query that matches as typed is not padded out with typos.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        grams = [self._postings(gram) for gram in _trigrams(query, prefix=True)]
+        grams.sort(key=len)
+
+        for max_edits in range(_max_edits(query) + 1):
+            ranked = self._rank(query, grams, max_edits, limit)
+            if ranked:
+                break
+
+        results = []
+        seen = set()
+        for *_, keys in ranked:
+            # Common names (a country, say) can be shared by many cities
+            for key in heapq.nsmallest(limit + len(seen), keys):
+                if key not in seen:
+                    seen.add(key)
+                    results.append(self._city_key(key))
+                    if len(results) >= limit:
+                        return results
+        return results
+
+    # Storage accessors, overridden by snapshot_file.MappedTrigramIndex, where
+    # postings hold term numbers and owners hold record numbers instead
+
+    def _postings(self, gram: str):
+        """Names containing a trigram."""
+        return self._grams.get(gram, _EMPTY)
+
+    def _name(self, name) -> str:
+        return name
+
+    def _owners_of(self, name) -> dict:
+        """{field: city keys} of the cities carrying a name."""
+        return self._owners[name]
+
+    def _city_key(self, key) -> str:
+        return key
+
+    def _rank(self, query: str, grams: list, max_edits: int, limit: int) -> list:
+        """Names exactly max_edits from a prefix of query, as sorted (-score, field rank, length, name, keys)."""
+        needed = max(min(len(grams), 2), len(grams) - 3 * max_edits)
+        # Only the postings of the len - needed + 1 rarest trigrams are read in full
+        rarest = len(grams) - needed + 1
+        shared = Counter()
+        for names in grams[:rarest]:
+            shared.update(names)
+        candidates = set(shared)
+        for names in grams[rarest:]:
+            shared.update(candidates.intersection(names))
+
+        # With the edit count fixed, the score only depends on shared trigrams,
+        # so names are checked best first until enough cities are found
+        ranked = []
+        found = 0
+        checked = 0
+        last_count = None
+        for name, count in shared.most_common():
+            if count < needed or checked >= FUZZY_MAX_CANDIDATES:
+                break
+            if found >= limit and count != last_count:
+                break
+            checked += 1
+            last_count = count
+            text = self._name(name)
+            if prefix_distance(query, text, max_edits) != max_edits:
+                continue
+            score = count / len(grams) - max_edits / len(query)
+            for field, keys in self._owners_of(name).items():
+                ranked.append((-score, SEARCH_FIELDS.index(field), len(text), text, keys))
+                found += len(keys)
+        ranked.sort()
+        return ranked
@@ -0,0 +1,61 @@
+"""
+Run the API as several uvicorn worker processes sharing one copy of the city data.
+
+    WORKERS=8 python serve.py
+
+WORKERS defaults to the number of CPUs. Every worker maps the same
+compiled snapshot file (SNAPSHOT_FILE, default city_snapshot.bin)
+read-only, so the cities, DST transition tables and search and geo
+indexes are held once in the page cache, however many workers run. A
+single snapshot exporter process, started here, rewrites the file
+whenever the data version in Redis changes. Workers notice the replaced
+file within SNAPSHOT_REFRESH_INTERVAL and remap it. Until the file first
+exists, workers load their own snapshot from Redis as usual. The sync
+process still runs separately (python redis_manager.py).
+
+This is an entry point of its own because uvicorn starts workers with
+the spawn method, which re-runs the parent's __main__ script in each of
+them; main.py as that script would be imported twice per worker.
+"""
+import os
+import asyncio
+import logging
+import multiprocessing
+from log_config import setup_logging
+
+HOST = os.getenv('HOST', '0.0.0.0')
+PORT = int(os.getenv('PORT', 8000))
+DEFAULT_SNAPSHOT_FILE = 'city_snapshot.bin'
+
+def run_snapshot_exporter_process(path: str):
+    """Entry point of the snapshot exporter process."""
+    from main import _setup_logging
+    from redis_manager import run_snapshot_exporter
+    _setup_logging()
+    try:
+        asyncio.run(run_snapshot_exporter(path))
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    import uvicorn
+    workers = int(os.getenv('WORKERS') or os.cpu_count() or 1)
+    snapshot_path = os.getenv('SNAPSHOT_FILE') or DEFAULT_SNAPSHOT_FILE
+    # Workers and the exporter import main.py in new processes, so their
+    # settings go through the environment
+    os.environ.update(WORKERS=str(workers), SHARED_SNAPSHOT='1', SNAPSHOT_FILE=snapshot_path)
+    setup_logging('main.log', max_bytes=0)
+
+    exporter = multiprocessing.get_context('spawn').Process(
+        target=run_snapshot_exporter_process, args=(snapshot_path,), name='snapshot-exporter', daemon=True
+    )
+    exporter.start()
+    logging.info(f"Starting {workers} workers sharing {snapshot_path}...")
+    try:
+        uvicorn.run('main:app', host=HOST, port=PORT, workers=workers)
+    finally:
+        exporter.terminate()
+        exporter.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import os
+import asyncio
+import logging
+
+# Longest a caller waits on someone else's in-flight call before making its own
+SINGLE_FLIGHT_MAX_WAIT = float(os.getenv('SINGLE_FLIGHT_MAX_WAIT', 1.0))
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one in-flight call.
+
+    The first caller for a key starts the work as its own task; callers
+    arriving while it runs await the same task instead of repeating it.
+    Waiting is bounded by max_wait, after which a caller runs the work
+    itself. The shared task is shielded, so a caller that disconnects does
+    not cancel the work for everyone else.
+    """
+
+    def __init__(self, name: str, max_wait: float = SINGLE_FLIGHT_MAX_WAIT):
+        self.name = name
+        self.max_wait = max_wait
+        self.enabled = True
+        self._calls = {}
+
+        self.leaders = 0
+        self.joined = 0
+        self.timeouts = 0
+        self.refreshes = 0
+
+    def _start(self, key, fn) -> asyncio.Task:
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+
+        def done(finished):
+            if self._calls.get(key) is finished:
+                del self._calls[key]
+
+        task.add_done_callback(done)
+        return task
+
+    async def do(self, key, fn):
+        """Return await fn(), sharing one call among concurrent callers with the same key."""
+        if not self.enabled:
+            return await fn()
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            return await asyncio.shield(self._start(key, fn))
+
+        self.joined += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.max_wait)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return await fn()
+
+    def refresh(self, key, fn):
+        """Run fn() in the background unless a call for key is already in flight."""
+        if key in self._calls:
+            return
+        self.refreshes += 1
+        task = self._start(key, fn)
+
+        def log_failure(finished):
+            if not finished.cancelled() and finished.exception() is not None:
+                logging.warning(f"Background refresh of {self.name} {key!r} failed: {finished.exception()!r}")
+
+        task.add_done_callback(log_failure)
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'joined': self.joined,
+            'timeouts': self.timeouts,
+            'refreshes': self.refreshes,
+        }
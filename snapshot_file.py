@@ -0,0 +1,479 @@
+"""
+Compiled city snapshot file, memory-mapped by API workers.
+
+The sync writes the file after every successful run, and the snapshot
+exporter rewrites it whenever the data version changes (see
+export_snapshot_file and run_snapshot_exporter in redis_manager). A fresh
+worker maps it and serves every read endpoint straight from it, with no
+network: at boot until the first snapshot from Redis replaces it, or for
+good with SHARED_SNAPSHOT, where all workers on a host map the same file
+and share its pages. Nothing is parsed up front: lookups binary-search the
+mapped records and decode only what they hit.
+
+Layout, all integers little-endian: a header (magic, format version,
+CRC32, data version, created_at, transition window) and a directory of
+(offset, rows) for each of _SECTIONS, followed by the sections:
+
+    strings         UTF-8 names and search terms, encode_city records and
+                    dst_offsets JSON, each stored once; referenced by (offset, length)
+    records         one fixed-width _RECORD per city, sorted by UTF-8 name
+    tables          one _TABLE (first entry, entry count) per distinct TransitionTable
+    entries         _ENTRY (epoch, offset minutes, is_dst) rows of all tables
+    prefix_<field>  per SEARCH_FIELDS field, _TERM (term, record) rows
+                    sorted by (term, name), the order PrefixIndex keeps
+    fuzzy_terms     TrigramIndex names, sorted, each with its owners per field
+    fuzzy_owners    record numbers of those owners
+    fuzzy_grams     sorted trigrams, each with its run of postings
+    fuzzy_postings  fuzzy_terms numbers containing each trigram
+    geo_coords      GeoIndex tree as x, y, z doubles
+    geo_keys        record number of each tree node
+    geo_axes        split axis of each tree node
+
+The CRC covers the whole file, with the CRC field itself zeroed. Files are
+replaced atomically, so a worker never maps a half-written one.
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import zlib
+import logging
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timezone
+from city_records import decode_city, encode_city
+from dst_transitions import TransitionTable, transition_window
+from geo_index import GeoIndex
+from search_index import SEARCH_FIELDS, PrefixIndex, TrigramIndex, normalize
+
+# Where the sync writes the compiled snapshot and API workers read it;
+# unset disables the file. Both must see the same local disk.
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', '')
+
+MAGIC = b'CSSNAP\r\n'
+FORMAT_VERSION = 2
+
+_RECORD = struct.Struct('<IIIIIIi')
+_TABLE = struct.Struct('<II')
+_ENTRY = struct.Struct('<qhBx')
+_TERM = struct.Struct('<III')
+_FUZZY_TERM = struct.Struct('<III%dI' % len(SEARCH_FIELDS))
+_GRAM = struct.Struct('<IIII')
+
+# Sections in file order, with the size of one row
+_SECTIONS = (
+    ('strings', 1), ('records', _RECORD.size), ('tables', _TABLE.size), ('entries', _ENTRY.size),
+    *((f'prefix_{field}', _TERM.size) for field in SEARCH_FIELDS),
+    ('fuzzy_terms', _FUZZY_TERM.size), ('fuzzy_owners', 4), ('fuzzy_grams', _GRAM.size), ('fuzzy_postings', 4),
+    ('geo_coords', 8), ('geo_keys', 4), ('geo_axes', 1),
+)
+_HEADER = struct.Struct('<8sHHIqdqq' + 'QQ' * len(_SECTIONS))
+_CRC_FIELD = 3
+
+class SnapshotFileError(ValueError):
+    """The snapshot file is truncated, corrupt or of another format version."""
+
+class _StringTable:
+    def __init__(self):
+        self.data = bytearray()
+        self._offsets = {}
+
+    def add(self, value: bytes):
+        """Store value once and return its (offset, length)."""
+        ref = self._offsets.get(value)
+        if ref is None:
+            ref = self._offsets[value] = (len(self.data), len(value))
+            self.data += value
+        return ref
+
+def write_snapshot_file(path: str, version, cities: dict, dst_offsets: dict, transitions: dict, now: datetime = None) -> int:
+    """Compile a snapshot to `path`, replacing any previous file atomically.
+
+    `transitions` is compile_transitions(cities, dst_offsets, now); tables
+    shared between cities are stored once. The search and geo indexes are
+    built here with the same code API workers use. Returns the file size
+    in bytes.
+    """
+    strings = _StringTable()
+    names = sorted(cities, key=lambda name: name.encode('utf-8'))
+    positions = {name: i for i, name in enumerate(names)}
+    sections = {name: bytearray() for name, _ in _SECTIONS}
+
+    table_ids = {}
+    entry_count = 0
+    for name in names:
+        table = transitions.get(name)
+        table_id = -1
+        if table is not None:
+            table_id = table_ids.get(id(table))
+            if table_id is None:
+                table_id = table_ids[id(table)] = len(table_ids)
+                rows = table.entries()
+                sections['tables'] += _TABLE.pack(entry_count, len(rows))
+                for epoch, offset, dst in rows:
+                    sections['entries'] += _ENTRY.pack(epoch, offset, dst)
+                entry_count += len(rows)
+        dst_data = dst_offsets.get(name)
+        dst_ref = strings.add(json.dumps(dst_data, ensure_ascii=False).encode('utf-8')) if dst_data else (0, 0)
+        sections['records'] += _RECORD.pack(
+            *strings.add(name.encode('utf-8')), *strings.add(encode_city(cities[name])), *dst_ref, table_id
+        )
+
+    for field in SEARCH_FIELDS:
+        rows = []
+        for name in names:
+            term = PrefixIndex._terms_for(cities[name]).get(field)
+            if term:
+                rows.append((term.encode('utf-8'), name.encode('utf-8'), positions[name]))
+        rows.sort()
+        for term, _, position in rows:
+            sections[f'prefix_{field}'] += _TERM.pack(*strings.add(term), position)
+
+    fuzzy = TrigramIndex()
+    fuzzy.build(cities)
+    terms = sorted(fuzzy._owners, key=lambda term: term.encode('utf-8'))
+    term_ids = {term: i for i, term in enumerate(terms)}
+    owner_count = 0
+    for term in terms:
+        owners = fuzzy._owners[term]
+        counts = []
+        for field in SEARCH_FIELDS:
+            records = sorted(positions[key] for key in owners.get(field, ()))
+            sections['fuzzy_owners'] += struct.pack(f'<{len(records)}I', *records)
+            counts.append(len(records))
+        sections['fuzzy_terms'] += _FUZZY_TERM.pack(*strings.add(term.encode('utf-8')), owner_count, *counts)
+        owner_count += sum(counts)
+    posting_count = 0
+    for gram in sorted(fuzzy._grams, key=lambda gram: gram.encode('utf-8')):
+        postings = sorted(term_ids[term] for term in fuzzy._grams[gram])
+        sections['fuzzy_grams'] += _GRAM.pack(*strings.add(gram.encode('utf-8')), posting_count, len(postings))
+        sections['fuzzy_postings'] += struct.pack(f'<{len(postings)}I', *postings)
+        posting_count += len(postings)
+
+    geo = GeoIndex()
+    geo.build(cities)
+    coords, keys, axes = geo.arrays()
+    sections['geo_coords'] += struct.pack(f'<{len(coords)}d', *coords)
+    sections['geo_keys'] += struct.pack(f'<{len(keys)}I', *(positions[key] for key in keys))
+    sections['geo_axes'] += axes
+    sections['strings'] = strings.data
+
+    directory = []
+    body = bytearray()
+    for name, row_size in _SECTIONS:
+        directory += [_HEADER.size + len(body), len(sections[name]) // row_size]
+        body += sections[name]
+        # Keep every section 8-byte aligned for memoryview casts
+        body += bytes(-len(body) % 8)
+
+    window_start, window_end = transition_window(now)
+    fields = [
+        MAGIC, FORMAT_VERSION, 0, 0, -1 if version is None else int(version), time.time(),
+        window_start, window_end, *directory,
+    ]
+    fields[_CRC_FIELD] = zlib.crc32(body, zlib.crc32(_HEADER.pack(*fields)))
+
+    # Write beside the target and rename over it, so readers see the old file or the new one
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(*fields))
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return _HEADER.size + len(body)
+
+class _MappedColumn(Mapping):
+    """Read-only {city name: value} view of one column of a MappedSnapshot."""
+
+    def __init__(self, snapshot, get):
+        self._snapshot = snapshot
+        self._get = get
+
+    def __getitem__(self, name):
+        value = self._get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def get(self, name, default=None):
+        value = self._get(name)
+        return default if value is None else value
+
+    def __iter__(self):
+        return iter(self._snapshot.names())
+
+    def __len__(self):
+        return self._snapshot.city_count
+
+class _MappedNames(Sequence):
+    """City names of an array of record numbers, decoded on access."""
+
+    def __init__(self, snapshot, records):
+        self._snapshot = snapshot
+        self._records = records
+
+    def __getitem__(self, i):
+        return self._snapshot.name(self._records[i])
+
+    def __len__(self):
+        return len(self._records)
+
+class MappedSnapshot:
+    """City snapshot served from a memory-mapped snapshot file.
+
+    Has the interface of city_cache.CitySnapshot. Cities and DST entries are
+    decoded on every lookup (response caching sits above this), while
+    TransitionTables are built once per distinct table and kept, as are the
+    response encodings of cities served (up to ENCODED_CITY_CACHE_SIZE).
+    Nothing else is held per process, so workers mapping one file share
+    its memory.
+    """
+
+    source = 'file'
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._open()
+        except (struct.error, SnapshotFileError):
+            self._map.close()
+            raise
+        self.path = path
+        # Identifies this file; a replaced file has a new inode
+        self.stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.loaded = True
+        self._tables = {}
+        # city name -> CityEncoding of the cities served so far
+        self.encodings = {}
+        self.cities = _MappedColumn(self, self.get_city)
+        self.dst_offsets = _MappedColumn(self, self.get_dst)
+        self.transitions = _MappedColumn(self, self.get_transitions)
+
+    def _open(self):
+        data = self._map
+        if sys.byteorder != 'little':
+            raise SnapshotFileError("snapshot files can only be mapped on little-endian machines")
+        if len(data) < _HEADER.size:
+            raise SnapshotFileError("file is shorter than its header")
+        fields = list(_HEADER.unpack_from(data))
+        if fields[0] != MAGIC:
+            raise SnapshotFileError("not a city snapshot file")
+        if fields[1] != FORMAT_VERSION:
+            raise SnapshotFileError(f"format version {fields[1]}, expected {FORMAT_VERSION}")
+        crc = fields[_CRC_FIELD]
+        fields[_CRC_FIELD] = 0
+        if zlib.crc32(memoryview(data)[_HEADER.size:], zlib.crc32(_HEADER.pack(*fields))) != crc:
+            raise SnapshotFileError("checksum mismatch")
+
+        version, self.created_at, self.window_start, self.window_end = fields[4:8]
+        self.version = None if version < 0 else version
+        self._sections = {}
+        directory = fields[8:]
+        for i, (name, row_size) in enumerate(_SECTIONS):
+            offset, rows = directory[2 * i], directory[2 * i + 1]
+            # The CRC catches damage, but a bad writer must not cause out-of-bounds reads
+            if offset + rows * row_size > len(data):
+                raise SnapshotFileError(f"section {name} extends past the end of the file")
+            self._sections[name] = (offset, rows)
+        self.city_count = self._sections['records'][1]
+
+    def rows(self, section: str) -> int:
+        return self._sections[section][1]
+
+    def unpack(self, section: str, layout: struct.Struct, row: int) -> tuple:
+        """Unpack one fixed-width row of a section."""
+        return layout.unpack_from(self._map, self._sections[section][0] + row * layout.size)
+
+    def array(self, section: str, format: str, start: int = 0, count: int = None):
+        """Zero-copy view of `count` rows of a section of plain numbers, from row `start`."""
+        offset, rows = self._sections[section]
+        size = struct.calcsize(format)
+        count = rows - start if count is None else count
+        return memoryview(self._map)[offset + start * size:offset + (start + count) * size].cast(format)
+
+    def string(self, offset: int, length: int) -> bytes:
+        start = self._sections['strings'][0] + offset
+        return self._map[start:start + length]
+
+    def _name(self, position: int) -> bytes:
+        name_offset, name_length, *_ = self.unpack('records', _RECORD, position)
+        return self.string(name_offset, name_length)
+
+    def name(self, position: int) -> str:
+        """Name of the city in record `position`."""
+        return self._name(position).decode('utf-8')
+
+    def _position(self, city_name: str):
+        """Index of a city's record, found by binary search over the sorted names."""
+        target = city_name.encode('utf-8')
+        low, high = 0, self.city_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self.city_count and self._name(low) == target else None
+
+    def names(self):
+        """City names in file order."""
+        return [self.name(position) for position in range(self.city_count)]
+
+    def get_city(self, city_name: str):
+        """Get city data by name, or None if the city is unknown."""
+        position = self._position(city_name)
+        if position is None:
+            return None
+        _, _, record_offset, record_length, *_ = self.unpack('records', _RECORD, position)
+        return decode_city(self.string(record_offset, record_length))
+
+    def get_dst(self, city_name: str):
+        """Get DST data by city name, or None if the city has no DST entry."""
+        position = self._position(city_name)
+        if position is None:
+            return None
+        *_, dst_offset, dst_length, _ = self.unpack('records', _RECORD, position)
+        return json.loads(self.string(dst_offset, dst_length)) if dst_length else None
+
+    def get_transitions(self, city_name: str):
+        """Get the compiled offset TransitionTable for a city, or None."""
+        position = self._position(city_name)
+        if position is None:
+            return None
+        table_id = self.unpack('records', _RECORD, position)[-1]
+        if table_id < 0:
+            return None
+        table = self._tables.get(table_id)
+        if table is None:
+            first, count = self.unpack('tables', _TABLE, table_id)
+            rows = [self.unpack('entries', _ENTRY, row) for row in range(first, first + count)]
+            table = self._tables[table_id] = TransitionTable([(epoch, offset, bool(dst)) for epoch, offset, dst in rows])
+        return table
+
+    def covers(self, epoch: float) -> bool:
+        """True if the compiled transitions are valid at a UTC epoch second."""
+        return self.window_start <= epoch < self.window_end
+
+    def geo_index(self) -> GeoIndex:
+        """GeoIndex over the mapped tree."""
+        return GeoIndex.from_arrays(
+            self.array('geo_coords', 'd'), _MappedNames(self, self.array('geo_keys', 'I')), self.array('geo_axes', 'B')
+        )
+
+class MappedPrefixIndex:
+    """PrefixIndex.search over the sorted prefix sections of a MappedSnapshot."""
+
+    def __init__(self, snapshot: MappedSnapshot):
+        self._snapshot = snapshot
+
+    def _term(self, section: str, row: int):
+        term_offset, term_length, record = self._snapshot.unpack(section, _TERM, row)
+        return self._snapshot.string(term_offset, term_length), record
+
+    def search(self, query: str, limit: int = 5) -> list:
+        """Return up to `limit` city keys whose city, state or country starts with query."""
+        query = normalize(query).encode('utf-8')
+        results = []
+        seen = set()
+        for field in SEARCH_FIELDS:
+            section = f'prefix_{field}'
+            count = self._snapshot.rows(section)
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                if self._term(section, middle)[0] < query:
+                    low = middle + 1
+                else:
+                    high = middle
+            while low < count and len(results) < limit:
+                term, record = self._term(section, low)
+                if not term.startswith(query):
+                    break
+                if record not in seen:
+                    seen.add(record)
+                    results.append(self._snapshot.name(record))
+                low += 1
+            if len(results) >= limit:
+                break
+        return results
+
+class MappedTrigramIndex(TrigramIndex):
+    """TrigramIndex.search over the fuzzy sections of a MappedSnapshot.
+
+    Postings are term numbers and owners record numbers, read as zero-copy
+    arrays; only the candidate names a query checks are decoded.
+    """
+
+    def __init__(self, snapshot: MappedSnapshot):
+        self._snapshot = snapshot
+
+    def __len__(self):
+        return self._snapshot.city_count
+
+    def _postings(self, gram: str):
+        target = gram.encode('utf-8')
+        snapshot = self._snapshot
+        low, high = 0, snapshot.rows('fuzzy_grams')
+        while low < high:
+            middle = (low + high) // 2
+            offset, length, first, count = snapshot.unpack('fuzzy_grams', _GRAM, middle)
+            term = snapshot.string(offset, length)
+            if term == target:
+                return snapshot.array('fuzzy_postings', 'I', first, count)
+            if term < target:
+                low = middle + 1
+            else:
+                high = middle
+        return ()
+
+    def _name(self, term: int) -> str:
+        offset, length, *_ = self._snapshot.unpack('fuzzy_terms', _FUZZY_TERM, term)
+        return self._snapshot.string(offset, length).decode('utf-8')
+
+    def _owners_of(self, term: int) -> dict:
+        _, _, first, *counts = self._snapshot.unpack('fuzzy_terms', _FUZZY_TERM, term)
+        owners = {}
+        for field, count in zip(SEARCH_FIELDS, counts):
+            if count:
+                owners[field] = self._snapshot.array('fuzzy_owners', 'I', first, count)
+            first += count
+        return owners
+
+    def _city_key(self, record: int) -> str:
+        return self._snapshot.name(record)
+
+def open_snapshot_file(path: str = SNAPSHOT_FILE):
+    """Map the snapshot file at `path`, or return None if it is unset, missing or unusable."""
+    if not path:
+        return None
+    try:
+        snapshot = MappedSnapshot(path)
+    except FileNotFoundError:
+        logging.info(f"No snapshot file at {path}")
+        return None
+    except (OSError, ValueError, struct.error) as e:
+        logging.warning(f"Ignoring snapshot file {path}: {str(e)}")
+        return None
+    if not snapshot.covers(datetime.now(timezone.utc).timestamp()):
+        logging.warning(f"Ignoring snapshot file {path}: its DST transitions do not cover the current date")
+        return None
+    return snapshot
+
+def snapshot_file_changed(snapshot, path: str = SNAPSHOT_FILE) -> bool:
+    """True if the file at `path` is not the one `snapshot` mapped."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return getattr(snapshot, 'stamp', None) != (stat.st_ino, stat.st_mtime_ns, stat.st_size)
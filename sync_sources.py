@@ -0,0 +1,166 @@
+"""Row sources for the Supabase to Redis sync.
+
+Delta syncs rely on two column conventions on every synced table:
+
+    updated_at timestamptz not null default now()  -- refreshed on every update
+    deleted_at timestamptz                          -- tombstone, set instead of deleting
+
+updated_at can be kept current with the moddatetime extension that ships
+with Supabase:
+
+    create extension if not exists moddatetime;
+    create trigger cities_updated_at before update on cities
+        for each row execute procedure moddatetime(updated_at);
+
+Sources hand rows out as async pages of at most SYNC_PAGE_SIZE rows using
+keyset pagination: full reads walk `id` upwards, change reads walk
+(watermark, id). Unlike offset pagination, rows updated while a read is in
+progress cannot shift others out of it, and each page is an indexed range
+scan. Every synced table therefore also needs a unique, ordered `id`.
+"""
+import os
+import json
+import asyncio
+from datetime import datetime, timezone
+
+# Column used as the per-table change watermark
+WATERMARK_COLUMN = os.getenv('SYNC_WATERMARK_COLUMN', 'updated_at')
+# Rows per page. PostgREST caps responses at 1000 rows by default (max-rows),
+# so larger pages are silently truncated by Supabase.
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 1000))
+
+class KeysetSource:
+    """Base for sources that hand out rows one keyset page at a time.
+
+    Subclasses implement fetch_page(table, changes, since, after, limit):
+    up to `limit` rows ordered by id, or, with changes, by (watermark, id)
+    starting at the `since` watermark; `after` is the last row of the
+    previous page, or None for the first one.
+    """
+
+    async def iter_all(self, table: str, page_size: int = SYNC_PAGE_SIZE):
+        """Yield every row of a table, in pages."""
+        async for rows in self._iter_pages(table, False, None, page_size):
+            yield rows
+
+    async def iter_changes(self, table: str, since=None, page_size: int = SYNC_PAGE_SIZE):
+        """Yield rows changed at or after the `since` watermark, oldest first, in pages."""
+        async for rows in self._iter_pages(table, True, since, page_size):
+            yield rows
+
+    async def _iter_pages(self, table: str, changes: bool, since, page_size: int):
+        after = None
+        while True:
+            rows = await self.fetch_page(table, changes, since, after, page_size)
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            after = rows[-1]
+
+class SupabaseSource(KeysetSource):
+    """Reads sync rows from Supabase tables.
+
+    The supabase client is synchronous, so each page request runs in the
+    default thread pool instead of blocking the event loop.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def fetch_page(self, table: str, changes: bool, since, after, limit: int) -> list:
+        query = self.client.table(table).select('*')
+        if changes:
+            query = query.order(WATERMARK_COLUMN).order('id')
+            if after:
+                mark = after[WATERMARK_COLUMN]
+                query = query.or_(
+                    f'{WATERMARK_COLUMN}.gt."{mark}",and({WATERMARK_COLUMN}.eq."{mark}",id.gt.{after["id"]})'
+                )
+            elif since:
+                query = query.gte(WATERMARK_COLUMN, since)
+        else:
+            query = query.order('id')
+            if after:
+                query = query.gt('id', after['id'])
+        return (await asyncio.to_thread(query.limit(limit).execute)).data
+
+class PostgresSource(KeysetSource):
+    """Reads sync rows straight from Postgres with asyncpg.
+
+    Rows are encoded by Postgres with row_to_json, as PostgREST does, so they
+    match what SupabaseSource returns. Point it at the database behind
+    Supabase (SYNC_DATABASE_URL) or at a local Postgres for testing.
+    """
+
+    def __init__(self, dsn: str, max_connections: int = 4):
+        self.dsn = dsn
+        self.max_connections = max_connections
+        self.pool = None
+
+    async def fetch_page(self, table: str, changes: bool, since, after, limit: int) -> list:
+        if self.pool is None:
+            import asyncpg
+            self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.max_connections)
+
+        mark = f't."{WATERMARK_COLUMN}"'
+        where, args = '', []
+        if not changes:
+            order = 't.id'
+            if after:
+                where, args = 'where t.id > $1', [after['id']]
+        else:
+            order = f'{mark}, t.id'
+            if after:
+                where, args = f'where ({mark}, t.id) > ($1::text::timestamptz, $2)', [after[WATERMARK_COLUMN], after['id']]
+            elif since:
+                where, args = f'where {mark} >= $1::text::timestamptz', [since]
+        sql = f'select row_to_json(t)::text from "{table}" t {where} order by {order} limit ${len(args) + 1}'
+        return [json.loads(record[0]) for record in await self.pool.fetch(sql, *args, limit)]
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+class InMemorySource(KeysetSource):
+    """In-memory stand-in for Supabase, for local runs and tests.
+
+    Rows are kept per table; upsert() and delete() stamp updated_at (and
+    deleted_at for tombstones) the same way the database triggers would.
+    """
+
+    def __init__(self, tables: dict = None):
+        self.tables = {name: [dict(row) for row in rows] for name, rows in (tables or {}).items()}
+
+    def upsert(self, table: str, row: dict, key: str = 'id'):
+        """Insert or replace a row and stamp its watermark column."""
+        row = {**row, WATERMARK_COLUMN: _now()}
+        rows = self.tables.setdefault(table, [])
+        for i, existing in enumerate(rows):
+            if existing.get(key) == row.get(key):
+                rows[i] = row
+                return row
+        rows.append(row)
+        return row
+
+    def delete(self, table: str, key_value, key: str = 'id'):
+        """Tombstone a row."""
+        for i, existing in enumerate(self.tables.get(table, [])):
+            if existing.get(key) == key_value:
+                stamp = _now()
+                self.tables[table][i] = {**existing, WATERMARK_COLUMN: stamp, 'deleted_at': stamp}
+
+    async def fetch_page(self, table: str, changes: bool, since, after, limit: int) -> list:
+        if changes:
+            key = lambda row: (row.get(WATERMARK_COLUMN) or '', row['id'])
+            rows = [row for row in self.tables.get(table, []) if not since or (row.get(WATERMARK_COLUMN) or '') >= since]
+        else:
+            key = lambda row: row['id']
+            rows = self.tables.get(table, [])
+        if after:
+            rows = [row for row in rows if key(row) > key(after)]
+        return [dict(row) for row in sorted(rows, key=key)[:limit]]
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from city_records import encode_city
+from redis_manager import apply_city_changes, city_index_members, plan_city_changes
+
+def city(city_id, name, state='Illinois', country='United States'):
+    return {'id': city_id, 'city': name, 'state': state, 'country': country, 'timezone': 'America/Chicago'}
+
+SPRINGFIELD_IL = city(1, 'Springfield')
+SPRINGFIELD_MA = city(2, 'Springfield', state='Massachusetts')
+
+def plan(upserts=None, deletes=(), stored=None, owners=None, namesakes=None):
+    upserts = upserts or {}
+    stored = stored or {}
+    ids = [*upserts, *deletes]
+    names = {row['city'] for row in [*upserts.values(), *stored.values()] if row}
+    return plan_city_changes(
+        upserts, set(deletes), {city_id: stored.get(city_id) for city_id in ids},
+        {name: (owners or {}).get(name) for name in names}, namesakes
+    )
+
+def test_unchanged_upsert_writes_nothing():
+    records, removed_ids, names, removed_names, added, removed, changed = plan(
+        {'1': SPRINGFIELD_IL}, stored={'1': SPRINGFIELD_IL}, owners={'Springfield': '1'}
+    )
+    assert (records, removed_ids, names, removed_names, added, removed, changed) == ({}, [], {}, [], [], [], [])
+
+def test_changed_field_rewrites_only_what_differs():
+    moved = {**SPRINGFIELD_IL, 'state': 'Ohio'}
+    records, _, names, removed_names, added, removed, _ = plan(
+        {'1': moved}, stored={'1': SPRINGFIELD_IL}, owners={'Springfield': '1'}
+    )
+    assert records == {'1': encode_city(moved)}
+    assert names == {} and removed_names == []
+    assert added == ['ohio\x0011'] and removed == ['illinois\x0011']
+
+def test_new_city_gets_its_name_and_members():
+    records, _, names, _, added, removed, _ = plan({'1': SPRINGFIELD_IL})
+    assert records == {'1': encode_city(SPRINGFIELD_IL)}
+    assert names == {'Springfield': '1'}
+    assert sorted(added) == sorted(city_index_members(SPRINGFIELD_IL)) and removed == []
+
+def test_rename_moves_the_name():
+    renamed = city(1, 'Capital City')
+    _, _, names, removed_names, _, _, _ = plan(
+        {'1': renamed}, stored={'1': SPRINGFIELD_IL}, owners={'Springfield': '1'}
+    )
+    assert names == {'Capital City': '1'}
+    assert removed_names == ['Springfield']
+
+def test_delete_removes_record_name_and_members():
+    _, removed_ids, names, removed_names, added, removed, _ = plan(
+        deletes=['1'], stored={'1': SPRINGFIELD_IL}, owners={'Springfield': '1'}
+    )
+    assert removed_ids == ['1'] and names == {} and removed_names == ['Springfield']
+    assert added == [] and sorted(removed) == sorted(city_index_members(SPRINGFIELD_IL))
+
+def test_deleting_a_city_that_does_not_own_its_name_keeps_the_name():
+    _, removed_ids, names, removed_names, _, _, _ = plan(
+        deletes=['1'], stored={'1': SPRINGFIELD_IL}, owners={'Springfield': '2'}
+    )
+    assert removed_ids == ['1'] and names == {} and removed_names == []
+
+def test_deleting_the_owner_hands_the_name_to_a_namesake():
+    _, removed_ids, names, removed_names, _, _, _ = plan(
+        deletes=['2'], stored={'2': SPRINGFIELD_MA}, owners={'Springfield': '2'},
+        namesakes={'Springfield': ['1', '2']}
+    )
+    assert removed_ids == ['2'] and names == {'Springfield': '1'} and removed_names == []
+
+def test_renaming_the_owner_hands_the_name_to_a_namesake():
+    renamed = {**SPRINGFIELD_MA, 'city': 'Springfield MA'}
+    _, _, names, removed_names, _, _, _ = plan(
+        {'2': renamed}, stored={'2': SPRINGFIELD_MA}, owners={'Springfield': '2'},
+        namesakes={'Springfield': ['1', '2']}
+    )
+    assert names == {'Springfield MA': '2', 'Springfield': '1'} and removed_names == []
+
+def test_namesakes_leaving_in_the_same_batch_are_skipped():
+    _, _, names, removed_names, _, _, _ = plan(
+        deletes=['1', '2'], stored={'1': SPRINGFIELD_IL, '2': SPRINGFIELD_MA}, owners={'Springfield': '2'},
+        namesakes={'Springfield': ['1', '2']}
+    )
+    assert names == {} and removed_names == ['Springfield']
+
+def test_same_id_upserted_and_deleted_is_rejected():
+    with pytest.raises(ValueError, match='both upserted and deleted'):
+        asyncio.run(apply_city_changes(upserts=[SPRINGFIELD_IL], deletes=['1']))
@@ -0,0 +1,53 @@
+import numpy as np
+
+# Packed search keys are (city_index << _CITY_SHIFT) + (epoch + _EPOCH_BIAS),
+# which keeps every city's transitions in one sorted array
+_CITY_SHIFT = 40
+_EPOCH_BIAS = 1 << 38
+
+class OffsetArrays:
+    """Transition tables for a fixed list of cities, packed for vectorized lookup."""
+
+    __slots__ = ('count', 'keys', 'offsets', 'dst', 'starts')
+
+    def __init__(self, tables: list):
+        lengths = np.fromiter((len(table.epochs) for table in tables), dtype=np.int64, count=len(tables))
+        city_index = np.repeat(np.arange(len(tables), dtype=np.int64), lengths)
+        epochs = np.concatenate([np.asarray(table.epochs, dtype=np.int64) for table in tables])
+
+        self.count = len(tables)
+        self.keys = (city_index << _CITY_SHIFT) + (epochs + _EPOCH_BIAS)
+        self.offsets = np.concatenate([np.asarray(table.offsets, dtype=np.int32) for table in tables])
+        self.dst = np.concatenate([np.asarray(table.dst, dtype=bool) for table in tables])
+        self.starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    def lookup(self, instants: np.ndarray):
+        """Return (offset_minutes, is_dst) arrays of shape (M, N) for M UTC epoch seconds."""
+        cities = np.arange(self.count, dtype=np.int64) << _CITY_SHIFT
+        query = cities[None, :] + (instants[:, None] + _EPOCH_BIAS)
+        pos = np.searchsorted(self.keys, query, side='right') - 1
+        # Instants before a city's first transition would land in the previous city
+        pos = np.maximum(pos, self.starts[None, :])
+        return self.offsets[pos], self.dst[pos]
+
+def instant_range(start: int, end: int, step_seconds: int) -> np.ndarray:
+    """UTC epoch seconds from start to end inclusive, every step_seconds."""
+    return np.arange(start, end + 1, step_seconds, dtype=np.int64)
+
+def convert_times(instants: np.ndarray, arrays: OffsetArrays) -> dict:
+    """Convert M UTC instants to local time in N cities in one vectorized pass.
+
+    Returns ISO-8601 strings for the instants (UTC) and the M x N local times,
+    plus the matching offsets (minutes) and DST flags, as nested lists.
+    """
+    offsets, dst = arrays.lookup(instants)
+    local = instants[:, None] + offsets.astype(np.int64) * 60
+    return {
+        'instants': np.char.add(_format(instants), 'Z').tolist(),
+        'local_times': _format(local).tolist(),
+        'utc_offsets': offsets.tolist(),
+        'dst': dst.tolist(),
+    }
+
+def _format(epochs: np.ndarray) -> np.ndarray:
+    return np.datetime_as_string(epochs.astype('datetime64[s]'), unit='s')
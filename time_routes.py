@@ -2,41 +2,29 @@ from datetime import datetime, timedelta
 import pytz
 from typing import List
 from models.location import LocationResponse
+from dst_transitions import compile_city_transitions, format_offset
+from clock import utc_now as clock_utc_now
 import logging
 
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('time_routes.log'),  # Log to a file
-        logging.StreamHandler()  # Log to the terminal
-    ]
-)
+def calculate_city_time(city_data: dict, utc_now: datetime = None, transitions=None) -> LocationResponse:
+    """Shared time calculation logic.
 
-def calculate_city_time(city_data: dict) -> LocationResponse:
-    """Shared time calculation logic."""
+    Pass the same utc_now when computing several cities so they agree, and
+    the city's precompiled TransitionTable (see dst_transitions) to skip
+    compiling one for this call.
+    """
     try:
-        # Get base UTC offset and normalize all possible minus signs
-        base_offset = city_data['utc_offset']
-        # Handle all variations of minus signs
-        if any(minus in base_offset for minus in ['\u2212', '−', '–', '—']):
-            base_offset = '-' + base_offset[1:]
-        
-        base_hours = int(base_offset.split(':')[0])
+        if utc_now is None:
+            utc_now = clock_utc_now()
         
-        # Check DST status
-        dst_offset = 0
-        if city_data.get('dst_status', 'No').lower() == 'yes':
-            dst_data = city_data.get('dst_data', {})
-            dst_offset = check_dst_status(dst_data)
+        if transitions is None:
+            transitions = compile_city_transitions(city_data, city_data.get('dst_data'), utc_now)
         
-        # Calculate total offset
-        total_offset = base_hours + dst_offset
+        # Resolve the total offset (in minutes) and DST flag with one bisect
+        total_offset, is_dst = transitions.lookup(utc_now.timestamp())
         
         # Calculate local time
-        utc_now = datetime.now(pytz.UTC)
-        local_time = utc_now + timedelta(hours=total_offset)
+        local_time = utc_now + timedelta(minutes=total_offset)
         
         return LocationResponse(
             city=city_data['city'],
@@ -44,10 +32,10 @@ def calculate_city_time(city_data: dict) -> LocationResponse:
             country=city_data['country'],
             timezone=city_data['timezone'],
             coordinates=city_data['coordinates'],
-            utc_offset=f"+{str(total_offset).zfill(2)}00" if total_offset >= 0 else f"{total_offset}00",
+            utc_offset=format_offset(total_offset),
             current_time=local_time.strftime('%H:%M:%S'),
             current_date=local_time.strftime('%A %d %B %Y'),
-            dst_status='Yes' if dst_offset > 0 else 'No',
+            dst_status='Yes' if is_dst else 'No',
             currency=city_data.get('currency'),
             languages_spoken=city_data.get('languages_spoken'),
             country_code=city_data.get('country_code'),
@@ -58,12 +46,13 @@ def calculate_city_time(city_data: dict) -> LocationResponse:
         logging.error(f"Time calculation error: {str(e)}", exc_info=True)
         raise
 
-def check_dst_status(dst_data: dict) -> int:
+def check_dst_status(dst_data: dict, current_time: datetime = None) -> int:
     """
     Check if DST is currently active for a city based on dst_offsets table.
     """
     try:
-        current_time = datetime.now(pytz.UTC)
+        if current_time is None:
+            current_time = clock_utc_now()
         
         # Parse DST dates correctly
         dst_start = datetime.strptime(f"{dst_data['dst_start']} {dst_data['dst_start_time']}", 